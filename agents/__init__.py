@@ -1,6 +1,66 @@
-from .agent_q1_q2_q3 import *
-from .agent_rl import *
-from .agent_minimax import *
-from .helper_functions import *
+# The submodules are imported the first time one of their names is used
+# (PEP 562), so the heuristic agents load without torch, stable_baselines3
+# or kaggle_environments: `agents.agent_q3` only imports agent_q1_q2_q3 and
+# the modules it needs, `agents.agent_rl` brings in the RL stack.
+#
+# The public names of a submodule are the ones of its __all__, read from the
+# source without importing it: a name added to a submodule's __all__ (or a
+# new submodule with an __all__) is reachable from the package as is.
+# `from agents import *` imports every submodule and binds these names only.
+import ast
+import importlib
+import pkgutil
+from pathlib import Path
 
-# import agent_q1_q2_q3,agent_minimax,helper_functions
\ No newline at end of file
+_NAMES = None
+
+
+def _public_names(path):
+    ''' Returns the names listed in the __all__ of a source file, or None '''
+    for node in ast.parse(Path(path).read_text(encoding="utf-8")).body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == "__all__" for target in node.targets):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def _names():
+    ''' Returns the submodule of every public name, built on first use '''
+    global _NAMES
+    if _NAMES is None:
+        names = {}
+        for module in pkgutil.iter_modules(__path__):
+            if module.ispkg:
+                continue
+            public = _public_names(Path(module.module_finder.path) / f"{module.name}.py")
+            for name in public or ():
+                names.setdefault(name, module.name)
+        _NAMES = names
+    return _NAMES
+
+
+def _load(name):
+    module = importlib.import_module(f".{_names()[name]}", __name__)
+    value = getattr(module, name)
+    # Also replaces the submodule the import bound to the package when the
+    # name is the one of its module (agent_rl, agent_minimax, ...)
+    globals()[name] = value
+    return value
+
+
+def __getattr__(name):
+    if name == "__all__":
+        # Asked by `from agents import *`, which then binds every name
+        for public in _names():
+            _load(public)
+        return sorted(_names())
+    if name in _names():
+        return _load(name)
+    if any(module.name == name for module in pkgutil.iter_modules(__path__)):
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    submodules = [module.name for module in pkgutil.iter_modules(__path__)]
+    return sorted(set(globals()) | set(submodules) | set(_names()))
@@ -0,0 +1,84 @@
+#%%
+import random
+import time
+
+from .bitboard import *
+from .helper_functions import *
+from .mcts import *
+from .profiling import *
+
+__all__ = ["MCTS_TIME_MARGIN", "get_mcts", "select_move_mcts", "agent_mcts"]
+
+# Seconds of config.actTimeout left unused, for the overhead around the search
+MCTS_TIME_MARGIN = 0.5
+
+# Trees kept between the moves of a game, one per game configuration
+_TREES = {}
+
+
+def get_mcts(config):
+    ''' Returns the (cached) MCTS of the game configuration, so its tree is reused from move to move '''
+    key = (config.rows, config.columns, config.inarow)
+    if key not in _TREES:
+        _TREES[key] = MCTS(config)
+    return _TREES[key]
+
+
+def select_move_mcts(obs, config, n_playouts=None, time_margin=MCTS_TIME_MARGIN, tree=None):
+    """Selects the most visited move of a Monte Carlo tree search
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+    n_playouts : int, optional
+        Fixed number of playouts, by default None: search until
+        config.actTimeout - time_margin seconds have passed.
+    time_margin : float, optional
+        Seconds of the move time kept free, by default MCTS_TIME_MARGIN.
+    tree : MCTS, optional
+        The search, by default the one of get_mcts, which keeps its tree
+        between moves.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    start = time.perf_counter()
+    pos = Position.from_board(obs.board, config)
+    if tree is None:
+        tree = get_mcts(config)
+    playouts = tree.playouts
+    deadline = None
+    if n_playouts is None:
+        deadline = start + getattr(config, 'actTimeout', 2) - time_margin
+    tree.search(pos, deadline, n_playouts)
+    if PROFILER.enabled:
+        PROFILER.add(playouts=tree.playouts - playouts, playouts_per_second=tree.playouts_per_second,
+                     nodes=tree.n_nodes)
+    return random.choice(tree.best_moves())
+
+
+@profiled
+def agent_mcts(obs, config):
+    """Selects move with Monte Carlo tree search (UCT), searching for as long as the move time allows
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_mcts(obs, config)
+# %%
@@ -1,9 +1,40 @@
  
 #%%
+import os
+import random
+import time
+
+from .bitboard import *
 from .helper_functions import *
+from .search import *
+from .profiling import *
+from .opening_book import *
+from .solver import *
+from .parallel_search import *
+from .transposition import *
 
-def agent_minimax(obs, config):
-    """Selects move using minimax algorithm
+__all__ = [
+    "TRANSPOSITION_TABLE", "TIME_MARGIN", "SOLVER_EMPTY_CELLS", "PARALLEL_WORKERS", "select_move_minimax",
+    "agent_minimax_parallel", "agent_minimax"
+]
+
+# Kept between moves, so the positions searched on previous turns are reused
+TRANSPOSITION_TABLE = TranspositionTable(max_mb=64)
+
+# Seconds of config.actTimeout left unused, for the overhead around the search
+TIME_MARGIN = 0.5
+
+# Positions with at most this many empty cells are solved exactly, if it takes
+# less than half of the move time
+SOLVER_EMPTY_CELLS = 24
+
+# Processes searching the root moves of agent_minimax_parallel
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+
+def select_move_minimax(obs, config, n_steps=None, time_margin=TIME_MARGIN, table=TRANSPOSITION_TABLE,
+                        book=OPENING_BOOK, tablebase=TABLEBASE, solver_empty_cells=SOLVER_EMPTY_CELLS, n_workers=1):
+    """Scores the moves with alpha-beta search, at a fixed depth or within a time budget
 
     Parameters
     ----------
@@ -11,6 +42,25 @@ def agent_minimax(obs, config):
         The observation object containing the game board information. 
     config : dict 
         A dictionary containing the configuration parameters of the game.
+    n_steps : int, optional
+        Fixed search depth, by default None: deepen iteratively until
+        config.actTimeout - time_margin seconds have passed.
+    time_margin : float, optional
+        Seconds of the move time kept free, by default TIME_MARGIN.
+    table : TranspositionTable, optional
+        Transposition table of the search, by default TRANSPOSITION_TABLE.
+    book : OpeningBook, optional
+        Book played from when it holds the position, by default OPENING_BOOK.
+        Not used at a fixed depth.
+    tablebase : OpeningBook, optional
+        Solved positions played from, by default TABLEBASE. Not used at a
+        fixed depth.
+    solver_empty_cells : int, optional
+        Solve the positions with at most this many empty cells, by default
+        SOLVER_EMPTY_CELLS. Not used at a fixed depth.
+    n_workers : int, optional
+        Processes searching the root moves in parallel (see ParallelSearch),
+        by default 1: the search runs in this process, with table.
 
     
     Returns
@@ -18,16 +68,88 @@ def agent_minimax(obs, config):
     int
         Column selected by the agent
     """
-    N_STEPS = 3
-
-    # Get list of valid moves
-    valid_moves = [c for c in range(config.columns) if obs.board[c] == 0]
-    # Convert the board to a 2D grid
-    grid = np.asarray(obs.board).reshape(config.rows, config.columns)
-    # Use the heuristic to assign a score to each possible board in the next step
-    scores = dict(zip(valid_moves, [score_move(grid, col, obs.mark, config, N_STEPS) for col in valid_moves]))
+    start = time.perf_counter()
+
+    # Convert the board to a bitboard position
+    pos = Position.from_board(obs.board, config)
+    if n_steps is None:
+        budget = getattr(config, 'actTimeout', 2) - time_margin
+        # Play the best moves of the book in the opening, of the tablebase later on
+        col = book_move(pos, book, tablebase)
+        if col is not None:
+            return col
+        # Play perfectly near the end of the game
+        solver = get_solver(config)
+        if solver is not None and config.rows*config.columns - pos.n_moves <= solver_empty_cells:
+            try:
+                scores = solver.score_moves(pos, deadline=start + budget/2)
+                if PROFILER.enabled:
+                    PROFILER.add(solved=1)
+                return random.choice(get_best_moves(scores))
+            except SearchTimeout:
+                pass
+    # Use alpha-beta search to assign a score to each possible board in the next step
+    if n_workers > 1:
+        # The workers have their own tables, kept between moves with the pool
+        search = get_parallel_search(config, n_workers)
+        search.nodes = search.leaves = 0
+        search.new_search()
+        table = None
+    else:
+        if table is not None:
+            table.new_search()
+        search = AlphaBetaSearch(config, table)
+    hits = table.hits if table is not None else 0
+    if n_steps is None:
+        deadline = start + budget
+        scores, depth = search.iterative_deepening(pos, obs.mark, deadline)
+    else:
+        scores, depth = search.score_moves(pos, n_steps, obs.mark), n_steps
+    if PROFILER.enabled:
+        PROFILER.add(nodes=search.nodes, leaves=search.leaves, depth=depth,
+                     cache_hits=table.hits - hits if table is not None else 0)
     # Get a list of columns (moves) that maximize the heuristic
-    max_cols = [key for key in scores.keys() if scores[key] == max(scores.values())]
+    max_cols = get_best_moves(scores)
     # Select at random from the maximizing columns
     return random.choice(max_cols)
+
+
+@profiled
+def agent_minimax_parallel(obs, config):
+    """Selects move like agent_minimax, the root moves being searched by PARALLEL_WORKERS processes
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_minimax(obs, config, n_workers=PARALLEL_WORKERS)
+
+
+@profiled
+def agent_minimax(obs, config):
+    """Selects move using minimax algorithm, searching as deep as the move time allows
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_minimax(obs, config)
 # %%
@@ -0,0 +1,120 @@
+#%%
+import random
+import time
+
+from .bitboard import *
+from .helper_functions import *
+from .model_registry import *
+from .opening_book import *
+from .profiling import *
+from .puct import *
+from .solver import *
+from .submission import *
+
+__all__ = ["PUCT_TIME_MARGIN", "NUMPY_POLICY_REGISTRY", "get_puct", "select_move_puct", "agent_puct"]
+
+# Seconds of config.actTimeout left unused, for the overhead around the search
+PUCT_TIME_MARGIN = 0.5
+
+# Policies of the checkpoints as NumpyPolicy, reloaded when a checkpoint changes
+NUMPY_POLICY_REGISTRY = ModelRegistry(loader=load_numpy_policy)
+
+# Trees kept between the moves of a game, per checkpoint version and game configuration
+_TREES = {}
+
+
+def get_puct(config, path=CHECKPOINT_PATH):
+    ''' Returns the (cached) PUCT search of a checkpoint, so its tree is reused from move to move
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    path : Path, optional
+        PPO checkpoint, by default CHECKPOINT_PATH.
+
+    Returns:
+    --------
+    PUCT
+        The search shared by the agents of this process. A new one is made
+        when the checkpoint is replaced.
+    '''
+    network = NUMPY_POLICY_REGISTRY.get(path)
+    key = (NUMPY_POLICY_REGISTRY.version(path), config.rows, config.columns, config.inarow)
+    if key not in _TREES:
+        _TREES.clear()
+        _TREES[key] = PUCT(config, network)
+    return _TREES[key]
+
+
+def select_move_puct(obs, config, path=CHECKPOINT_PATH, n_simulations=None, time_margin=PUCT_TIME_MARGIN, tree=None,
+                     book=OPENING_BOOK, tablebase=TABLEBASE):
+    """Selects the most visited move of a PUCT search guided by the policy of a PPO checkpoint
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+    path : Path, optional
+        Checkpoint of the policy, by default CHECKPOINT_PATH.
+    n_simulations : int, optional
+        Fixed number of leaves evaluated, by default None: search until
+        config.actTimeout - time_margin seconds have passed.
+    time_margin : float, optional
+        Seconds of the move time kept free, by default PUCT_TIME_MARGIN.
+    tree : PUCT, optional
+        The search, by default the one of get_puct, which keeps its tree
+        between moves.
+    book : OpeningBook, optional
+        Book played from when it holds the position, by default OPENING_BOOK.
+    tablebase : OpeningBook, optional
+        Solved positions played from, by default TABLEBASE.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    start = time.perf_counter()
+    pos = Position.from_board(obs.board, config)
+    # Play the best moves of the book in the opening, of the tablebase later on
+    col = book_move(pos, book, tablebase)
+    if col is not None:
+        return col
+
+    if tree is None:
+        tree = get_puct(config, path)
+    playouts = tree.playouts
+    deadline = None
+    if n_simulations is None:
+        deadline = start + getattr(config, 'actTimeout', 2) - time_margin
+    tree.search(pos, deadline, n_simulations)
+    if PROFILER.enabled:
+        PROFILER.add(playouts=tree.playouts - playouts, playouts_per_second=tree.playouts_per_second,
+                     nodes=tree.n_nodes)
+    return random.choice(tree.best_moves())
+
+
+@profiled
+def agent_puct(obs, config):
+    """Selects move with a PUCT search guided by the PPO policy and value networks
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_puct(obs, config)
+# %%
@@ -1,8 +1,15 @@
 #%%
+import random
+
+from .bitboard import *
 from .helper_functions import *
+from .profiling import *
+
+__all__ = ["agent_q1", "agent_q2", "agent_q3"]
 
 # %%
 
+@profiled
 def agent_q1(obs, config):
     """Selects a winning move if exists, otherwise selects  random
 
@@ -21,9 +28,11 @@ def agent_q1(obs, config):
     """    
     
 
-    valid_moves = [col for col in range(config.columns) if obs.board[col] == 0]
+    pos = Position.from_board(obs.board, config)
 
-    winning_moves = [col for col in valid_moves if check_winning_move(obs, config, col, piece=obs.mark)]
+    valid_moves = pos.valid_moves()
+
+    winning_moves = [col for col in valid_moves if pos.is_winning_move(col, obs.mark)]
 
     
     if not winning_moves:
@@ -35,6 +44,7 @@ def agent_q1(obs, config):
     
     
 
+@profiled
 def agent_q2(obs, config):
     """Selects a winning move if available, 
     otherwise selects the winning move of the opponent,
@@ -53,13 +63,15 @@ def agent_q2(obs, config):
     int
         Column selected by the agent
     """
-    valid_moves = [col for col in range(config.columns) if obs.board[col] == 0]
+    pos = Position.from_board(obs.board, config)
+
+    valid_moves = pos.valid_moves()
     
-    winning_moves = [col for col in valid_moves if check_winning_move(obs, config, col, piece=obs.mark)]
+    winning_moves = [col for col in valid_moves if pos.is_winning_move(col, obs.mark)]
     
     opponet_mark = 1 if obs.mark == 2 else 2
     
-    winning_moves_opp = [col for col in valid_moves if check_winning_move(obs, config, col, piece=opponet_mark)]
+    winning_moves_opp = [col for col in valid_moves if pos.is_winning_move(col, opponet_mark)]
     
     
     if winning_moves:
@@ -73,6 +85,7 @@ def agent_q2(obs, config):
     
 
 
+@profiled
 def agent_q3(obs, config):
     """Selects a winning move if available, 
     otherwise selects the winning move of the opponent,
@@ -92,28 +105,23 @@ def agent_q3(obs, config):
         Column selected by the agent
     """
 
-    valid_moves = [col for col in range(config.columns) if obs.board[col] == 0]
+    pos = Position.from_board(obs.board, config)
+
+    valid_moves = pos.valid_moves()
     
-    winning_moves = [col for col in valid_moves if check_winning_move(obs, config, col, piece=obs.mark)]
+    winning_moves = [col for col in valid_moves if pos.is_winning_move(col, obs.mark)]
     
     opponet_mark = 1 if obs.mark == 2 else 2
     
-    winning_moves_opp = [col for col in valid_moves if check_winning_move(obs, config, col, piece=opponet_mark)]
+    winning_moves_opp = [col for col in valid_moves if pos.is_winning_move(col, opponet_mark)]
     
     no_play_moves=[]
-    
-    class tempclass:
-        def __init__(self, board):
-            self.board = board
 
-    
     for move in valid_moves:
-        grid = np.asarray(obs.board).reshape(config.rows, config.columns)
-        next_grid = drop_piece(grid, move, obs.mark, config)
-        next_board=next_grid.flatten()
-        next_obs=tempclass(next_board)
-        if check_winning_move(next_obs, config, move, piece=opponet_mark):
+        pos.play(move, obs.mark)
+        if pos.can_play(move) and pos.is_winning_move(move, opponet_mark):
             no_play_moves.append(move)
+        pos.undo()
             
         
     
@@ -1,6 +1,8 @@
  
 #%%
+import random
 import sys
+import time
 from pathlib import Path # if you haven't already done so
 file = Path(__file__).resolve()
 parent, root = file.parent, file.parents[2]
@@ -11,12 +13,21 @@ sys.path.append(str(root))
 
 
 #%%
+import numpy as np
 
-from helper_functions import *
+from .bitboard import *
+from .helper_functions import *
+from .model_registry import *
+from .profiling import *
+from .opening_book import *
+from .solver import *
+from .policy_cache import *
 
 #%%
 from connect4_drl.config import *
 
+__all__ = ["VERBOSE", "select_move_rl", "agent_rl", "agent_rl_book", "make_agent_rl"]
+
 #%%
 
 #%%
@@ -74,8 +85,12 @@ from connect4_drl.config import *
 # env = ConnectFourGym(agent2="random")
 
 
-def agent_rl(obs, config):
-    """Use a reinforcement learning agent to select the moves
+# Print the model input and the selected column at every move
+VERBOSE = False
+
+
+def select_move_rl(obs, config, path=None, book=None, tablebase=None, cache=POLICY_CACHE):
+    """Selects a move with the policy of a PPO checkpoint
 
     Parameters
     ----------
@@ -83,6 +98,17 @@ def agent_rl(obs, config):
         The observation object containing the game board information. 
     config : dict 
         A dictionary containing the configuration parameters of the game.
+    path : Path, optional
+        Checkpoint of the policy, by default MODELS_DIR / "ppo".
+    book : OpeningBook, optional
+        Book played from when it holds the position, e.g. OPENING_BOOK, by
+        default None: the policy plays every move, so the ratings and
+        evaluations of a checkpoint measure the network alone.
+    tablebase : OpeningBook, optional
+        Solved positions played from, e.g. TABLEBASE, by default None.
+    cache : PolicyCache, optional
+        Cache of the action probabilities of the boards, by default
+        POLICY_CACHE. None runs model.predict on every move.
 
     
     Returns
@@ -91,46 +117,106 @@ def agent_rl(obs, config):
         Column selected by the agent
     """
 
+    # Play the best moves of the book in the opening, of the tablebase later on
+    if book is not None or tablebase is not None:
+        col = book_move(Position.from_board(obs['board'], config), book, tablebase)
+        if col is not None:
+            return col
 
+    # Use the best model to select a column
     try:
-        model = PPO.load(MODELS_DIR / "ppo")
-    except Exception as e:
-        print(f"Failed to load model: {e}")
-
-
-
-     # Use the best model to select a column
-
-    try:
+        # Loaded once per process and kept in memory
+        path = MODELS_DIR / "ppo" if path is None else path
+        model = MODEL_REGISTRY.get(path)
         input_data = np.array(obs['board']).reshape(1, 6, 7)
-        print(f"Input shape: {input_data.shape}, Input type: {input_data.dtype}")
-        col, _ = model.predict(input_data)
-
+        start = time.perf_counter()
+        if cache is None:
+            col, _ = model.predict(input_data)
+        else:
+            # Drawn from the distribution of model.predict (with NumPy's generator, not
+            # torch's), the forward pass being skipped for boards already seen
+            hits = cache.hits
+            probabilities = cache.probabilities(model, MODEL_REGISTRY.version(path), obs['board'], obs['mark'])
+            col = np.random.choice(len(probabilities), p=probabilities)
+        if PROFILER.enabled:
+            PROFILER.add(inference_time=time.perf_counter() - start)
+            if cache is not None:
+                PROFILER.add(cache_hits=cache.hits - hits)
+        if VERBOSE:
+            print(f"Input shape: {input_data.shape}, Input type: {input_data.dtype}")
+            print(col)
     except Exception as e:
-        print(f"Failed to load model: {e}")
+        print(f"Failed to use model: {e}")
+        col = None
 
-    
-    print(col)
-    print(col)
-    print(col)
     # Check if selected column is valid
-    is_valid = (obs['board'][int(col)] == 0)
+    is_valid = col is not None and (obs['board'][int(col)] == 0)
     # If not valid, select random move. 
     if is_valid:
         return int(col)
     else:
         return random.choice([col for col in range(config.columns) if obs.board[int(col)] == 0])
-# %%
-# %%
 
-import sys
 
+@profiled
+def agent_rl(obs, config):
+    """Use a reinforcement learning agent to select the moves
 
-# %%
-sys.path
-# %%
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
 
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_rl(obs, config)
 
 
-from config import BASE_DIR
+@profiled
+def agent_rl_book(obs, config):
+    """agent_rl playing from OPENING_BOOK in the opening and from TABLEBASE later on
+
+    Parameters
+    ----------
+    obs : object 
+        The observation object containing the game board information. 
+    config : dict 
+        A dictionary containing the configuration parameters of the game.
+
+    
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return select_move_rl(obs, config, book=OPENING_BOOK, tablebase=TABLEBASE)
+
+
+def make_agent_rl(path, book=None, tablebase=None):
+    """Builds an agent_rl playing with the policy of another checkpoint
+
+    Parameters
+    ----------
+    path : Path or str
+        Checkpoint of the policy, e.g. one saved by train_agent_rl.py.
+    book : OpeningBook, optional
+        Book played from, by default None (the policy plays every move).
+    tablebase : OpeningBook, optional
+        Solved positions played from, by default None.
+
+    Returns
+    -------
+    function
+        The agent, taking (obs, config).
+    """
+    def agent_rl_checkpoint(obs, config):
+        return select_move_rl(obs, config, path, book, tablebase)
+    agent_rl_checkpoint.__name__ = f"agent_rl[{Path(path).name}]"
+    return profiled(agent_rl_checkpoint)
 # %%
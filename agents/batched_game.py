@@ -0,0 +1,240 @@
+#%%
+import numpy as np
+
+try:
+    from .windows import *
+except ImportError:
+    from windows import *
+
+__all__ = ["BatchedBoards", "random_valid_moves", "tactical_moves", "swap_marks"]
+
+
+###########################################################
+### Many games stepped together as one array
+###########################################################
+
+class BatchedBoards:
+    ''' B Connect Four boards stored as one array and played with vectorized operations
+
+    The moves of all the boards are applied with fancy indexing, and wins
+    are detected by checking, for every board, only the windows that
+    contain the cell just played (at most 16 on the default board).
+
+    Parameters:
+    -----------
+    n_boards : int
+        Number of boards B.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+    '''
+    def __init__(self, n_boards, config):
+        self.n_boards = n_boards
+        self.rows = config.rows
+        self.columns = config.columns
+        self.size = config.rows * config.columns
+        self.inarow = config.inarow
+        # One extra cell per board, always -1: padding of the window table
+        self.cells = np.zeros((n_boards, self.size + 1), dtype=np.int8)
+        self.cells[:, self.size] = -1
+        # (B, rows, columns) view of the boards, laid out as obs.board
+        self.grids = self.cells[:, :self.size].reshape(n_boards, self.rows, self.columns)
+        self.heights = np.zeros((n_boards, self.columns), dtype=np.int8)
+        self.n_moves = np.zeros(n_boards, dtype=np.int16)
+        self._index = np.arange(n_boards)
+
+        # Windows containing each cell, padded with a window of the extra cell
+        windows = get_window_indices(config)
+        windows = np.vstack([windows, np.full((1, windows.shape[1]), self.size)])
+        cell_windows = [[w for w in range(len(windows) - 1) if cell in windows[w]] for cell in range(self.size)]
+        width = max(len(w) for w in cell_windows)
+        # The row of the extra cell only holds the padding window
+        padded = np.full((self.size + 1, width), len(windows) - 1)
+        for cell, w in enumerate(cell_windows):
+            padded[cell, :len(w)] = w
+        # (n_cells + 1, width, inarow) cells of the windows through every cell
+        self.cell_windows = windows[padded]
+
+    def reset(self, boards=None):
+        ''' Empties all the boards, or only the selected ones
+
+        Parameters:
+        -----------
+        boards : numpy array, optional
+            Indices (or boolean mask) of the boards to reset, by default all.
+        '''
+        if boards is None:
+            boards = slice(None)
+        self.cells[boards, :self.size] = 0
+        self.heights[boards] = 0
+        self.n_moves[boards] = 0
+
+    def load(self, boards):
+        ''' Sets the first boards to the given kaggle boards (obs.board)
+
+        Parameters:
+        -----------
+        boards : list
+            At most B boards, flattened row-major with the top row first.
+        '''
+        n = len(boards)
+        self.cells[:n, :self.size] = np.asarray(boards, dtype=np.int8).reshape(n, self.size)
+        self.heights[:n] = (self.grids[:n] != 0).sum(axis=1)
+        self.n_moves[:n] = self.heights[:n].sum(axis=1)
+
+    def valid_moves(self, boards=None):
+        ''' Returns a (B, columns) boolean array of the columns that are not full '''
+        heights = self.heights if boards is None else self.heights[boards]
+        return heights < self.rows
+
+    def winning_moves(self, mark, boards=None, above=False):
+        ''' Returns a (n, columns) boolean array of the columns where mark would complete a line
+
+        Parameters:
+        -----------
+        mark : int or numpy array
+            The value of the pieces, one per selected board or for all.
+
+        boards : numpy array, optional
+            Indices of the boards, by default all.
+
+        above : bool, optional
+            Check the cell above the next free cell of each column instead,
+            the one the opponent gets after a move in the column, by default
+            False.
+
+        Returns:
+        --------
+        numpy array
+            True for the columns where the piece completes a line.
+        '''
+        return self._completes(self._window_values(boards, above), mark)
+
+    def _window_values(self, boards, above=False):
+        # (n, columns, width, inarow) values of the windows through the next free cell of each column
+        if boards is None:
+            boards = self._index
+        heights = self.heights[boards].astype(np.intp) + above
+        cells = np.where(heights < self.rows, (self.rows - 1 - heights) * self.columns + np.arange(self.columns),
+                         self.size)
+        return self.cells[boards[:, None, None, None], self.cell_windows[cells]]
+
+    def _completes(self, values, mark):
+        # The cells being empty, a window is completed when all its other cells hold mark
+        own = (values == np.reshape(mark, (-1, 1, 1, 1))).sum(axis=-1, dtype=np.int8)
+        return (own == self.inarow - 1).any(axis=-1)
+
+    def play(self, cols, mark, boards=None):
+        ''' Drops one piece in each selected board
+
+        Parameters:
+        -----------
+        cols : numpy array
+            Column played in each board. The columns must not be full.
+
+        mark : int or numpy array
+            The value of the pieces.
+
+        boards : numpy array, optional
+            Indices of the boards where the pieces are dropped, by default all.
+
+        Returns:
+        --------
+        won : numpy array
+            True for the boards where the move wins the game.
+
+        full : numpy array
+            True for the boards that are full after the move.
+        '''
+        if boards is None:
+            boards = self._index
+        cols = np.asarray(cols)
+        cells = (self.rows - 1 - self.heights[boards, cols]) * self.columns + cols
+        self.cells[boards, cells] = mark
+        self.heights[boards, cols] += 1
+        self.n_moves[boards] += 1
+        # (n, width, inarow) values of the windows through the played cells
+        values = self.cells[boards[:, None, None], self.cell_windows[cells]]
+        won = (values == np.reshape(mark, (-1, 1, 1))).all(axis=-1).any(axis=-1)
+        full = self.n_moves[boards] == self.size
+        return won, full
+
+
+def random_valid_moves(valid, rng):
+    ''' Samples one valid column per board, uniformly
+
+    Parameters:
+    -----------
+    valid : numpy array
+        (n, columns) boolean array of the valid columns.
+
+    rng : numpy.random.Generator
+        Random generator.
+
+    Returns:
+    --------
+    numpy array
+        The sampled columns.
+    '''
+    u = rng.random(valid.shape)
+    u[~valid] = -1
+    return u.argmax(axis=1)
+
+
+def tactical_moves(batch, valid, marks, rng, boards=None):
+    ''' Samples one column per board with the rules of agent_q3, vectorized
+
+    A winning move if there is one, otherwise a move blocking a win of the
+    opponent, otherwise a move that does not give the opponent a win on top
+    of it, otherwise any valid move, drawn uniformly at each step.
+
+    Parameters:
+    -----------
+    batch : BatchedBoards
+        The boards.
+
+    valid : numpy array
+        (n, columns) boolean array of the valid columns of the selected boards.
+
+    marks : numpy array
+        Mark of the player to move on each selected board.
+
+    rng : numpy.random.Generator
+        Random generator.
+
+    boards : numpy array, optional
+        Indices of the boards, by default all.
+
+    Returns:
+    --------
+    numpy array
+        The sampled columns.
+    '''
+    opponents = 3 - np.asarray(marks)
+    values = batch._window_values(boards)
+    wins = batch._completes(values, marks) & valid
+    blocks = batch._completes(values, opponents) & valid
+    safe = valid & ~batch.winning_moves(opponents, boards, above=True)
+    choice = valid
+    for moves in (safe, blocks, wins):
+        choice = np.where(moves.any(axis=1, keepdims=True), moves, choice)
+    return random_valid_moves(choice, rng)
+
+
+def swap_marks(grids):
+    ''' Returns the grids with the pieces of the two players exchanged
+
+    Lets a policy trained as player 1 play as player 2.
+
+    Parameters:
+    -----------
+    grids : numpy array
+        Grids with values 0, 1 and 2.
+
+    Returns:
+    --------
+    numpy array
+        Grids where 1 and 2 are exchanged.
+    '''
+    return np.where(grids == 0, 0, 3 - grids).astype(grids.dtype)
+# %%
@@ -0,0 +1,265 @@
+#%%
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from .bitboard import *
+from .helper_functions import *
+from .mcts import *
+from .agent_q1_q2_q3 import *
+from .agent_minimax import *
+from .agent_mcts import *
+from .agent_rl import *
+from .game import *
+
+
+###########################################################
+### Benchmarks of the helper functions and agents
+###########################################################
+
+# Stored results the benchmarks are compared with
+BASELINE_PATH = Path(__file__).resolve().parents[1] / "benchmarks" / "baseline.json"
+
+# Plies of the positions of each phase of the corpus
+PHASES = {'opening': (2, 8), 'midgame': (14, 22), 'endgame': (30, 38)}
+
+
+class BenchmarkRegression(AssertionError):
+    ''' Raised when a benchmark is slower than its baseline by more than the tolerance '''
+
+
+def make_corpus(n_per_phase=20, seed=0, config=DEFAULT_CONFIG):
+    ''' Builds the fixed corpus of positions of the benchmarks
+
+    The positions come from games of random moves that are stopped after a
+    number of plies drawn in each phase (PHASES), skipping finished games.
+    Only random.Random is used, so the corpus is the same on every machine.
+
+    Parameters:
+    -----------
+    n_per_phase : int, optional
+        Number of positions of each phase, by default 20.
+
+    seed : int, optional
+        Seed of the corpus, by default 0.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    Returns:
+    --------
+    dict
+        phase -> list of (grid, mark), mark being the player to move.
+    '''
+    rng = random.Random(seed)
+    corpus = {}
+    for phase, (low, high) in PHASES.items():
+        positions = []
+        while len(positions) < n_per_phase:
+            pos = Position(config)
+            n_plies = rng.randint(low, high)
+            while pos.n_moves < n_plies and not pos.is_terminal():
+                pos.play(rng.choice(pos.valid_moves()))
+            if pos.n_moves == n_plies and not pos.is_terminal():
+                positions.append((pos.to_grid(), pos.mark))
+        corpus[phase] = positions
+    return corpus
+
+
+def _benchmark_cases(config, agents):
+    # name -> function of one position (grid, mark, obs), run on every position of the corpus
+    cases = {
+        'drop_piece': lambda grid, mark, obs: drop_piece(grid, 3, mark, config),
+        'check_winning_move': lambda grid, mark, obs: check_winning_move(obs, config, 3, mark),
+        'count_windows': lambda grid, mark, obs: count_windows(grid, 3, mark, config),
+        'get_heuristic': lambda grid, mark, obs: get_heuristic(grid, mark, config),
+        'is_terminal_node': lambda grid, mark, obs: is_terminal_node(grid, config),
+        'minimax_depth3': lambda grid, mark, obs: minimax(grid, 3, False, mark, config),
+    }
+    for name in agents:
+        if name == 'agent_minimax':
+            # Fixed depth and no table kept between moves, so the work done is the same every time
+            cases['agent_minimax_depth4'] = lambda grid, mark, obs: select_move_minimax(obs, config, n_steps=4,
+                                                                                          table=None)
+        elif name == 'agent_mcts':
+            # Fixed number of playouts from a new tree every time
+            cases['agent_mcts_256'] = lambda grid, mark, obs: select_move_mcts(obs, config, n_playouts=256,
+                                                                              tree=MCTS(config, capacity=2**14, seed=0))
+        else:
+            agent = get_agent(name)
+            cases[name] = lambda grid, mark, obs, agent=agent: agent(obs, config)
+    return cases
+
+
+def _measure(function, positions, min_time):
+    # Best rate over 3 repeats of at least min_time seconds each, and peak memory of one pass
+    rates = []
+    for _ in range(3):
+        n_ops, start = 0, time.perf_counter()
+        while True:
+            for grid, mark, obs in positions:
+                function(grid, mark, obs)
+            n_ops += len(positions)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        rates.append(n_ops / elapsed)
+    tracemalloc.start()
+    for grid, mark, obs in positions:
+        function(grid, mark, obs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return max(rates), peak / 1024
+
+
+def run_benchmarks(names=None, agents=('agent_q1', 'agent_q2', 'agent_q3', 'agent_minimax'), min_time=0.2,
+                   n_per_phase=20, config=DEFAULT_CONFIG):
+    ''' Times the helper functions and agents over the corpus
+
+    Parameters:
+    -----------
+    names : list, optional
+        Only run these benchmarks, by default all.
+
+    agents : tuple, optional
+        Agents whose moves are timed, by default agent_q1, agent_q2, agent_q3
+        and agent_minimax (at depth 4). agent_rl can be added when its
+        checkpoint is available, agent_mcts (at 256 playouts) as well.
+
+    min_time : float, optional
+        Minimum duration of each of the 3 repeats, by default 0.2 seconds.
+
+    n_per_phase : int, optional
+        Number of positions of each phase of the corpus, by default 20.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    Returns:
+    --------
+    dict
+        benchmark -> ops_per_sec (calls, or moves for the agents, per second
+        over the whole corpus), ops_per_sec of every phase, and peak_kb (peak
+        memory allocated during one pass over the corpus).
+    '''
+    corpus = make_corpus(n_per_phase, config=config)
+    corpus = {phase: [(grid, mark, Struct(board=list(grid.flatten()), mark=mark, step=int((grid != 0).sum())))
+                      for grid, mark in positions] for phase, positions in corpus.items()}
+    everything = [position for positions in corpus.values() for position in positions]
+    results = {}
+    for name, function in _benchmark_cases(config, agents).items():
+        if names is not None and name not in names:
+            continue
+        random.seed(0)
+        rate, peak_kb = _measure(function, everything, min_time)
+        results[name] = {'ops_per_sec': rate, 'peak_kb': peak_kb}
+        for phase, positions in corpus.items():
+            results[name][f'ops_per_sec_{phase}'] = _measure(function, positions, min_time / 3)[0]
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.25):
+    ''' Lists the benchmarks slower than their baseline
+
+    Parameters:
+    -----------
+    results : dict
+        Results of run_benchmarks.
+
+    baseline : dict
+        Stored results of run_benchmarks.
+
+    tolerance : float, optional
+        Allowed slowdown, by default 0.25 (25% fewer ops/sec).
+
+    Returns:
+    --------
+    list
+        (benchmark, ops_per_sec, baseline ops_per_sec) of every regression.
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['ops_per_sec'] < (1 - tolerance) * baseline[name]['ops_per_sec']:
+            regressions.append((name, result['ops_per_sec'], baseline[name]['ops_per_sec']))
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    ''' Returns the benchmarks stored in a baseline file '''
+    with open(path) as f:
+        return json.load(f)['benchmarks']
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    ''' Stores results of run_benchmarks as the baseline, with the machine they come from '''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                   'numpy': np.__version__, 'benchmarks': results}, f, indent=1, sort_keys=True)
+
+
+def check_benchmarks(path=BASELINE_PATH, tolerance=0.25, **kwargs):
+    ''' Runs the benchmarks and raises BenchmarkRegression if one is slower than the baseline
+
+    Parameters:
+    -----------
+    path : Path, optional
+        Baseline file, by default BASELINE_PATH.
+
+    tolerance : float, optional
+        Allowed slowdown, by default 0.25.
+
+    **kwargs
+        Passed to run_benchmarks.
+
+    Returns:
+    --------
+    dict
+        Results of run_benchmarks.
+    '''
+    results = run_benchmarks(**kwargs)
+    regressions = compare_with_baseline(results, load_baseline(path), tolerance)
+    if regressions:
+        raise BenchmarkRegression("; ".join(f"{name}: {rate:.0f} ops/sec, baseline {base:.0f}"
+                                            for name, rate, base in regressions))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the helper functions and agents")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--only", nargs="*", help="benchmarks to run")
+    parser.add_argument("--agents", nargs="*", default=['agent_q1', 'agent_q2', 'agent_q3', 'agent_minimax'])
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only, tuple(args.agents), args.min_time)
+    baseline = load_baseline(args.baseline) if Path(args.baseline).exists() else {}
+    print(f"{'benchmark':<24}{'ops/sec':>12}{'baseline':>12}{'change':>9}{'peak KB':>10}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get('ops_per_sec')
+        change = f"{result['ops_per_sec']/base - 1:+.0%}" if base else ""
+        print(f"{name:<24}{result['ops_per_sec']:>12.1f}{base or float('nan'):>12.1f}{change:>9}"
+              f"{result['peak_kb']:>10.1f}")
+    if args.save:
+        save_baseline(results, args.baseline)
+        return 0
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for name, rate, base in regressions:
+        print(f"REGRESSION {name}: {rate:.1f} ops/sec, baseline {base:.1f}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+# %%
@@ -0,0 +1,458 @@
+#%%
+import random
+import numpy as np
+
+__all__ = [
+    "popcount", "Geometry", "get_geometry", "Position", "get_heuristic_position",
+    "get_heuristic_minimax_position"
+]
+
+
+###########################################################
+### Bitboard representation of the game state
+###########################################################
+#
+# Each player owns one integer whose bits mark their discs. Column c uses the
+# bits c*(rows+1) ... c*(rows+1)+rows-1, ordered from the bottom row upwards.
+# The extra (always empty) bit on top of each column keeps shifted masks from
+# wrapping into the next column, so four in a row in any direction can be
+# detected with a handful of shifts and ands.
+#
+#   6 13 20 27 34 41 48
+#   5 12 19 26 33 40 47
+#   4 11 18 25 32 39 46
+#   3 10 17 24 31 38 45
+#   2  9 16 23 30 37 44
+#   1  8 15 22 29 36 43
+#   0  7 14 21 28 35 42
+
+
+def popcount(bitboard):
+    ''' Number of bits set in a bitboard
+
+    Parameters:
+    -----------
+    bitboard : int
+        The bitboard to be counted.
+
+    Returns:
+    --------
+    int
+        The number of set bits.
+    '''
+    return bin(bitboard).count("1")
+
+
+
+class Geometry:
+    ''' Precomputed masks for a board of a given size
+
+    Parameters:
+    -----------
+    rows : int
+        Number of rows of the board.
+
+    columns : int
+        Number of columns of the board.
+
+    inarow : int
+        Number of discs in a row needed to win.
+    '''
+    def __init__(self, rows, columns, inarow):
+        self.rows = rows
+        self.columns = columns
+        self.inarow = inarow
+        self.height = rows + 1
+        self.size = rows * columns
+
+        column = (1 << rows) - 1
+        self.bottom_mask = sum(1 << (c * self.height) for c in range(columns))
+        self.board_mask = self.bottom_mask * column
+        self.column_masks = [column << (c * self.height) for c in range(columns)]
+        self.top_masks = [1 << (c * self.height + rows - 1) for c in range(columns)]
+
+        # Bit of every cell of the kaggle board (row-major, top row first)
+        self.cell_bits = [c * self.height + rows - 1 - r for r in range(rows) for c in range(columns)]
+
+        # Vertical, horizontal, positive diagonal and negative diagonal
+        steps = ((0, 1), (1, 0), (1, 1), (1, -1))
+        self.directions = tuple(dc * self.height + dr for dc, dr in steps)
+
+        # Cells where a window of each direction starts, and the windows themselves
+        self.start_masks = []
+        self.window_masks = []
+        for (dc, dr), shift in zip(steps, self.directions):
+            start_mask = 0
+            for c in range(columns):
+                for r in range(rows):
+                    if not (0 <= c + (inarow-1)*dc < columns and 0 <= r + (inarow-1)*dr < rows):
+                        continue
+                    start = c * self.height + r
+                    start_mask |= 1 << start
+                    self.window_masks.append(sum(1 << (start + k*shift) for k in range(inarow)))
+            self.start_masks.append((shift, start_mask))
+
+        # Zobrist keys: one random 64-bit number per mark and bit
+        rng = random.Random(20240601)
+        n_bits = columns * self.height
+        self.zobrist = [[0] * n_bits] + [[rng.getrandbits(64) for _ in range(n_bits)] for _ in range(2)]
+        # Keys of the mirror image: the hash of the position reflected across the center column
+        mirror_bits = [(columns - 1 - b // self.height) * self.height + b % self.height for b in range(n_bits)]
+        self.zobrist_mirror = [[keys[m] for m in mirror_bits] for keys in self.zobrist]
+
+    def mirror(self, bitboard):
+        ''' Returns the bitboard reflected across the center column '''
+        column = (1 << self.height) - 1
+        mirrored = 0
+        for c in range(self.columns):
+            mirrored |= ((bitboard >> (c * self.height)) & column) << ((self.columns - 1 - c) * self.height)
+        return mirrored
+
+
+_GEOMETRIES = {}
+
+def get_geometry(config):
+    ''' Returns the (cached) Geometry matching the game configuration
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    Geometry
+        The precomputed masks of the board.
+    '''
+    key = (config.rows, config.columns, config.inarow)
+    if key not in _GEOMETRIES:
+        _GEOMETRIES[key] = Geometry(*key)
+    return _GEOMETRIES[key]
+
+
+
+class Position:
+    ''' Connect Four position stored as two bitboards and the column heights
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+    '''
+    def __init__(self, config):
+        self.geometry = get_geometry(config)
+        # masks[1] and masks[2] are the discs of each player (masks[0] is unused)
+        self.masks = [0, 0, 0]
+        self.heights = [0] * self.geometry.columns
+        self.n_moves = 0
+        self.history = []
+        # Zobrist hashes of the position and of its mirror image, updated
+        # incrementally by play() and undo()
+        self.hash = 0
+        self.mirror_hash = 0
+
+    @classmethod
+    def from_board(cls, board, config):
+        ''' Builds a position from a kaggle board (obs.board)
+
+        Parameters:
+        -----------
+        board : list
+            The flattened board, row-major with the top row first.
+
+        config : dict
+            A dictionary containing the configuration parameters of the game.
+
+        Returns:
+        --------
+        Position
+            The position corresponding to the board.
+        '''
+        pos = cls(config)
+        cell_bits = pos.geometry.cell_bits
+        masks = pos.masks
+        for i, piece in enumerate(board):
+            if piece:
+                masks[piece] |= 1 << cell_bits[i]
+        pos._sync_heights()
+        return pos
+
+    @classmethod
+    def from_grid(cls, grid, config):
+        ''' Builds a position from a 2D numpy grid
+
+        Parameters:
+        -----------
+        grid : numpy array
+            The game grid.
+
+        config : dict
+            A dictionary containing the configuration parameters of the game.
+
+        Returns:
+        --------
+        Position
+            The position corresponding to the grid.
+        '''
+        pos = cls(config)
+        cell_bits = pos.geometry.cell_bits
+        flat = np.asarray(grid).ravel()
+        for piece in (1, 2):
+            for i in np.flatnonzero(flat == piece):
+                pos.masks[piece] |= 1 << cell_bits[i]
+        pos._sync_heights()
+        return pos
+
+    def _sync_heights(self):
+        occupied = self.masks[1] | self.masks[2]
+        self.heights = [popcount(occupied & m) for m in self.geometry.column_masks]
+        self.n_moves = sum(self.heights)
+        self.hash = self.mirror_hash = 0
+        for mark in (1, 2):
+            zobrist = self.geometry.zobrist[mark]
+            zobrist_mirror = self.geometry.zobrist_mirror[mark]
+            mask = self.masks[mark]
+            while mask:
+                low = mask & -mask
+                self.hash ^= zobrist[low.bit_length() - 1]
+                self.mirror_hash ^= zobrist_mirror[low.bit_length() - 1]
+                mask ^= low
+
+    def copy(self):
+        ''' Returns an independent copy of the position '''
+        pos = Position.__new__(Position)
+        pos.geometry = self.geometry
+        pos.masks = list(self.masks)
+        pos.heights = list(self.heights)
+        pos.n_moves = self.n_moves
+        pos.history = list(self.history)
+        pos.hash = self.hash
+        pos.mirror_hash = self.mirror_hash
+        return pos
+
+    def mirrored(self):
+        ''' Returns the position reflected across the center column (without history) '''
+        pos = Position(self.geometry)
+        pos.masks = [0, self.geometry.mirror(self.masks[1]), self.geometry.mirror(self.masks[2])]
+        pos._sync_heights()
+        return pos
+
+    def to_board(self):
+        ''' Returns the position as a kaggle board (flattened list) '''
+        p1, p2 = self.masks[1], self.masks[2]
+        return [1 if p1 >> b & 1 else 2 if p2 >> b & 1 else 0 for b in self.geometry.cell_bits]
+
+    def to_grid(self):
+        ''' Returns the position as a 2D numpy grid '''
+        return np.asarray(self.to_board()).reshape(self.geometry.rows, self.geometry.columns)
+
+    @property
+    def mark(self):
+        ''' Mark of the player to move '''
+        return 1 + (self.n_moves & 1)
+
+    def key(self):
+        ''' Unique integer key of the position
+
+        The discs of player 1 plus the occupied cells plus the bottom row:
+        every column then holds its height as a single leading bit above the
+        discs of player 1, so no two positions share a key.
+        '''
+        return self.masks[1] + (self.masks[1] | self.masks[2]) + self.geometry.bottom_mask
+
+    def canonical_key(self):
+        ''' Returns the smallest key of the position and its mirror image, and True if it is the mirror's '''
+        key = self.key()
+        mirrored = self.geometry.mirror(key)
+        return (mirrored, True) if mirrored < key else (key, False)
+
+    def can_play(self, col):
+        ''' Returns True if the column is not full '''
+        return self.heights[col] < self.geometry.rows
+
+    def valid_moves(self):
+        ''' Returns the list of columns that are not full '''
+        rows = self.geometry.rows
+        return [c for c, h in enumerate(self.heights) if h < rows]
+
+    def play(self, col, mark=None):
+        ''' Drops a piece in the selected column, in O(1)
+
+        Parameters:
+        -----------
+        col : int
+            The column where the piece will be dropped.
+
+        mark : int, optional
+            The value of the piece, by default the player to move.
+        '''
+        if mark is None:
+            mark = 1 + (self.n_moves & 1)
+        bit = col * self.geometry.height + self.heights[col]
+        self.masks[mark] |= 1 << bit
+        self.hash ^= self.geometry.zobrist[mark][bit]
+        self.mirror_hash ^= self.geometry.zobrist_mirror[mark][bit]
+        self.heights[col] += 1
+        self.n_moves += 1
+        self.history.append((col, mark))
+
+    def undo(self):
+        ''' Takes back the last move played with play() '''
+        col, mark = self.history.pop()
+        self.heights[col] -= 1
+        self.n_moves -= 1
+        bit = col * self.geometry.height + self.heights[col]
+        self.masks[mark] ^= 1 << bit
+        self.hash ^= self.geometry.zobrist[mark][bit]
+        self.mirror_hash ^= self.geometry.zobrist_mirror[mark][bit]
+
+    def connected(self, bitboard):
+        ''' Returns True if the bitboard contains inarow discs in a row '''
+        inarow = self.geometry.inarow
+        for shift in self.geometry.directions:
+            m = bitboard
+            for k in range(1, inarow):
+                m &= bitboard >> (k * shift)
+            if m:
+                return True
+        return False
+
+    def has_won(self, mark):
+        ''' Returns True if the player has inarow discs in a row '''
+        return self.connected(self.masks[mark])
+
+    def is_winning_move(self, col, mark=None):
+        ''' Returns True if dropping piece in column results in game win
+
+        Parameters:
+        -----------
+        col : int
+            The column where the piece is to be placed.
+
+        mark : int, optional
+            The value of the piece, by default the player to move.
+
+        Returns:
+        --------
+        bool
+            True if the move results in a winning move, False otherwise.
+        '''
+        if mark is None:
+            mark = 1 + (self.n_moves & 1)
+        return self.connected(self.masks[mark] | 1 << (col * self.geometry.height + self.heights[col]))
+
+    def is_full(self):
+        ''' Returns True if no more pieces can be dropped '''
+        return self.n_moves == self.geometry.size
+
+    def is_terminal(self):
+        ''' Returns True if the game has ended (win or draw) '''
+        return self.n_moves == self.geometry.size or self.connected(self.masks[1]) or self.connected(self.masks[2])
+
+    def count_windows(self, num_discs, mark):
+        ''' Counts windows with num_discs pieces of mark and the rest empty
+
+        Parameters:
+        -----------
+        num_discs : int
+            The number of discs to be checked for in a window.
+
+        mark : int
+            The value of the piece to be checked.
+
+        Returns:
+        --------
+        int
+            The number of windows satisfying the condition.
+        '''
+        geometry = self.geometry
+        own = self.masks[mark]
+        if num_discs == geometry.inarow:
+            return self._count_full(own)
+        empty = geometry.board_mask & ~(self.masks[1] | self.masks[2])
+        if num_discs == geometry.inarow - 1:
+            return self._count_open(own, empty)
+        # General case: check the windows one by one
+        other = self.masks[3 - mark]
+        return sum(1 for w in geometry.window_masks if not other & w and popcount(own & w) == num_discs)
+
+    def _count_full(self, own):
+        inarow = self.geometry.inarow
+        count = 0
+        for shift, start_mask in self.geometry.start_masks:
+            m = own & start_mask
+            for k in range(1, inarow):
+                m &= own >> (k * shift)
+            if m:
+                count += popcount(m)
+        return count
+
+    def _count_open(self, own, empty):
+        # A window has inarow-1 discs and one empty cell if, for some k, its
+        # k-th cell is empty and all the others are taken by the player
+        inarow = self.geometry.inarow
+        count = 0
+        for shift, start_mask in self.geometry.start_masks:
+            owns = [own >> (k * shift) for k in range(inarow)]
+            found = 0
+            for k in range(inarow):
+                m = (empty >> (k * shift)) & start_mask
+                for j in range(inarow):
+                    if j != k:
+                        m &= owns[j]
+                found |= m
+            if found:
+                count += popcount(found)
+        return count
+
+
+###########################################################
+### Heuristics on bitboards
+###########################################################
+
+def get_heuristic_position(pos, mark):
+    ''' Same value as get_heuristic, computed on a Position
+
+    Parameters:
+    -----------
+    pos : Position
+        The current position.
+
+    mark : int
+        The value of the piece to be evaluated.
+
+    Returns:
+    --------
+    score : float
+        The heuristic score of the position for mark.
+    '''
+    geometry = pos.geometry
+    own, opp = pos.masks[mark], pos.masks[3 - mark]
+    if geometry.inarow != 4:
+        return pos.count_windows(3, mark) - 1e2*pos.count_windows(3, 3 - mark) + 1e6*pos.count_windows(4, mark)
+    empty = geometry.board_mask & ~(own | opp)
+    num_threes = pos._count_open(own, empty)
+    num_fours = pos._count_full(own)
+    num_threes_opp = pos._count_open(opp, empty)
+    return num_threes - 1e2*num_threes_opp + 1e6*num_fours
+
+
+def get_heuristic_minimax_position(pos, mark):
+    ''' Same value as get_heuristic_minimax, computed on a Position
+
+    Parameters:
+    -----------
+    pos : Position
+        The current position.
+
+    mark : int
+        The value of the piece to be evaluated.
+
+    Returns:
+    --------
+    score : float
+        The heuristic score of the position for mark.
+    '''
+    return (get_heuristic_position(pos, mark)
+            - 1e4*pos.count_windows(4, 3 - mark))
+# %%
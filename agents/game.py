@@ -0,0 +1,190 @@
+#%%
+import importlib
+import random
+import sys
+import time
+import types
+
+import numpy as np
+
+try:
+    from .bitboard import *
+except ImportError:
+    from bitboard import *
+
+__all__ = [
+    "Struct", "DEFAULT_CONFIG", "random_agent", "get_agent", "get_agent_name", "seed_everything",
+    "play_game"
+]
+
+
+###########################################################
+### Game objects shared by the environments and runners
+###########################################################
+
+class Struct(dict):
+    ''' Dictionary whose keys can also be read as attributes
+
+    Same behaviour as kaggle_environments.utils.Struct, so observations and
+    configurations built here work with agents written for kaggle
+    (obs.board as well as obs['board']).
+    '''
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+# Default configuration of the kaggle connectx environment
+DEFAULT_CONFIG = Struct(rows=6, columns=7, inarow=4, actTimeout=2, agentTimeout=60,
+                        runTimeout=1200, episodeSteps=1000, timeout=2)
+
+
+def random_agent(obs, config):
+    """Selects a random valid column, as the kaggle "random" agent
+
+    Parameters
+    ----------
+    obs : object
+        The observation object containing the game board information.
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+
+    Returns
+    -------
+    int
+        Column selected by the agent
+    """
+    return random.choice([c for c in range(config.columns) if obs.board[c] == 0])
+
+
+def get_agent(agent):
+    ''' Returns the agent function of a kaggle agent name or function
+
+    Parameters:
+    -----------
+    agent : str or function
+        "random", "negamax" (the kaggle built-in agents), the name of an agent
+        of this package ("agent_q3", "agent_minimax", ...), "module:function",
+        the path of a PPO checkpoint (".zip", played as agent_rl), the path of
+        a submission file (".py"), or an agent function.
+
+    Returns:
+    --------
+    function
+        The agent, taking (obs, config).
+    '''
+    if callable(agent):
+        return agent
+    if agent == "random":
+        return random_agent
+    if agent == "negamax":
+        from kaggle_environments.envs.connectx.connectx import negamax_agent
+        return negamax_agent
+    package = importlib.import_module(__package__ or "agents")
+    if agent.endswith(".zip"):
+        return package.make_agent_rl(agent)
+    if agent.endswith(".py"):
+        return package.load_submission(agent)
+    if ":" in agent:
+        module, name = agent.split(":", 1)
+        return getattr(importlib.import_module(module), name)
+    if agent.startswith("agent_") and hasattr(package, agent):
+        agent_function = getattr(package, agent)
+        # `import agents.agent_rl` binds the submodule of the same name
+        if isinstance(agent_function, types.ModuleType):
+            agent_function = getattr(agent_function, agent)
+        return agent_function
+    raise ValueError(f"Unknown agent: {agent}")
+
+
+def get_agent_name(agent):
+    ''' Returns the name under which an agent is reported '''
+    return agent if isinstance(agent, str) else getattr(agent, "__name__", repr(agent))
+
+
+def seed_everything(seed):
+    ''' Seeds the random generators the agents draw from (random, numpy, torch) '''
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    if "torch" in sys.modules:
+        sys.modules["torch"].manual_seed(seed)
+
+
+def play_game(agent1, agent2, config=None, seed=None):
+    ''' Plays one game between two agents, with the rules of kaggle connectx
+
+    A move in a full or nonexistent column, an exception raised by the agent
+    or a move taking longer than config.actTimeout once the overage time
+    (config.agentTimeout in total) is used up ends the game. The agent at
+    fault gets a reward of None and the other one 0, as kaggle does.
+
+    Parameters:
+    -----------
+    agent1 : function
+        Agent playing first (mark 1).
+
+    agent2 : function
+        Agent playing second (mark 2).
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    seed : int, optional
+        Seed of random, numpy and torch before the game, by default None
+        (not reseeded).
+
+    Returns:
+    --------
+    dict
+        rewards: [reward of agent1, reward of agent2] (1 win, -1 loss, 0 draw,
+        None invalid play), status: "DONE", "INVALID", "ERROR" or "TIMEOUT",
+        moves: the columns played, times: the seconds of every move of each
+        agent.
+    '''
+    config = Struct(DEFAULT_CONFIG if config is None else config)
+    if seed is not None:
+        seed_everything(seed)
+    agents = [agent1, agent2]
+    pos = Position(config)
+    board = [0] * (config.rows*config.columns)
+    overage = [config.agentTimeout, config.agentTimeout]
+    moves, times = [], [[], []]
+    rewards, status = [0, 0], "DONE"
+    while True:
+        player = pos.n_moves % 2
+        mark = player + 1
+        obs = Struct(board=list(board), mark=mark, step=pos.n_moves, remainingOverageTime=overage[player])
+        start = time.perf_counter()
+        try:
+            col = agents[player](obs, config)
+        except Exception:
+            col, status = None, "ERROR"
+        elapsed = time.perf_counter() - start
+        times[player].append(elapsed)
+        overage[player] -= max(0.0, elapsed - config.actTimeout)
+        if status == "DONE" and overage[player] < 0:
+            status = "TIMEOUT"
+        elif status == "DONE" and not (isinstance(col, (int, np.integer)) and 0 <= col < config.columns
+                                       and pos.can_play(int(col))):
+            status = "INVALID"
+        if status != "DONE":
+            rewards[player] = None
+            break
+        col = int(col)
+        won = pos.is_winning_move(col, mark)
+        board[(config.rows - 1 - pos.heights[col])*config.columns + col] = mark
+        pos.play(col, mark)
+        moves.append(col)
+        if won:
+            rewards = [1, -1] if mark == 1 else [-1, 1]
+            break
+        if pos.is_full():
+            break
+    return {'rewards': rewards, 'status': status, 'moves': moves, 'times': times}
+# %%
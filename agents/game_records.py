@@ -0,0 +1,423 @@
+#%%
+import os
+import struct
+
+import numpy as np
+
+try:
+    from .game import *
+except ImportError:
+    from game import *
+
+__all__ = [
+    "RECORD_DTYPE", "STATUSES", "NO_SEED", "pack_moves", "unpack_moves", "GameRecordWriter", "write_games",
+    "GameRecordReader"
+]
+
+
+###########################################################
+### Compact binary archive of played games
+###########################################################
+# A file of game records starts with a header (magic, version, board size)
+# followed by chunks, each one written in a single append:
+#
+#   chunk header   magic, number of games, bytes of names, bytes of moves
+#   names          agents met for the first time in the chunk (u16 length
+#                  + UTF-8), numbered after those of the previous chunks
+#   index          one RECORD_DTYPE entry per game: file offset of its
+#                  moves, agent numbers, seed and outcome
+#   moves          the columns of every game, two per byte (high nibble
+#                  first), each game starting on a new byte
+#
+# A game of 42 moves takes 21 bytes of moves and 24 of index. A chunk cut
+# short by a crash is ignored by the reader and overwritten by the next
+# writer. The move times of play_game are not kept.
+
+_MAGIC = b"C4GR"
+_CHUNK_MAGIC = b"C4CH"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBBBB")
+_CHUNK_HEADER = struct.Struct("<4sIIQ")
+_NAME_LENGTH = struct.Struct("<H")
+
+RECORD_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('first', '<u2'),
+    ('second', '<u2'),
+    ('seed', '<i8'),
+    ('n_moves', 'u1'),
+    ('status', 'u1'),
+    ('winner', 'u1'),
+    ('invalid', 'u1'),
+])
+
+# Status codes of the records, as reported by play_game
+STATUSES = ("DONE", "INVALID", "ERROR", "TIMEOUT")
+
+# Seed of the games played without one
+NO_SEED = -1
+
+
+def pack_moves(moves):
+    ''' Packs columns (0 to 15) two per byte, the first one in the high nibble
+
+    Parameters:
+    -----------
+    moves : list
+        Columns played.
+
+    Returns:
+    --------
+    bytes
+        (len(moves) + 1) // 2 bytes, the last low nibble 0 for an odd number
+        of moves.
+    '''
+    moves = np.asarray(moves, dtype=np.uint8)
+    if len(moves) % 2:
+        moves = np.append(moves, np.uint8(0))
+    return ((moves[0::2] << 4) | moves[1::2]).tobytes()
+
+
+def unpack_moves(packed, n_moves):
+    ''' Returns the n_moves columns packed by pack_moves (numpy array of uint8) '''
+    packed = np.frombuffer(packed, dtype=np.uint8) if isinstance(packed, (bytes, bytearray)) else packed
+    moves = np.empty(2*len(packed), dtype=np.uint8)
+    moves[0::2] = packed >> 4
+    moves[1::2] = packed & 15
+    return moves[:n_moves]
+
+
+def _outcome(result):
+    # (status, winner, invalid) codes of a result of play_game
+    rewards = result['rewards']
+    winner = 1 if rewards[0] == 1 else 2 if rewards[1] == 1 else 0
+    invalid = 1 if rewards[0] is None else 2 if rewards[1] is None else 0
+    return STATUSES.index(result['status']), winner, invalid
+
+
+def _rewards(winner, invalid):
+    # Rewards of play_game from the outcome codes of a record
+    if invalid:
+        rewards = [0, 0]
+        rewards[invalid - 1] = None
+        return rewards
+    return [1, -1] if winner == 1 else [-1, 1] if winner == 2 else [0, 0]
+
+
+def _scan(f, start=None):
+    # Reads the header (when start is None) and the complete chunks from
+    # start: (config, names, index arrays, end of the last complete chunk)
+    size = os.fstat(f.fileno()).st_size
+    config = None
+    if start is None:
+        f.seek(0)
+        magic, version, rows, columns, inarow = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{f.name} is not a file of game records (version {_VERSION})")
+        config = Struct(rows=rows, columns=columns, inarow=inarow)
+        start = _HEADER.size
+    names, indices = [], []
+    while start + _CHUNK_HEADER.size <= size:
+        f.seek(start)
+        magic, n_games, names_bytes, moves_bytes = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+        end = start + _CHUNK_HEADER.size + names_bytes + n_games*RECORD_DTYPE.itemsize + moves_bytes
+        if magic != _CHUNK_MAGIC or end > size:
+            break
+        block = f.read(names_bytes)
+        i = 0
+        while i < names_bytes:
+            length, = _NAME_LENGTH.unpack_from(block, i)
+            names.append(block[i + 2:i + 2 + length].decode('utf-8'))
+            i += 2 + length
+        indices.append(np.frombuffer(f.read(n_games*RECORD_DTYPE.itemsize), dtype=RECORD_DTYPE))
+        start = end
+    return config, names, indices, start
+
+
+###########################################################
+### Writer
+###########################################################
+
+class GameRecordWriter:
+    ''' Appends games to a file of game records, a chunk at a time
+
+    The games are buffered and written as one chunk every chunk_size games,
+    and when the writer is flushed or closed. An existing file is appended
+    to (after checking its board size), the agents keeping their numbers.
+    Only one writer may append to a file at a time.
+
+    Parameters:
+    -----------
+    path : str or Path
+        The file, created if needed.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG. At most 15
+        columns and 255 cells.
+
+    chunk_size : int, optional
+        Number of games per chunk, by default 4096.
+    '''
+    def __init__(self, path, config=None, chunk_size=4096):
+        config = Struct(DEFAULT_CONFIG if config is None else config)
+        if config.columns > 15 or config.rows*config.columns > 255:
+            raise ValueError("Game records hold at most 15 columns and 255 cells")
+        self.path = str(path)
+        self.shape = (config.rows, config.columns, config.inarow)
+        self.chunk_size = chunk_size
+        self.agents = {}
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                found, names, _, end = _scan(f)
+            if (found.rows, found.columns, found.inarow) != self.shape:
+                raise ValueError(f"{self.path} holds games of another board size")
+            self.agents = {name: i for i, name in enumerate(names)}
+            self.file = open(self.path, 'r+b')
+            # Drops a chunk cut short by a crash
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(self.path, 'wb')
+            self.file.write(_HEADER.pack(_MAGIC, _VERSION, config.rows, config.columns, config.inarow))
+            self.file.flush()
+        self.n_games = 0
+        self._new_names = []
+        self._records = []
+        self._moves = []
+
+    def _agent(self, agent):
+        name = get_agent_name(agent)
+        if name not in self.agents:
+            self.agents[name] = len(self.agents)
+            self._new_names.append(name)
+        return self.agents[name]
+
+    def write(self, agent1, agent2, result, seed=None):
+        ''' Adds a game
+
+        Parameters:
+        -----------
+        agent1 : str or function
+            The agent who played first, recorded by name (see get_agent_name).
+
+        agent2 : str or function
+            The agent who played second.
+
+        result : dict
+            Result of play_game: rewards, status and moves.
+
+        seed : int, optional
+            Seed of the game, by default None (recorded as NO_SEED).
+        '''
+        status, winner, invalid = _outcome(result)
+        self._records.append((0, self._agent(agent1), self._agent(agent2), NO_SEED if seed is None else seed,
+                              len(result['moves']), status, winner, invalid))
+        self._moves.append(pack_moves(result['moves']))
+        self.n_games += 1
+        if len(self._records) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        ''' Writes the buffered games as one chunk '''
+        if not self._records:
+            return
+        names = b"".join(_NAME_LENGTH.pack(len(name)) + name for name in
+                         (name.encode('utf-8') for name in self._new_names))
+        moves = b"".join(self._moves)
+        records = np.array(self._records, dtype=RECORD_DTYPE)
+        start = self.file.tell() + _CHUNK_HEADER.size + len(names) + records.nbytes
+        lengths = np.array([len(packed) for packed in self._moves], dtype=np.uint64)
+        records['offset'] = start + np.cumsum(lengths) - lengths
+        self.file.write(_CHUNK_HEADER.pack(_CHUNK_MAGIC, len(records), len(names), len(moves))
+                        + names + records.tobytes() + moves)
+        self.file.flush()
+        self._new_names, self._records, self._moves = [], [], []
+
+    def close(self):
+        ''' Writes the buffered games and closes the file '''
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_games(records, games, results, config=None):
+    ''' Appends the games of run_games to game records
+
+    Parameters:
+    -----------
+    records : str, Path or GameRecordWriter
+        The file (opened, appended to and closed) or an open writer.
+
+    games : list
+        (first agent, second agent, seed, ...) of every game.
+
+    results : list
+        Result of play_game of every game.
+
+    config : dict, optional
+        Configuration of the games, by default DEFAULT_CONFIG. It must be
+        that of the file when it exists or of the writer.
+    '''
+    config = Struct(DEFAULT_CONFIG if config is None else config)
+    if isinstance(records, GameRecordWriter):
+        if records.shape != (config.rows, config.columns, config.inarow):
+            raise ValueError(f"{records.path} holds games of another board size")
+        writer = records
+    else:
+        writer = GameRecordWriter(records, config)
+    try:
+        for game, result in zip(games, results):
+            writer.write(game[0], game[1], result, game[2])
+    finally:
+        if writer is not records:
+            writer.close()
+
+
+###########################################################
+### Reader
+###########################################################
+
+class GameRecordReader:
+    ''' Reads a file of game records through a memory map
+
+    The index of the games (a RECORD_DTYPE array) is loaded when the file is
+    opened, the moves are only read from the map when a game is asked for.
+    Games appended after opening are seen after refresh().
+
+    Parameters:
+    -----------
+    path : str or Path
+        The file of game records.
+    '''
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            self.config, self.agents, indices, self._end = _scan(f)
+        self.index = np.concatenate(indices) if indices else np.zeros(0, dtype=RECORD_DTYPE)
+        self._map()
+
+    def _map(self):
+        self._data = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(self._end,))
+        self._pairs = None
+
+    def refresh(self):
+        ''' Loads the chunks written since the file was opened
+
+        Returns:
+        --------
+        int
+            Number of new games.
+        '''
+        with open(self.path, 'rb') as f:
+            _, names, indices, end = _scan(f, self._end)
+        if not indices:
+            return 0
+        n = len(self.index)
+        self.agents += names
+        self.index = np.concatenate([self.index] + indices)
+        self._end = end
+        self._map()
+        return len(self.index) - n
+
+    def __len__(self):
+        return len(self.index)
+
+    def moves(self, i):
+        ''' Returns the columns played in game i (numpy array of uint8) '''
+        entry = self.index[i]
+        offset = int(entry['offset'])
+        return unpack_moves(self._data[offset:offset + (int(entry['n_moves']) + 1)//2], int(entry['n_moves']))
+
+    def __getitem__(self, i):
+        ''' Returns game i: first, second (agent names), seed, status, rewards and moves, as play_game '''
+        entry = self.index[i]
+        seed = int(entry['seed'])
+        return dict(first=self.agents[entry['first']], second=self.agents[entry['second']],
+                    seed=None if seed == NO_SEED else seed, status=STATUSES[entry['status']],
+                    rewards=_rewards(entry['winner'], entry['invalid']), moves=self.moves(i).tolist())
+
+    def games(self, indices=None, chunk_size=4096):
+        ''' Yields the games (see __getitem__), reading the index chunk_size games at a time
+
+        Parameters:
+        -----------
+        indices : array, optional
+            Numbers of the games, by default all of them in file order.
+
+        chunk_size : int, optional
+            Number of games read from the map at once, by default 4096.
+        '''
+        if indices is None:
+            indices = np.arange(len(self.index))
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            entries = self.index[chunk]
+            offsets = entries['offset'].astype(np.int64)
+            n_moves = entries['n_moves'].astype(np.int64)
+            # The moves of the chunk in one read when they are contiguous, as in file order
+            low, high = offsets.min(), (offsets + (n_moves + 1)//2).max()
+            data = np.array(self._data[low:high]) if high - low <= 64*len(chunk) else None
+            for entry, offset, n in zip(entries, offsets, n_moves):
+                packed = data[offset - low:offset - low + (n + 1)//2] if data is not None else \
+                    self._data[offset:offset + (n + 1)//2]
+                seed = int(entry['seed'])
+                yield dict(first=self.agents[entry['first']], second=self.agents[entry['second']],
+                           seed=None if seed == NO_SEED else seed, status=STATUSES[entry['status']],
+                           rewards=_rewards(entry['winner'], entry['invalid']),
+                           moves=unpack_moves(packed, n).tolist())
+
+    def boards(self, i):
+        ''' Yields the boards of game i, from the empty board to the last move
+
+        Every board is a new list, as the board of an observation (row 0 at
+        the top, 0 empty, 1 and 2 the marks of the players).
+        '''
+        rows, columns = self.config.rows, self.config.columns
+        board = [0] * (rows*columns)
+        heights = [0] * columns
+        yield list(board)
+        for n, col in enumerate(self.moves(i).tolist()):
+            board[(rows - 1 - heights[col])*columns + col] = n % 2 + 1
+            heights[col] += 1
+            yield list(board)
+
+    def pairs(self):
+        ''' Numbers of the games of every pair of agents
+
+        Returns:
+        --------
+        dict
+            (name of the first player, name of the second player) -> array of
+            the numbers of their games, in file order.
+        '''
+        if self._pairs is None:
+            keys = self.index['first'].astype(np.int64) << 16 | self.index['second']
+            order = np.argsort(keys, kind='stable')
+            unique, starts = np.unique(keys[order], return_index=True)
+            self._pairs = {(self.agents[key >> 16], self.agents[key & 0xFFFF]): games
+                           for key, games in zip(unique.tolist(), np.split(order, starts[1:]))}
+        return self._pairs
+
+    def match(self, agent1, agent2):
+        ''' Returns the numbers of the games between two agents, whoever played first, in file order '''
+        pairs = self.pairs()
+        agent1, agent2 = get_agent_name(agent1), get_agent_name(agent2)
+        games = [pairs.get(pair, []) for pair in {(agent1, agent2), (agent2, agent1)}]
+        return np.sort(np.concatenate(games)).astype(np.int64)
+
+    def close(self):
+        ''' Releases the memory map '''
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# %%
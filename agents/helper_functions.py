@@ -2,14 +2,27 @@
 import numpy as np
 import random
 
-from kaggle_environments import make, evaluate, agent
-from stable_baselines3 import PPO 
-from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+try:
+    from .bitboard import *
+    from .windows import *
+    from .search import *
+    from .tournament import *
+except ImportError:
+    from bitboard import *
+    from windows import *
+    from search import *
+    from tournament import *
 
+__all__ = [
+    "get_win_percentages", "drop_piece", "check_winning_move", "score_move", "get_heuristic",
+    "check_window", "count_windows", "MINIMAX_BATCH_DEPTH", "get_heuristic_minimax", "score_move_position",
+    "is_terminal_window", "is_terminal_node", "minimax", "minimax_position"
+]
 
 
 
-def get_win_percentages(agent1, agent2, n_rounds=100):
+
+def get_win_percentages(agent1, agent2, n_rounds=100, n_workers=None, records=None):
     """Gets the winning percentages of two agents playing together
 
     Parameters
@@ -20,18 +33,24 @@ def get_win_percentages(agent1, agent2, n_rounds=100):
         Agent number 2
     n_rounds : int, optional
         Number of rounds, by default 100
+    n_workers : int, optional
+        Number of processes playing the rounds, by default the number of cores
+    records : str, Path or GameRecordWriter, optional
+        Game records to which the rounds are appended, by default None
+
+    Returns
+    -------
+    dict
+        Summary of the match, see play_match
     """
-    # Use default Connect Four setup
-    config = {'rows': 6, 'columns': 7, 'inarow': 4}
-    # Agent 1 goes first (roughly) half the time          
-    outcomes = evaluate("connectx", [agent1, agent2], config, [], n_rounds//2)
-    # Agent 2 goes first (roughly) half the time      
-    outcomes += [[b,a] for [a,b] in evaluate("connectx", [agent2, agent1], config, [], n_rounds-n_rounds//2)]
-    print("Agent 1 Win Percentage:", np.round(outcomes.count([1,-1])/len(outcomes), 2))
-    print("Agent 2 Win Percentage:", np.round(outcomes.count([-1,1])/len(outcomes), 2))
-    print("Number of draws:", np.round(outcomes.count([0,0])/len(outcomes), 2))
-    print("Number of Invalid Plays by Agent 1:", outcomes.count([None, 0]))
-    print("Number of Invalid Plays by Agent 2:", outcomes.count([0, None]))
+    # Use default Connect Four setup, each agent goes first half the time
+    summary = play_match(agent1, agent2, n_rounds, n_workers=n_workers, records=records)
+    print("Agent 1 Win Percentage:", np.round(summary['wins']/summary['games'], 2))
+    print("Agent 2 Win Percentage:", np.round(summary['losses']/summary['games'], 2))
+    print("Number of draws:", np.round(summary['draws']/summary['games'], 2))
+    print("Number of Invalid Plays by Agent 1:", summary['invalid'])
+    print("Number of Invalid Plays by Agent 2:", summary['invalid_opponent'])
+    return summary
 
 
 
@@ -93,34 +112,9 @@ def check_winning_move(obs, config, col, piece):
     bool 
         True if the move results in a winning move, False otherwise. 
     '''
-    # Convert the board to a 2D grid
-    grid = np.asarray(obs.board).reshape(config.rows, config.columns)
-    next_grid = drop_piece(grid, col, piece, config)
-    # horizontal
-    for row in range(config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(next_grid[row,col:col+config.inarow])
-            if window.count(piece) == config.inarow:
-                return True
-    # vertical
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns):
-            window = list(next_grid[row:row+config.inarow,col])
-            if window.count(piece) == config.inarow:
-                return True
-    # positive diagonal
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(next_grid[range(row, row+config.inarow), range(col, col+config.inarow)])
-            if window.count(piece) == config.inarow:
-                return True
-    # negative diagonal
-    for row in range(config.inarow-1, config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(next_grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
-            if window.count(piece) == config.inarow:
-                return True
-    return False
+    # Convert the board to a bitboard position
+    pos = Position.from_board(obs.board, config)
+    return pos.is_winning_move(col, piece)
 
 
 
@@ -202,11 +196,7 @@ def get_heuristic(grid, mark, config):
     score : int 
         The heuristic score calculated based on the game grid and piece value. 
     '''
-    num_threes = count_windows(grid, 3, mark, config)
-    num_fours = count_windows(grid, 4, mark, config)
-    num_threes_opp = count_windows(grid, 3, mark%2+1, config)
-    score = num_threes - 1e2*num_threes_opp + 1e6*num_fours
-    return score
+    return float(get_heuristic_batch(grid, mark, config))
 
 # 
 def check_window(window, num_discs, piece, config):
@@ -254,33 +244,7 @@ def count_windows(grid, num_discs, piece, config):
     num_windows : int 
         The number of windows satisfying the specified heuristic conditions in the game grid. 
     '''
-
-    num_windows = 0
-    # horizontal
-    for row in range(config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[row, col:col+config.inarow])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # vertical
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns):
-            window = list(grid[row:row+config.inarow, col])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # positive diagonal
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row+config.inarow), range(col, col+config.inarow)])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    # negative diagonal
-    for row in range(config.inarow-1, config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
-            if check_window(window, num_discs, piece, config):
-                num_windows += 1
-    return num_windows
+    return int(count_windows_batch(grid, num_discs, piece, config))
 
 
 
@@ -296,6 +260,9 @@ def count_windows(grid, num_discs, piece, config):
 ### Helper functions of minimax agnets
 ###########################################################
 
+# Subtrees up to this depth are scored in one batch by minimax_position
+MINIMAX_BATCH_DEPTH = 3
+
 def get_heuristic_minimax(grid, mark, config):
     ''' Helper function for score_move: calculates value of heuristic for grid
     Parameters: 
@@ -314,12 +281,7 @@ def get_heuristic_minimax(grid, mark, config):
     score : int 
         The heuristic score calculated based on the game grid and piece value. 
     '''
-    num_threes = count_windows(grid, 3, mark, config)
-    num_fours = count_windows(grid, 4, mark, config)
-    num_threes_opp = count_windows(grid, 3, mark%2+1, config)
-    num_fours_opp = count_windows(grid, 4, mark%2+1, config)
-    score = num_threes - 1e2*num_threes_opp - 1e4*num_fours_opp + 1e6*num_fours
-    return score
+    return float(get_heuristic_minimax_batch(grid, mark, config))
 
 
 def score_move(grid, col, mark, config, nsteps):
@@ -347,8 +309,34 @@ def score_move(grid, col, mark, config, nsteps):
     score : int 
         The score of the move calculated using the minimax algorithm. 
     '''
-    next_grid = drop_piece(grid, col, mark, config)
-    score = minimax(next_grid, nsteps-1, False, mark, config)
+    return score_move_position(Position.from_grid(grid, config), col, mark, nsteps)
+
+
+def score_move_position(pos, col, mark, nsteps):
+    ''' Same as score_move, for a bitboard Position
+
+    Parameters: 
+    ----------- 
+    pos : Position 
+        The current position. It is left unchanged. 
+    
+    col : int 
+        The column where the piece will be dropped. 
+    
+    mark : int 
+        The value of the piece to be dropped. 
+    
+    nsteps : int 
+        The number of steps to look ahead in the minimax algorithm. 
+    
+    Returns: 
+    -------- 
+    score : int 
+        The score of the move calculated using the minimax algorithm. 
+    '''
+    pos.play(col, mark)
+    score = minimax_position(pos, nsteps-1, False, mark)
+    pos.undo()
     return score
 
 # Helper function for minimax: checks if agent or opponent has four in a row in the window
@@ -389,35 +377,7 @@ def is_terminal_node(grid, config):
     bool 
         True if the current node is a terminal node (win or draw), False otherwise. 
     '''
-    # Check for draw 
-    if list(grid[0, :]).count(0) == 0:
-        return True
-    # Check for win: horizontal, vertical, or diagonal
-    # horizontal 
-    for row in range(config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[row, col:col+config.inarow])
-            if is_terminal_window(window, config):
-                return True
-    # vertical
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns):
-            window = list(grid[row:row+config.inarow, col])
-            if is_terminal_window(window, config):
-                return True
-    # positive diagonal
-    for row in range(config.rows-(config.inarow-1)):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row+config.inarow), range(col, col+config.inarow)])
-            if is_terminal_window(window, config):
-                return True
-    # negative diagonal
-    for row in range(config.inarow-1, config.rows):
-        for col in range(config.columns-(config.inarow-1)):
-            window = list(grid[range(row, row-config.inarow, -1), range(col, col+config.inarow)])
-            if is_terminal_window(window, config):
-                return True
-    return False
+    return Position.from_grid(grid, config).is_terminal()
 
 # Minimax implementation
 def minimax(node, depth, maximizingPlayer, mark, config):
@@ -445,19 +405,46 @@ def minimax(node, depth, maximizingPlayer, mark, config):
     int 
         The optimal value of the current node calculated using the minimax algorithm. 
     '''
-    is_terminal = is_terminal_node(node, config)
-    valid_moves = [c for c in range(config.columns) if node[0][c] == 0]
-    if depth == 0 or is_terminal:
-        return get_heuristic(node, mark, config)
+    return minimax_position(Position.from_grid(node, config), depth, maximizingPlayer, mark)
+
+
+def minimax_position(pos, depth, maximizingPlayer, mark):
+    ''' Minimax implementation on a bitboard Position
+    
+    Parameters: 
+    ----------- 
+    pos : Position 
+        The current position. Moves are played and undone in place. 
+    
+    depth : int 
+        The depth to which the minimax algorithm should search. 
+    
+    maximizingPlayer : bool 
+        True if the current player is maximizing, False if minimizing. 
+    
+    mark : int 
+        The value of the piece to be evaluated. 
+    
+    Returns: 
+    -------- 
+    int 
+        The optimal value of the current node calculated using the minimax algorithm. 
+    '''
+    if depth == 0 or pos.is_terminal():
+        return get_heuristic_position(pos, mark)
+    if depth <= MINIMAX_BATCH_DEPTH and pos.geometry.columns * pos.geometry.height <= 64:
+        return minimax_batch(pos, depth, maximizingPlayer, mark)[0]
     if maximizingPlayer:
-        value = -np.Inf
-        for col in valid_moves:
-            child = drop_piece(node, col, mark, config)
-            value = max(value, minimax(child, depth-1, False, mark, config))
+        value = -np.inf
+        for col in pos.valid_moves():
+            pos.play(col, mark)
+            value = max(value, minimax_position(pos, depth-1, False, mark))
+            pos.undo()
         return value
     else:
-        value = np.Inf
-        for col in valid_moves:
-            child = drop_piece(node, col, mark%2+1, config)
-            value = min(value, minimax(child, depth-1, True, mark, config))
-        return value
\ No newline at end of file
+        value = np.inf
+        for col in pos.valid_moves():
+            pos.play(col, mark%2+1)
+            value = min(value, minimax_position(pos, depth-1, True, mark))
+            pos.undo()
+        return value
@@ -0,0 +1,233 @@
+#%%
+import asyncio
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+__all__ = ["BatchedPolicyServer", "make_batched_agent"]
+
+
+###########################################################
+### Batched inference for the RL policy
+###########################################################
+
+class BatchedPolicyServer:
+    ''' Gathers the boards of many games and runs them through the policy together
+
+    Requests are queued by any number of threads (predict) or asyncio tasks
+    (predict_async). A background thread takes the first pending request,
+    waits up to max_wait_ms for more, and runs a single model.predict on the
+    whole batch (at most max_batch_size boards).
+
+    The server is started by the first request and restarted by the first
+    one after stop(). Requests made while it is stopping are refused with a
+    RuntimeError, and the futures still queued when the background thread
+    ends fail with one.
+
+    Parameters:
+    -----------
+    model : object
+        Model with a stable_baselines3-like predict(observations, deterministic)
+        method, e.g. MODEL_REGISTRY.get(MODELS_DIR / "ppo").
+
+    rows : int, optional
+        Number of rows of the board, by default 6.
+
+    columns : int, optional
+        Number of columns of the board, by default 7.
+
+    max_batch_size : int, optional
+        Maximum number of boards per forward pass, by default 64.
+
+    max_wait_ms : float, optional
+        Maximum time the first request of a batch waits for others, by default 2.
+
+    deterministic : bool, optional
+        Take the most likely action instead of sampling it, by default False
+        (as model.predict in agent_rl).
+    '''
+    def __init__(self, model, rows=6, columns=7, max_batch_size=64, max_wait_ms=2.0, deterministic=False):
+        self.model = model
+        self.shape = (1, rows, columns)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.deterministic = deterministic
+        self._requests = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+        # Guards _thread and _stopping: start, stop and submit may be called from any thread
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.n_batches = 0
+        self.n_requests = 0
+
+    def start(self):
+        ''' Starts the background thread (done automatically by the first request) '''
+        with self._lock:
+            self._start()
+        return self
+
+    def _start(self):
+        # Called with the lock held
+        if self._stopping:
+            raise RuntimeError("BatchedPolicyServer is stopping")
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._serve, name="BatchedPolicyServer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        ''' Serves the pending requests, then stops the background thread '''
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._stop.set()
+            thread = self._thread
+        try:
+            if thread is not None:
+                thread.join()
+        finally:
+            with self._lock:
+                self._thread = None
+                self._stopping = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, board):
+        ''' Queues a board and returns a Future holding the selected column
+
+        Parameters:
+        -----------
+        board : list
+            The board (obs.board) of the game.
+
+        Returns:
+        --------
+        Future
+            Resolves to the column selected by the policy.
+        '''
+        board = np.asarray(board).reshape(self.shape)
+        future = Future()
+        with self._lock:
+            # Queued with the lock held, so stop() cannot end the thread in between
+            self._start()
+            self._requests.put((board, future))
+        return future
+
+    def predict(self, board, timeout=None):
+        ''' Selects a column for one board, blocking until its batch is served
+
+        Parameters:
+        -----------
+        board : list
+            The board (obs.board) of the game.
+
+        timeout : float, optional
+            Maximum seconds to wait, by default None (no limit).
+
+        Returns:
+        --------
+        int
+            Column selected by the policy.
+        '''
+        return self.submit(board).result(timeout)
+
+    async def predict_async(self, board):
+        ''' Same as predict, for asyncio callers
+
+        Parameters:
+        -----------
+        board : list
+            The board (obs.board) of the game.
+
+        Returns:
+        --------
+        int
+            Column selected by the policy.
+        '''
+        return await asyncio.wrap_future(self.submit(board))
+
+    def _serve(self):
+        try:
+            self._serve_batches()
+        finally:
+            # Fails the requests left behind, rather than leaving their callers waiting
+            while True:
+                try:
+                    _, future = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                future.set_exception(RuntimeError("BatchedPolicyServer stopped before serving the request"))
+
+    def _serve_batches(self):
+        while not (self._stop.is_set() and self._requests.empty()):
+            try:
+                batch = [self._requests.get(timeout=0.05)]
+            except queue.Empty:
+                continue
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._requests.get(timeout=remaining))
+                    else:
+                        batch.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        boards = np.stack([board for board, _ in batch])
+        try:
+            actions, _ = self.model.predict(boards, deterministic=self.deterministic)
+        except Exception as e:
+            for _, future in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+        for (_, future), action in zip(batch, actions):
+            if not future.cancelled():
+                future.set_result(int(action))
+        self.n_batches += 1
+        self.n_requests += len(batch)
+
+    def stats(self):
+        ''' Returns the number of batches and requests served and the mean batch size '''
+        return {
+            'batches': self.n_batches,
+            'requests': self.n_requests,
+            'mean_batch_size': self.n_requests / self.n_batches if self.n_batches else 0.0,
+        }
+
+
+def make_batched_agent(server):
+    ''' Builds a kaggle agent that selects its moves through a BatchedPolicyServer
+
+    Parameters:
+    -----------
+    server : BatchedPolicyServer
+        Server shared by the games played in parallel.
+
+    Returns:
+    --------
+    function
+        Agent taking (obs, config), with the same behaviour as agent_rl.
+    '''
+    def agent_batched_rl(obs, config):
+        col = server.predict(obs['board'])
+        # If not valid, select random move.
+        if obs['board'][col] == 0:
+            return col
+        return random.choice([c for c in range(config.columns) if obs['board'][c] == 0])
+    return agent_batched_rl
+# %%
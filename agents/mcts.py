@@ -0,0 +1,316 @@
+#%%
+import math
+import time
+
+import numpy as np
+
+try:
+    from .batched_game import *
+    from .bitboard import *
+except ImportError:
+    from batched_game import *
+    from bitboard import *
+
+__all__ = ["MCTS"]
+
+
+###########################################################
+### Monte Carlo tree search over a pool of array nodes
+###########################################################
+
+class MCTS:
+    ''' Monte Carlo tree search with UCT and batched, vectorized playouts
+
+    The nodes live in preallocated arrays indexed by node number (parent,
+    move, children, visits, value sum, ...), not in Python objects. A node
+    is expanded with all its children at once, and the value of a node is
+    summed from the point of view of the player who moved into it.
+
+    Every iteration selects batch_size leaves one after the other, a virtual
+    loss on the nodes of each path steering the next descents elsewhere,
+    then evaluates them together: here by playing every leaf to the end at
+    once on BatchedBoards, with random moves or the rules of agent_q3.
+
+    The tree is kept between moves: search() starts from the node of the
+    new position if it is in the tree, the rest of the pool being freed
+    when it fills up.
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    capacity : int, optional
+        Number of nodes of the pool, by default 2**18.
+
+    c_uct : float, optional
+        Exploration constant of UCT, by default 1.4.
+
+    batch_size : int, optional
+        Leaves evaluated together, by default 64.
+
+    tactical : bool, optional
+        Play the playouts with the rules of agent_q3 instead of random moves,
+        by default True.
+
+    seed : int, optional
+        Seed of the playouts, by default None (random).
+    '''
+    def __init__(self, config, capacity=2**18, c_uct=1.4, batch_size=64, tactical=True, seed=None):
+        self.config = config
+        self.geometry = get_geometry(config)
+        self.columns = config.columns
+        self.capacity = capacity
+        self.c_uct = c_uct
+        self.batch_size = batch_size
+        self.tactical = tactical
+        self.rng = np.random.default_rng(seed)
+        self.boards = BatchedBoards(batch_size, config)
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.move = np.empty(capacity, dtype=np.int8)
+        self.children = np.empty((capacity, self.columns), dtype=np.int32)
+        self.visits = np.empty(capacity, dtype=np.float64)
+        self.value_sum = np.empty(capacity, dtype=np.float64)
+        self.virtual = np.empty(capacity, dtype=np.float64)
+        self.prior = np.empty(capacity, dtype=np.float64)
+        # 0: game goes on, 1: the move into the node won, 2: the board is full
+        self.terminal = np.empty(capacity, dtype=np.int8)
+        self.expanded = np.empty(capacity, dtype=bool)
+        # Leaves evaluated since the tree was created, and the rate of the last search
+        self.playouts = 0
+        self.playouts_per_second = 0.0
+        self.clear()
+
+    def clear(self):
+        ''' Empties the tree '''
+        self.n_nodes = 0
+        self.root_pos = None
+        self.root = self._new_nodes(1, -1, [-1], [1.0], [0])
+
+    def _new_nodes(self, n, parent, moves, priors, terminal):
+        start = self.n_nodes
+        nodes = slice(start, start + n)
+        self.parent[nodes] = parent
+        self.move[nodes] = moves
+        self.children[nodes] = -1
+        self.visits[nodes] = 0
+        self.value_sum[nodes] = 0
+        self.virtual[nodes] = 0
+        self.prior[nodes] = priors
+        self.terminal[nodes] = terminal
+        self.expanded[nodes] = False
+        self.n_nodes += n
+        return start
+
+    # Position reached from the root ---------------------------------------
+
+    def _find_root(self, pos):
+        # Node of pos if it is the root or one of its children or grandchildren, else None
+        if self.root_pos is None:
+            return None
+        old, new = self.root_pos.to_board(), pos.to_board()
+        if any(a and a != b for a, b in zip(old, new)):
+            return None
+        added = {new[i]: i % self.columns for i in range(len(new)) if new[i] and not old[i]}
+        # The player to move at the root plays the first of the new discs
+        marks = [self.root_pos.mark, 3 - self.root_pos.mark][:len(added)]
+        if sorted(added) != sorted(marks):
+            return None
+        node, moved = self.root, self.root_pos.copy()
+        for mark in marks:
+            if not self.expanded[node] or not moved.can_play(added[mark]):
+                return None
+            moved.play(added[mark], mark)
+            node = self.children[node, added[mark]]
+        return node if moved.to_board() == new else None
+
+    def set_root(self, pos):
+        ''' Moves the root to the node of pos, keeping its subtree, or starts a new tree
+
+        Parameters:
+        -----------
+        pos : Position
+            The position to search.
+        '''
+        node = self._find_root(pos)
+        if node is None or self.terminal[node]:
+            self.clear()
+        else:
+            self.root = node
+            self.parent[node] = -1
+            if self.n_nodes > self.capacity // 2:
+                self._compact()
+        self.root_pos = pos.copy()
+
+    def _compact(self):
+        # Copies the subtree of the root to the start of the pool, breadth-first
+        order, frontier = [], np.array([self.root])
+        while len(frontier):
+            order.append(frontier)
+            children = self.children[frontier]
+            frontier = children[children >= 0]
+        order = np.concatenate(order)
+        index = np.full(self.n_nodes, -1, dtype=np.int32)
+        index[order] = np.arange(len(order), dtype=np.int32)
+        n = len(order)
+        for array in self._node_arrays():
+            array[:n] = array[order]
+        children = self.children[order]
+        self.children[:n] = np.where(children >= 0, index[children], -1)
+        parent = self.parent[order]
+        self.parent[:n] = np.where(parent >= 0, index[parent], -1)
+        self.root = 0
+        self.n_nodes = n
+
+    def _node_arrays(self):
+        # Per-node arrays moved by _compact, besides parent and children
+        return [self.move, self.visits, self.value_sum, self.virtual, self.prior, self.terminal, self.expanded]
+
+    # Search -------------------------------------------------------------
+
+    def _expand(self, node, pos):
+        # Creates the children of node (pos being its position); False if the pool is full
+        moves = pos.valid_moves()
+        if self.n_nodes + len(moves) > self.capacity:
+            return False
+        terminal = []
+        for col in moves:
+            if pos.is_winning_move(col):
+                terminal.append(1)
+            else:
+                terminal.append(2 if pos.n_moves + 1 == self.geometry.size else 0)
+        first = self._new_nodes(len(moves), node, moves, self._priors(node, pos, moves), terminal)
+        self.children[node, moves] = np.arange(first, first + len(moves), dtype=np.int32)
+        self.expanded[node] = True
+        return True
+
+    def _priors(self, node, pos, moves):
+        # Prior probability of the children; UCT does not use them
+        return 1.0 / len(moves)
+
+    def _select_child(self, node):
+        # UCT: children never visited first, then the highest upper confidence bound
+        children = self.children[node]
+        children = children[children >= 0]
+        visits = self.visits[children] + self.virtual[children]
+        unvisited = np.flatnonzero(visits == 0)
+        if len(unvisited):
+            return children[unvisited[self.rng.integers(len(unvisited))]]
+        q = (self.value_sum[children] - self.virtual[children]) / visits
+        total = self.visits[node] + self.virtual[node]
+        return children[np.argmax(q + self.c_uct * np.sqrt(math.log(total) / visits))]
+
+    def _descend(self, pos):
+        # Path from the root to a leaf, playing its moves on pos
+        node = self.root
+        path = [node]
+        while not self.terminal[node]:
+            if not self.expanded[node]:
+                if self.visits[node] + self.virtual[node] == 0 and node != self.root:
+                    break
+                if not self._expand(node, pos):
+                    break
+            node = self._select_child(node)
+            pos.play(int(self.move[node]))
+            path.append(node)
+        return path
+
+    def _evaluate(self, positions, nodes):
+        # Value of each leaf for the player who moved into it, from one playout each
+        n = len(positions)
+        batch = self.boards
+        batch.load([pos.to_board() for pos in positions])
+        marks = np.array([pos.mark for pos in positions])
+        winners = np.zeros(n, dtype=np.int8)
+        active = np.arange(n)
+        to_move = marks.copy()
+        while len(active):
+            valid = batch.valid_moves(active)
+            if self.tactical:
+                cols = tactical_moves(batch, valid, to_move[active], self.rng, active)
+            else:
+                cols = random_valid_moves(valid, self.rng)
+            won, full = batch.play(cols, to_move[active], active)
+            winners[active[won]] = to_move[active[won]]
+            to_move[active] = 3 - to_move[active]
+            active = active[~(won | full)]
+        self.playouts += n
+        return np.where(winners == 0, 0.0, np.where(winners == marks, -1.0, 1.0))
+
+    def _backup(self, path, value, virtual=0):
+        # Adds value (for the player who moved into the leaf) along the path, alternating sides
+        sign = 1.0
+        for node in reversed(path):
+            self.visits[node] += 1
+            self.value_sum[node] += sign * value
+            self.virtual[node] -= virtual
+            sign = -sign
+
+    def search(self, pos, deadline=None, n_playouts=None):
+        ''' Runs batches of playouts from pos until the deadline or the number of playouts
+
+        Parameters:
+        -----------
+        pos : Position
+            The position to search, which must not be finished. It is left
+            unchanged.
+
+        deadline : float, optional
+            time.perf_counter() value at which to stop, by default None.
+
+        n_playouts : int, optional
+            Number of leaves to evaluate, by default None. At least one of
+            deadline and n_playouts must be given. One batch is always run.
+
+        Returns:
+        --------
+        dict
+            Visits of the root node of every valid column.
+        '''
+        start = time.perf_counter()
+        self.set_root(pos)
+        done = 0
+        while True:
+            paths, leaves, nodes = [], [], []
+            for _ in range(self.batch_size):
+                leaf_pos = self.root_pos.copy()
+                path = self._descend(leaf_pos)
+                leaf = path[-1]
+                if self.terminal[leaf]:
+                    self._backup(path, 1.0 if self.terminal[leaf] == 1 else 0.0)
+                else:
+                    self.virtual[path] += 1
+                    paths.append(path)
+                    leaves.append(leaf_pos)
+                    nodes.append(leaf)
+            if leaves:
+                for path, value in zip(paths, self._evaluate(leaves, nodes)):
+                    self._backup(path, value, virtual=1)
+            done += self.batch_size
+            if n_playouts is not None and done >= n_playouts:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if deadline is None and n_playouts is None:
+                break
+        self.playouts_per_second = done / (time.perf_counter() - start)
+        children = self.children[self.root]
+        return {col: float(self.visits[children[col]]) for col in range(self.columns) if children[col] >= 0}
+
+    def best_moves(self):
+        ''' Returns the columns of the most visited children of the root, a winning move if there is one '''
+        children = self.children[self.root]
+        cols = [col for col in range(self.columns) if children[col] >= 0]
+        wins = [col for col in cols if self.terminal[children[col]] == 1]
+        if wins:
+            return wins
+        visits = self.visits[children[cols]]
+        return [col for col, v in zip(cols, visits) if v == visits.max()]
+
+    def root_value(self):
+        ''' Mean value of the root for the player to move, in [-1, 1] '''
+        children = self.children[self.root]
+        children = children[children >= 0]
+        visits = self.visits[children].sum()
+        return float(self.value_sum[children].sum() / visits) if visits else 0.0
+# %%
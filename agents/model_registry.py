@@ -0,0 +1,168 @@
+#%%
+import os
+import threading
+import time
+from pathlib import Path
+
+__all__ = ["load_ppo", "ModelRegistry", "MODEL_REGISTRY"]
+
+
+###########################################################
+### Registry of loaded models
+###########################################################
+
+def load_ppo(path):
+    ''' Loads a PPO checkpoint saved by train_agent_rl.py
+
+    The CustomCNN class and the training schedules are given explicitly, so
+    the checkpoint also loads under another Python version than the one it
+    was saved with (the pickled versions cannot be read there).
+
+    Parameters:
+    -----------
+    path : Path
+        Path of the .zip checkpoint.
+
+    Returns:
+    --------
+    PPO
+        The loaded model.
+    '''
+    from stable_baselines3 import PPO
+    try:
+        from .networks import CustomCNN
+    except ImportError:
+        from networks import CustomCNN
+
+    custom_objects = {
+        'policy_kwargs': dict(features_extractor_class=CustomCNN),
+        'lr_schedule': 0.0,
+        'clip_range': 0.0,
+        # Checkpoints of MirrorPPO load as plain PPO
+        'rollout_buffer_class': None,
+        'rollout_buffer_kwargs': {},
+    }
+    return PPO.load(path, custom_objects=custom_objects, device='cpu')
+
+
+class ModelRegistry:
+    ''' Loads each checkpoint once per process and keeps it in memory
+
+    A checkpoint is loaded the first time it is asked for. Later calls return
+    the same object, unless the file has been replaced by a newer one (its
+    modification time changed), in which case it is loaded again. The file is
+    checked at most once every check_interval seconds.
+
+    The functions in on_unload are called with the version (see version())
+    of every checkpoint dropped, replaced or cleared, e.g. to drop what a
+    cache holds for it.
+
+    Parameters:
+    -----------
+    loader : callable, optional
+        Function loading a checkpoint from its path, by default load_ppo.
+
+    check_interval : float, optional
+        Seconds between two checks of the file on disk, by default 1.0.
+        None never checks again once loaded.
+
+    verbose : bool, optional
+        Print a message every time a checkpoint is (re)loaded, by default False.
+    '''
+    def __init__(self, loader=load_ppo, check_interval=1.0, verbose=False):
+        self.loader = loader
+        self.check_interval = check_interval
+        self.verbose = verbose
+        # path -> [model, mtime, time of the last check]
+        self._models = {}
+        self._lock = threading.Lock()
+        self.on_unload = []
+
+    def _unloaded(self, path, entry):
+        for callback in self.on_unload:
+            callback((path, entry[1]))
+
+    @staticmethod
+    def _resolve(path):
+        # stable_baselines3 saves "ppo" as "ppo.zip"
+        path = Path(path)
+        if not path.exists() and path.with_name(path.name + '.zip').exists():
+            path = path.with_name(path.name + '.zip')
+        return str(path.resolve())
+
+    def get(self, path):
+        ''' Returns the model stored in a checkpoint, loading it if needed
+
+        Parameters:
+        -----------
+        path : Path or str
+            Path of the checkpoint, with or without the .zip extension.
+
+        Returns:
+        --------
+        object
+            The loaded model.
+        '''
+        path = self._resolve(path)
+        entry = self._models.get(path)
+        now = time.monotonic()
+        if entry is not None and (self.check_interval is None or now - entry[2] < self.check_interval):
+            return entry[0]
+
+        with self._lock:
+            entry = self._models.get(path)
+            mtime = os.stat(path).st_mtime_ns
+            if entry is None or entry[1] != mtime:
+                model = self.loader(path)
+                if self.verbose:
+                    print(f"Loaded model {path}")
+                if entry is not None:
+                    self._unloaded(path, entry)
+                entry = [model, mtime, now]
+                self._models[path] = entry
+            else:
+                entry[2] = now
+        return entry[0]
+
+    def version(self, path):
+        ''' Returns an identifier of the checkpoint version currently loaded
+
+        Parameters:
+        -----------
+        path : Path or str
+            Path of the checkpoint, with or without the .zip extension.
+
+        Returns:
+        --------
+        tuple or None
+            (path, modification time) of the loaded file, None if not loaded.
+        '''
+        path = self._resolve(path)
+        entry = self._models.get(path)
+        return None if entry is None else (path, entry[1])
+
+    def unload(self, path):
+        ''' Drops the model of a checkpoint, if it is loaded
+
+        Parameters:
+        -----------
+        path : Path or str
+            Path of the checkpoint, with or without the .zip extension.
+        '''
+        path = self._resolve(path)
+        with self._lock:
+            entry = self._models.pop(path, None)
+            if entry is not None:
+                self._unloaded(path, entry)
+
+    def clear(self):
+        ''' Drops every loaded model '''
+        with self._lock:
+            for path, entry in self._models.items():
+                self._unloaded(path, entry)
+            self._models.clear()
+
+
+# Registry shared by the agents of this process
+MODEL_REGISTRY = ModelRegistry()
+# %%
@@ -0,0 +1,33 @@
+#%%
+import gym
+import torch as th
+import torch.nn as nn
+
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+
+# Neural network for predicting action values
+class CustomCNN(BaseFeaturesExtractor):
+    
+    def __init__(self, observation_space: gym.spaces.Box, features_dim: int=128):
+        super(CustomCNN, self).__init__(observation_space, features_dim)
+        # CxHxW images (channels first)
+        n_input_channels = observation_space.shape[0]
+        self.cnn = nn.Sequential(
+            nn.Conv2d(n_input_channels, 32, kernel_size=3, stride=1, padding=0),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=0),
+            nn.ReLU(),
+            nn.Flatten(),
+        )
+
+        # Compute shape by doing one forward pass
+        with th.no_grad():
+            n_flatten = self.cnn(
+                th.as_tensor(observation_space.sample()[None]).float()
+            ).shape[1]
+
+        self.linear = nn.Sequential(nn.Linear(n_flatten, features_dim), nn.ReLU())
+
+    def forward(self, observations: th.Tensor) -> th.Tensor:
+        return self.linear(self.cnn(observations))
+# %%
@@ -0,0 +1,128 @@
+#%%
+import base64
+import io
+
+import numpy as np
+
+__all__ = ["pack_weights", "unpack_weights", "load_weights", "NumpyPolicy"]
+
+
+###########################################################
+### NumPy inference of the PPO policy
+###########################################################
+# This module only needs NumPy: agents/submission.py copies its source into
+# the standalone submission file, next to the packed weights.
+
+def pack_weights(weights):
+    ''' Packs arrays into a base64 string (compressed .npz)
+
+    Parameters:
+    -----------
+    weights : dict
+        Arrays by name.
+
+    Returns:
+    --------
+    str
+        The packed arrays, as float32.
+    '''
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **{name: np.asarray(value, dtype=np.float32) for name, value in weights.items()})
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def unpack_weights(packed):
+    ''' Returns the arrays packed by pack_weights, by name '''
+    with np.load(io.BytesIO(base64.b64decode(packed))) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _conv3x3(x, weight, bias):
+    # Valid 3x3 convolution of (n, c, h, w) inputs as one matrix product
+    n, c, h, w = x.shape
+    h, w = h - 2, w - 2
+    patches = np.stack([x[:, :, i:i+h, j:j+w] for i in range(3) for j in range(3)], axis=2)
+    out = weight.reshape(len(weight), -1) @ patches.reshape(n, c*9, h*w)
+    return (out + bias[:, None]).reshape(n, len(weight), h, w)
+
+
+def load_weights(path):
+    ''' Loads a NumpyPolicy from an .npz file of its arrays (a loader for ModelRegistry) '''
+    with np.load(path) as data:
+        return NumpyPolicy({name: data[name] for name in data.files})
+
+
+class NumpyPolicy:
+    ''' Forward pass of the PPO policy of agent_rl (CustomCNN + MLP heads)
+
+    The layers are those of stable_baselines3 ActorCriticPolicy with the
+    CustomCNN features extractor: two 3x3 convolutions (ReLU), a linear
+    layer (ReLU), then policy and value networks of two tanh layers.
+
+    Parameters:
+    -----------
+    weights : dict
+        Arrays named as in the state dict of the policy (see
+        submission.extract_policy_weights). Without pi_/vf_ extractors, the
+        shared features_extractor is used by both heads.
+    '''
+    def __init__(self, weights):
+        self.weights = {name: np.asarray(value, dtype=np.float32) for name, value in weights.items()}
+
+    def _prefix(self, prefix):
+        # Extractor of a head: its own, or the shared one
+        return prefix if prefix + 'cnn.0.weight' in self.weights else 'features_extractor.'
+
+    def _features(self, x, prefix):
+        w = self.weights
+        prefix = self._prefix(prefix)
+        x = np.maximum(_conv3x3(x, w[prefix + 'cnn.0.weight'], w[prefix + 'cnn.0.bias']), 0)
+        x = np.maximum(_conv3x3(x, w[prefix + 'cnn.2.weight'], w[prefix + 'cnn.2.bias']), 0)
+        x = x.reshape(len(x), -1)
+        return np.maximum(x @ w[prefix + 'linear.0.weight'].T + w[prefix + 'linear.0.bias'], 0)
+
+    def _mlp(self, x, net):
+        w = self.weights
+        for layer in (0, 2):
+            x = np.tanh(x @ w[f'mlp_extractor.{net}.{layer}.weight'].T + w[f'mlp_extractor.{net}.{layer}.bias'])
+        return x
+
+    def _observations(self, boards):
+        boards = np.asarray(boards, dtype=np.float32)
+        return boards[:, None] if boards.ndim == 3 else boards
+
+    def _logits(self, features):
+        x = self._mlp(features, 'policy_net')
+        return x @ self.weights['action_net.weight'].T + self.weights['action_net.bias']
+
+    def _values(self, features):
+        x = self._mlp(features, 'value_net')
+        return (x @ self.weights['value_net.weight'].T + self.weights['value_net.bias'])[:, 0]
+
+    @staticmethod
+    def _softmax(logits):
+        logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return logits / logits.sum(axis=1, keepdims=True)
+
+    def logits(self, boards):
+        ''' Logits of the columns for boards of shape (n, rows, columns) or (n, 1, rows, columns) '''
+        return self._logits(self._features(self._observations(boards), 'pi_features_extractor.'))
+
+    def probabilities(self, boards):
+        ''' Probabilities of the columns, as model.predict samples them (n, columns) '''
+        return self._softmax(self.logits(boards))
+
+    def values(self, boards):
+        ''' Value estimates of the boards (n,) '''
+        return self._values(self._features(self._observations(boards), 'vf_features_extractor.'))
+
+    def forward(self, boards):
+        ''' Probabilities of the columns and value estimates of the boards, the shared features computed once '''
+        x = self._observations(boards)
+        features = self._features(x, 'pi_features_extractor.')
+        if self._prefix('vf_features_extractor.') != self._prefix('pi_features_extractor.'):
+            value_features = self._features(x, 'vf_features_extractor.')
+        else:
+            value_features = features
+        return self._softmax(self._logits(features)), self._values(value_features)
+# %%
@@ -0,0 +1,241 @@
+#%%
+import random
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from .bitboard import *
+    from .game import *
+    from .profiling import *
+    from .search import *
+    from .transposition import *
+except ImportError:
+    from bitboard import *
+    from game import *
+    from profiling import *
+    from search import *
+    from transposition import *
+
+__all__ = ["BOOK_PATH", "write_book", "OpeningBook", "OPENING_BOOK", "book_move", "build_opening_book"]
+
+
+###########################################################
+### Opening book: best moves of the early positions
+###########################################################
+
+# Book consulted by the agents, next to the checkpoints
+BOOK_PATH = Path(__file__).resolve().parent / "models" / "opening_book.bin"
+
+# Magic, version, rows, columns, inarow, max_ply, depth, number of positions.
+# The header is followed by the sorted keys (uint64), the best moves (uint8
+# bitmask of the columns) and the values (float32) of the positions.
+_HEADER = struct.Struct("<4sHBBBBBxQ")
+_MAGIC = b"C4BK"
+_VERSION = 1
+
+
+def write_book(path, keys, moves, values, config, max_ply=0, depth=0):
+    ''' Writes positions to a book file, sorted by key
+
+    Parameters:
+    -----------
+    path : Path or str
+        The book file.
+
+    keys : numpy array
+        Canonical keys of the positions (Position.canonical_key).
+
+    moves : numpy array
+        Bitmask of the best columns of every position, as seen from the
+        canonical orientation.
+
+    values : numpy array
+        Value of every position for the player to move.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    max_ply, depth : int, optional
+        Plies and search depth the book was built with (informative).
+    '''
+    order = np.argsort(keys)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, config.rows, config.columns, config.inarow, max_ply, depth, len(keys)))
+        f.write(np.asarray(keys, dtype='<u8')[order].tobytes())
+        f.write(np.asarray(moves, dtype='u1')[order].tobytes())
+        f.write(np.asarray(values, dtype='<f4')[order].tobytes())
+
+
+class OpeningBook:
+    ''' Memory-mapped book of positions, looked up by canonical key
+
+    The file is opened on the first lookup. Its arrays are memory-mapped, so
+    nothing is read until a lookup touches it (a binary search reads a few
+    pages) and the processes using the same book share its pages. A missing
+    file is an empty book.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The book file, by default BOOK_PATH.
+    '''
+    def __init__(self, path=BOOK_PATH):
+        self.path = Path(path)
+        self._opened = False
+
+    def _open(self):
+        self._opened = True
+        self.keys = None
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb') as f:
+            magic, version, rows, columns, inarow, self.max_ply, self.depth, n = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{self.path} is not an opening book")
+        self.shape = (rows, columns, inarow)
+        offset = _HEADER.size
+        self.keys = np.memmap(self.path, dtype='<u8', mode='r', offset=offset, shape=(n,)) if n else np.zeros(0, '<u8')
+        offset += 8*n
+        self.moves = np.memmap(self.path, dtype='u1', mode='r', offset=offset, shape=(n,)) if n else None
+        offset += n
+        self.values = np.memmap(self.path, dtype='<f4', mode='r', offset=offset, shape=(n,)) if n else None
+
+    def __len__(self):
+        if not self._opened:
+            self._open()
+        return 0 if self.keys is None else len(self.keys)
+
+    def lookup(self, pos):
+        ''' Returns the best moves and value of a position, if it is in the book
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position.
+
+        Returns:
+        --------
+        tuple or None
+            (best columns, value for the player to move), None if the
+            position is not in the book.
+        '''
+        if not self._opened:
+            self._open()
+        geometry = pos.geometry
+        if self.keys is None or self.shape != (geometry.rows, geometry.columns, geometry.inarow):
+            return None
+        key, mirrored = pos.canonical_key()
+        i = int(np.searchsorted(self.keys, np.uint64(key)))
+        if i == len(self.keys) or int(self.keys[i]) != key:
+            return None
+        mask = int(self.moves[i])
+        cols = [c for c in range(geometry.columns) if mask >> c & 1]
+        if mirrored:
+            cols = sorted(geometry.columns - 1 - c for c in cols)
+        return cols, float(self.values[i])
+
+
+# Book shared by the agents of this process
+OPENING_BOOK = OpeningBook()
+
+
+def book_move(pos, book, tablebase):
+    ''' Plays from the book in the opening, from the tablebase later on
+
+    Parameters:
+    -----------
+    pos : Position
+        The current position.
+
+    book : OpeningBook
+        Book of the opening positions, or None.
+
+    tablebase : OpeningBook
+        Solved positions, or None.
+
+    Returns:
+    --------
+    int or None
+        One of the best columns of the first of them holding the position
+        (counted as a book hit in PROFILER), None if neither does.
+    '''
+    for positions in (book, tablebase):
+        entry = positions.lookup(pos) if positions is not None else None
+        if entry is not None:
+            if PROFILER.enabled:
+                PROFILER.add(book_hits=1)
+            return random.choice(entry[0])
+    return None
+
+
+def build_opening_book(path=BOOK_PATH, max_ply=4, depth=9, config=None, table_mb=256, verbose=False):
+    ''' Searches every position up to max_ply plies and writes the book
+
+    Each position (mirror images counted once, finished games left out) is
+    searched with AlphaBetaSearch at a fixed depth, so its best moves are
+    those of score_move with nsteps=depth. A single transposition table is
+    shared by all the searches.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The book file, by default BOOK_PATH.
+
+    max_ply : int, optional
+        Positions with up to max_ply discs are searched, by default 4.
+
+    depth : int, optional
+        Search depth, by default 9 (as deep as agent_minimax reaches in the
+        opening within the move time).
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    table_mb : int, optional
+        Size of the transposition table, by default 256 MB.
+
+    verbose : bool, optional
+        Print the progress after every ply, by default False.
+
+    Returns:
+    --------
+    int
+        The number of positions in the book.
+    '''
+    if config is None:
+        config = DEFAULT_CONFIG
+    search = AlphaBetaSearch(config, TranspositionTable(max_mb=table_mb))
+    keys, moves, values = [], [], []
+    level = {Position(config).canonical_key()[0]: Position(config)}
+    start = time.perf_counter()
+    for ply in range(max_ply + 1):
+        next_level = {}
+        for key, pos in level.items():
+            if pos.canonical_key()[1]:
+                # Search the canonical orientation, so the moves are stored as seen from it
+                pos = pos.mirrored()
+            scores = search.score_moves(pos, depth, pos.mark)
+            best = get_best_moves(scores)
+            keys.append(key)
+            moves.append(sum(1 << c for c in best))
+            values.append(scores[best[0]])
+            if ply == max_ply:
+                continue
+            for col in pos.valid_moves():
+                if pos.is_winning_move(col):
+                    continue
+                child = pos.copy()
+                child.play(col)
+                if not child.is_full():
+                    next_level.setdefault(child.canonical_key()[0], child)
+        if verbose:
+            print(f"ply {ply}: {len(level)} positions, {len(keys)} in total, {time.perf_counter() - start:.0f}s")
+        level = next_level
+    write_book(path, keys, moves, values, config, max_ply, depth)
+    return len(keys)
+# %%
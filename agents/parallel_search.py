@@ -0,0 +1,223 @@
+#%%
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .bitboard import *
+    from .game import *
+    from .search import *
+    from .transposition import *
+except ImportError:
+    from bitboard import *
+    from game import *
+    from search import *
+    from transposition import *
+
+__all__ = ["ParallelSearch", "get_parallel_search"]
+
+
+###########################################################
+### Root-parallel alpha-beta search on a process pool
+###########################################################
+
+# State of a worker process: the shared best score, and its search and
+# transposition table for each game configuration, kept between moves
+_WORKER = {}
+
+
+def _init_worker(best, table_mb):
+    _WORKER['best'] = best
+    _WORKER['table_mb'] = table_mb
+    _WORKER['searches'] = {}
+    _WORKER['generation'] = None
+
+
+def _search_move(board, config, col, depth, mark, deadline, generation):
+    # Runs in the workers: (score, nodes, leaves) of one root move, score None on timeout
+    key = (config.rows, config.columns, config.inarow)
+    search = _WORKER['searches'].get(key)
+    if search is None:
+        search = _WORKER['searches'][key] = AlphaBetaSearch(config, TranspositionTable(_WORKER['table_mb']))
+    if generation != _WORKER['generation']:
+        _WORKER['generation'] = generation
+        search.table.new_search()
+    search.nodes = search.leaves = 0
+    pos = Position.from_board(board, config)
+    pos.play(col, mark)
+    best = _WORKER['best']
+    search.deadline = deadline
+    try:
+        # Same window as AlphaBetaSearch.score_moves, with the best score of all the workers
+        score = search.alphabeta(pos, depth-1, best.value - 0.5, np.inf, False, mark, 1)
+    except SearchTimeout:
+        return None, search.nodes, search.leaves
+    finally:
+        search.deadline = None
+    with best.get_lock():
+        if score > best.value:
+            best.value = score
+    return score, search.nodes, search.leaves
+
+
+class ParallelSearch:
+    ''' Alpha-beta search with the root moves shared out to a process pool
+
+    The first root move (the best one of the previous iteration) is
+    searched alone, then the others are searched in parallel, as in the
+    Young Brothers Wait Concept at the root. The best score found so far is
+    shared by the workers in a multiprocessing.Value: a root move starts
+    with it as its lower bound, so the scores are those of
+    AlphaBetaSearch.score_moves (exact for the best moves, upper bounds for
+    the others). The pool is started once and every worker keeps its
+    search and transposition table from one move to the next.
+
+    With one task per root move, the speedup is bounded by the number of
+    valid columns and by the size of the first subtree.
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    n_workers : int, optional
+        Number of processes, by default the number of cores.
+
+    table_mb : float, optional
+        Size of the transposition table of each worker, by default 64 MB.
+    '''
+    def __init__(self, config, n_workers=None, table_mb=64):
+        self.config = Struct(rows=config.rows, columns=config.columns, inarow=config.inarow)
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.best = multiprocessing.Value('d', -np.inf)
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                            initargs=(self.best, table_mb))
+        self.generation = 0
+        center = (config.columns - 1) / 2
+        self.center_order = sorted(range(config.columns), key=lambda c: abs(c - center))
+        self.nodes = 0
+        self.leaves = 0
+
+    def new_search(self):
+        ''' Marks the entries of the tables of the workers as coming from an older search '''
+        self.generation += 1
+
+    def score_moves(self, pos, depth, mark, order=None, deadline=None):
+        ''' Scores every valid move of the root position, in parallel
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position. It is left unchanged.
+
+        depth : int
+            The number of steps to look ahead, as nsteps in score_move.
+
+        mark : int
+            The value of the piece to be dropped.
+
+        order : list, optional
+            Order in which the moves are searched, by default center first.
+
+        deadline : float, optional
+            time.perf_counter() value at which to give up by raising
+            SearchTimeout, by default None (no limit).
+
+        Returns:
+        --------
+        scores : dict
+            Score of each valid column.
+        '''
+        if order is None:
+            order = [c for c in self.center_order if pos.can_play(c)]
+        board = pos.to_board()
+        self.best.value = -np.inf
+
+        def submit(col):
+            return self.executor.submit(_search_move, board, self.config, col, depth, mark, deadline, self.generation)
+
+        results = {order[0]: submit(order[0]).result()}
+        futures = {col: submit(col) for col in order[1:]}
+        # Every task is waited for, so none is left running into the next search
+        results.update({col: future.result() for col, future in futures.items()})
+        scores = {}
+        for col, (score, nodes, leaves) in results.items():
+            self.nodes += nodes
+            self.leaves += leaves
+            scores[col] = score
+        if None in scores.values():
+            raise SearchTimeout()
+        return scores
+
+    def iterative_deepening(self, pos, mark, deadline, max_depth=None):
+        ''' Searches deeper and deeper until the deadline, as AlphaBetaSearch.iterative_deepening
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position. It is left unchanged.
+
+        mark : int
+            The value of the piece to be dropped.
+
+        deadline : float
+            time.perf_counter() value at which the search must stop.
+
+        max_depth : int, optional
+            Depth at which to stop even if there is time left, by default
+            the number of empty cells.
+
+        Returns:
+        --------
+        scores : dict
+            Score of each valid column at the last completed depth.
+
+        depth : int
+            The last completed depth.
+        '''
+        empty = self.config.rows * self.config.columns - pos.n_moves
+        if max_depth is None or max_depth > empty:
+            max_depth = empty
+        scores = self.score_moves(pos, 1, mark)
+        depth = 1
+        try:
+            while depth < max_depth and time.perf_counter() < deadline:
+                # Best moves of the previous iteration first
+                order = sorted(scores, key=lambda col: -scores[col])
+                scores = self.score_moves(pos, depth+1, mark, order, deadline)
+                depth += 1
+        except SearchTimeout:
+            pass
+        return scores, depth
+
+    def close(self):
+        ''' Stops the worker processes '''
+        self.executor.shutdown()
+
+
+_PARALLEL_SEARCHES = {}
+
+def get_parallel_search(config, n_workers=None):
+    ''' Returns the (cached) ParallelSearch of a game configuration, so its pool is started once per process
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    n_workers : int, optional
+        Number of processes, by default the number of cores.
+
+    Returns:
+    --------
+    ParallelSearch
+        The search shared by the agents of this process.
+    '''
+    key = (config.rows, config.columns, config.inarow, n_workers or os.cpu_count() or 1)
+    if key not in _PARALLEL_SEARCHES:
+        _PARALLEL_SEARCHES[key] = ParallelSearch(config, key[3])
+    return _PARALLEL_SEARCHES[key]
+# %%
@@ -0,0 +1,139 @@
+#%%
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .model_registry import *
+except ImportError:
+    from model_registry import *
+
+__all__ = ["policy_probabilities", "PolicyCache", "POLICY_CACHE"]
+
+
+###########################################################
+### Cache of the policy of the RL agent
+###########################################################
+
+def policy_probabilities(model, observations):
+    ''' Action probabilities of a stable_baselines3 policy, without sampling
+
+    Parameters:
+    -----------
+    model : object
+        Model with a stable_baselines3 policy (e.g. PPO).
+
+    observations : numpy array
+        Observations of shape (n, 1, rows, columns).
+
+    Returns:
+    --------
+    numpy array
+        (n, columns) probabilities of the columns, the distribution model.predict
+        samples from.
+    '''
+    import torch
+
+    with torch.no_grad():
+        tensor, _ = model.policy.obs_to_tensor(observations)
+        return model.policy.get_distribution(tensor).distribution.probs.cpu().numpy()
+
+
+class PolicyCache:
+    ''' Bounded LRU cache of the action probabilities of the policy, per board
+
+    Caching the probabilities rather than an action keeps agent_rl
+    stochastic: a column is still drawn from the same distribution as
+    model.predict on every move, only the forward pass is skipped. The
+    entries of every checkpoint share one LRU, keyed by the version of the
+    checkpoint (see ModelRegistry.version), so several checkpoints can be
+    played in one process. The entries of a version are dropped by
+    drop(version): MODEL_REGISTRY calls it for POLICY_CACHE when it unloads
+    or reloads the checkpoint.
+
+    Parameters:
+    -----------
+    max_size : int, optional
+        Number of boards kept, by default 100000 (a few tens of MB).
+    '''
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probabilities(self, model, version, board, mark, shape=(1, 6, 7)):
+        ''' Returns the action probabilities of a board, computing them on a miss
+
+        Parameters:
+        -----------
+        model : object
+            Model with a stable_baselines3 policy.
+
+        version : object
+            Identity of the checkpoint of the model (ModelRegistry.version).
+
+        board : list
+            The board (obs.board) of the game.
+
+        mark : int
+            The mark of the player to move.
+
+        shape : tuple, optional
+            Shape of one observation, by default (1, 6, 7).
+
+        Returns:
+        --------
+        numpy array
+            Probability of every column.
+        '''
+        board = np.asarray(board, dtype=np.int8)
+        key = (version, board.tobytes(), mark)
+        with self._lock:
+            probabilities = self._entries.get(key)
+            if probabilities is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return probabilities
+            self.misses += 1
+        probabilities = policy_probabilities(model, board.reshape((1,) + shape).astype(int))[0].astype(np.float64)
+        probabilities /= probabilities.sum()
+        with self._lock:
+            self._entries[key] = probabilities
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return probabilities
+
+    def drop(self, version):
+        ''' Drops the entries of a checkpoint version '''
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == version]:
+                del self._entries[key]
+
+    def clear(self):
+        ''' Drops every entry and resets the counters '''
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        ''' Returns the number of entries, hits and misses, and the hit rate '''
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Cache shared by the RL agents of this process, emptied of the checkpoints
+# the shared registry unloads
+POLICY_CACHE = PolicyCache()
+MODEL_REGISTRY.on_unload.append(POLICY_CACHE.drop)
+# %%
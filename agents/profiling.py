@@ -0,0 +1,171 @@
+#%%
+import csv
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+__all__ = ["Profiler", "PROFILER", "profiled"]
+
+
+###########################################################
+### Per-move profiling of the agents
+###########################################################
+
+class Profiler:
+    ''' Records the wall time and work counters of every move of the profiled agents
+
+    Disabled by default: a profiled agent then only checks the enabled flag
+    before playing. Once enabled, every move gets a record holding the
+    agent's name, the step, the wall time (seconds), and the counters added
+    by the agent while it played (nodes, leaves, cache_hits, inference_time,
+    depth, ...). Records are kept per thread while a move is played, so
+    agents running in parallel threads are profiled separately.
+
+    Parameters:
+    -----------
+    enabled : bool, optional
+        Start recording right away, by default False.
+    '''
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        ''' Drops every record '''
+        self.records = []
+
+    @contextmanager
+    def recording(self):
+        ''' Enables the profiler inside a with block '''
+        enabled, self.enabled = self.enabled, True
+        try:
+            yield self
+        finally:
+            self.enabled = enabled
+
+    def profile_move(self, agent, obs, config):
+        ''' Plays a move with an agent and records it
+
+        Parameters:
+        -----------
+        agent : function
+            The agent, taking (obs, config).
+
+        obs : object
+            The observation object containing the game board information.
+
+        config : dict
+            A dictionary containing the configuration parameters of the game.
+
+        Returns:
+        --------
+        int
+            Column selected by the agent.
+        '''
+        record = {'agent': agent.__name__, 'step': obs.get('step', sum(1 for x in obs['board'] if x))}
+        outer, self._local.record = getattr(self._local, 'record', None), record
+        start = time.perf_counter()
+        try:
+            return agent(obs, config)
+        finally:
+            record['time'] = time.perf_counter() - start
+            self._local.record = outer
+            self.records.append(record)
+
+    def add(self, **counters):
+        ''' Adds counters to the record of the move being played in this thread
+
+        Parameters:
+        -----------
+        **counters : float
+            Values added to the counters of the same name (e.g. nodes=1200,
+            inference_time=0.003). Ignored outside a profiled move.
+        '''
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            for name, value in counters.items():
+                record[name] = record.get(name, 0) + value
+
+    def values(self, metric, agent=None):
+        ''' Returns the values of a metric over the recorded moves, of one agent or all '''
+        return np.array([r[metric] for r in self.records
+                         if metric in r and (agent is None or r['agent'] == agent)], dtype=float)
+
+    def summary(self, metrics=None):
+        ''' Summarizes the distribution of every metric, per agent
+
+        Parameters:
+        -----------
+        metrics : list, optional
+            Metrics to summarize, by default all the recorded ones.
+
+        Returns:
+        --------
+        dict
+            agent -> metric -> count, mean, p50, p95, p99 and max.
+        '''
+        summary = {}
+        for agent in sorted(set(r['agent'] for r in self.records)):
+            names = metrics or sorted(set(k for r in self.records if r['agent'] == agent for k in r) - {'agent', 'step'})
+            summary[agent] = {}
+            for metric in names:
+                values = self.values(metric, agent)
+                if len(values):
+                    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                    summary[agent][metric] = dict(count=len(values), mean=float(values.mean()), p50=float(p50),
+                                                  p95=float(p95), p99=float(p99), max=float(values.max()))
+        return summary
+
+    def histogram(self, metric, agent=None, bins=20):
+        ''' Histogram of a metric, as returned by numpy.histogram (counts, bin edges) '''
+        return np.histogram(self.values(metric, agent), bins=bins)
+
+    def to_csv(self, path):
+        ''' Writes one row per recorded move '''
+        columns = ['agent', 'step', 'time'] + sorted(set(k for r in self.records for k in r) - {'agent', 'step', 'time'})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def to_json(self, path):
+        ''' Writes the summary and the recorded moves '''
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'moves': self.records}, f, indent=1)
+
+
+# Profiler shared by the agents of this process
+PROFILER = Profiler()
+
+
+def profiled(agent):
+    ''' Decorator recording the moves of an agent in PROFILER when it is enabled
+
+    Parameters:
+    -----------
+    agent : function
+        The agent, taking (obs, config).
+
+    Returns:
+    --------
+    function
+        The same agent, calling PROFILER.profile_move when profiling is enabled.
+    '''
+    @functools.wraps(agent)
+    def profiled_agent(obs, config):
+        if not PROFILER.enabled:
+            return agent(obs, config)
+        return PROFILER.profile_move(agent, obs, config)
+    return profiled_agent
+# %%
@@ -0,0 +1,108 @@
+#%%
+import math
+
+import numpy as np
+
+try:
+    from .batched_game import *
+    from .mcts import *
+except ImportError:
+    from batched_game import *
+    from mcts import *
+
+__all__ = ["PUCT"]
+
+
+###########################################################
+### PUCT search guided by the policy and value networks
+###########################################################
+
+class PUCT(MCTS):
+    ''' AlphaZero-style tree search: policy priors and value estimates instead of playouts
+
+    A leaf is evaluated by the network rather than played out: its value
+    estimate is backed up, and its column probabilities become the priors
+    of its children when it is expanded. Children are selected by
+
+        Q + c_puct * P * sqrt(N) / (1 + n)
+
+    with Q the mean value of the child (0 before its first visit), P its
+    prior, n its visits and N the visits of all the children. The leaves of
+    a batch are found one after the other, the virtual loss of MCTS sending
+    each descent down another path, and evaluated in one forward pass.
+
+    The network sees the board from the side of the player to move (marks
+    swapped when it is player 2), as agent_rl was trained as player 1.
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    network : object
+        Network with forward(boards) returning the probabilities of the
+        columns (n, columns) and the values (n,) of (n, rows, columns)
+        boards, e.g. NumpyPolicy.
+
+    capacity : int, optional
+        Number of nodes of the pool, by default 2**17.
+
+    c_puct : float, optional
+        Exploration constant, by default 2.0.
+
+    batch_size : int, optional
+        Leaves evaluated in one forward pass, by default 16.
+
+    seed : int, optional
+        Seed of the ties between unvisited children, by default None.
+    '''
+    def __init__(self, config, network, capacity=2**17, c_puct=2.0, batch_size=16, seed=None):
+        self.network = network
+        self.c_puct = c_puct
+        # Column probabilities of the evaluated nodes, the priors of their children
+        self.policy = np.zeros((capacity, config.columns), dtype=np.float32)
+        self.evaluated = np.zeros(capacity, dtype=bool)
+        super().__init__(config, capacity=capacity, batch_size=batch_size, tactical=False, seed=seed)
+
+    def _new_nodes(self, n, parent, moves, priors, terminal):
+        start = super()._new_nodes(n, parent, moves, priors, terminal)
+        self.evaluated[start:start + n] = False
+        return start
+
+    def _node_arrays(self):
+        return super()._node_arrays() + [self.policy, self.evaluated]
+
+    def _forward(self, positions):
+        # Probabilities and values of the positions, for their player to move
+        grids = np.array([pos.to_board() for pos in positions], dtype=np.int8)
+        grids = grids.reshape(len(positions), self.config.rows, self.columns)
+        swap = np.array([pos.mark == 2 for pos in positions])
+        grids[swap] = swap_marks(grids[swap])
+        probabilities, values = self.network.forward(grids)
+        return probabilities, np.clip(values, -1.0, 1.0)
+
+    def _priors(self, node, pos, moves):
+        if not self.evaluated[node]:
+            # The root, when it was not a leaf of an earlier search
+            self.policy[node] = self._forward([pos])[0][0]
+            self.evaluated[node] = True
+        priors = self.policy[node, moves].astype(np.float64)
+        total = priors.sum()
+        return priors / total if total > 0 else 1.0 / len(moves)
+
+    def _select_child(self, node):
+        children = self.children[node]
+        children = children[children >= 0]
+        visits = self.visits[children] + self.virtual[children]
+        q = np.where(visits > 0, (self.value_sum[children] - self.virtual[children]) / np.maximum(visits, 1), 0.0)
+        u = self.c_puct * self.prior[children] * math.sqrt(max(visits.sum(), 1.0)) / (1 + visits)
+        return children[np.argmax(q + u)]
+
+    def _evaluate(self, positions, nodes):
+        probabilities, values = self._forward(positions)
+        self.policy[nodes] = probabilities
+        self.evaluated[nodes] = True
+        self.playouts += len(positions)
+        # The values are for the player to move at the leaf
+        return -values
+# %%
@@ -0,0 +1,327 @@
+#%%
+import itertools
+import math
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+try:
+    from .tournament import *
+except ImportError:
+    from tournament import *
+
+__all__ = [
+    "LADDER_PATH", "INITIAL_RATING", "INITIAL_RD", "expected_score", "glicko_update", "game_score",
+    "RatingLadder"
+]
+
+
+###########################################################
+### Glicko rating ladder kept in a sqlite database
+###########################################################
+
+# Database of the ladder, next to the checkpoints
+LADDER_PATH = Path(__file__).resolve().parent / "models" / "ladder.sqlite"
+
+# Glicko constants: rating and deviation of a new agent
+INITIAL_RATING = 1500.0
+INITIAL_RD = 350.0
+_Q = math.log(10) / 400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    name TEXT PRIMARY KEY,
+    spec TEXT NOT NULL,
+    rating REAL NOT NULL,
+    rd REAL NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    registered REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first TEXT NOT NULL,
+    second TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    score REAL NOT NULL,
+    status TEXT NOT NULL,
+    moves TEXT NOT NULL,
+    played REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_pair ON games (first, second);
+"""
+
+
+def _g(rd):
+    return 1 / math.sqrt(1 + 3*_Q**2*rd**2/math.pi**2)
+
+
+def expected_score(rating, opponent_rating, opponent_rd):
+    ''' Expected score of a player against an opponent, in the Glicko model
+
+    Parameters:
+    -----------
+    rating : float
+        Rating of the player.
+
+    opponent_rating : float
+        Rating of the opponent.
+
+    opponent_rd : float
+        Rating deviation of the opponent.
+
+    Returns:
+    --------
+    float
+        Expected score, between 0 (loss) and 1 (win).
+    '''
+    return 1 / (1 + 10**(-_g(opponent_rd)*(rating - opponent_rating)/400))
+
+
+def glicko_update(rating, rd, results):
+    ''' Glicko-1 update of a rating after a rating period
+
+    Parameters:
+    -----------
+    rating : float
+        Rating of the player.
+
+    rd : float
+        Rating deviation of the player.
+
+    results : list
+        (opponent rating, opponent rating deviation, score) of every game of
+        the period, the score being 1 for a win, 0.5 for a draw and 0 for a loss.
+
+    Returns:
+    --------
+    tuple
+        The new rating and rating deviation.
+    '''
+    if not results:
+        return rating, rd
+    variance, delta = 0.0, 0.0
+    for opponent_rating, opponent_rd, score in results:
+        g = _g(opponent_rd)
+        e = expected_score(rating, opponent_rating, opponent_rd)
+        variance += g**2 * e * (1 - e)
+        delta += g * (score - e)
+    precision = 1/rd**2 + _Q**2*variance
+    return rating + _Q/precision*delta, math.sqrt(1/precision)
+
+
+def game_score(result):
+    ''' Score of the first agent of a play_game result: invalid plays count as losses '''
+    first, second = result['rewards']
+    if first is None:
+        return 0.0
+    if second is None:
+        return 1.0
+    return (first - second + 2) / 4
+
+
+class RatingLadder:
+    ''' Ranks agents by playing the most informative pairings and keeping every result
+
+    The agents and the games are stored in a sqlite database, so a ladder is
+    resumed where it stopped and a new agent only plays the games needed to
+    place it. Ratings follow Glicko-1: each batch of games is one rating
+    period. Agents do not change once registered, so the rating deviations
+    are not inflated between periods.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        Database file, by default LADDER_PATH.
+
+    z : float, optional
+        Two agents are separated when their ratings differ by more than z
+        times the deviation of the difference, by default 1.96 (95%).
+    '''
+    def __init__(self, path=LADDER_PATH, z=1.96):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.z = z
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def register(self, name, spec=None):
+        ''' Adds an agent to the ladder (nothing is done if the name is taken)
+
+        Parameters:
+        -----------
+        name : str
+            Name of the agent in the ladder.
+
+        spec : str, optional
+            How to build the agent (see get_agent), by default the name.
+        '''
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO agents (name, spec, rating, rd, registered) VALUES (?, ?, ?, ?, ?)",
+                            (name, name if spec is None else str(spec), INITIAL_RATING, INITIAL_RD, time.time()))
+
+    def register_checkpoint(self, path, name=None, directory=None):
+        ''' Registers a PPO checkpoint, under a copy that later trainings do not overwrite
+
+        Parameters:
+        -----------
+        path : Path or str
+            Checkpoint saved by train_agent_rl.py, with or without ".zip".
+
+        name : str, optional
+            Name of the agent, by default the name of the file and its
+            modification time.
+
+        directory : Path, optional
+            Where the copy is kept, by default a "checkpoints" directory next
+            to the database.
+
+        Returns:
+        --------
+        str
+            The name of the agent.
+        '''
+        path = Path(path)
+        if path.suffix != ".zip":
+            path = path.with_name(path.name + ".zip")
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(path.stat().st_mtime))
+        if name is None:
+            name = f"{path.stem}-{stamp}"
+        directory = self.path.parent / "checkpoints" if directory is None else Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        copy = directory / f"{name}.zip"
+        if not copy.exists():
+            shutil.copy2(path, copy)
+        self.register(name, copy)
+        return name
+
+    def standings(self):
+        ''' Returns (name, rating, rating deviation, games) of every agent, best first '''
+        return self.db.execute("SELECT name, rating, rd, games FROM agents ORDER BY rating DESC").fetchall()
+
+    def separated(self, agent1, agent2):
+        ''' Returns True if the confidence intervals of two agents no longer overlap '''
+        ratings = dict((name, (rating, rd)) for name, rating, rd, _ in self.standings())
+        (r1, rd1), (r2, rd2) = ratings[agent1], ratings[agent2]
+        return abs(r1 - r2) > self.z * math.sqrt(rd1**2 + rd2**2)
+
+    def schedule(self, n_pairs=4, agents=None):
+        ''' Picks the pairings whose results are expected to tell the most
+
+        A pairing is worth as much as the variance of its result, weighted by
+        the uncertainty of the two ratings. Pairs that are already separated
+        are left out.
+
+        Parameters:
+        -----------
+        n_pairs : int, optional
+            Number of pairings, by default 4.
+
+        agents : list, optional
+            Only pair these agents with the others (e.g. a new checkpoint), by
+            default every agent.
+
+        Returns:
+        --------
+        list
+            (agent1, agent2) pairings, most informative first.
+        '''
+        ratings = dict((name, (rating, rd)) for name, rating, rd, _ in self.standings())
+        candidates = []
+        for a, b in itertools.combinations(sorted(ratings), 2):
+            if agents is not None and a not in agents and b not in agents:
+                continue
+            (ra, rda), (rb, rdb) = ratings[a], ratings[b]
+            if abs(ra - rb) > self.z * math.sqrt(rda**2 + rdb**2):
+                continue
+            e = expected_score(ra, rb, math.sqrt(rda**2 + rdb**2))
+            candidates.append(((rda**2 + rdb**2) * e * (1 - e), a, b))
+        candidates.sort(reverse=True)
+        return [(a, b) for _, a, b in candidates[:n_pairs]]
+
+    def record(self, games, results):
+        ''' Stores the results of a batch of games and updates the ratings
+
+        Parameters:
+        -----------
+        games : list
+            (first agent, second agent, seed) of every game, agents by name.
+
+        results : list
+            The play_game result of every game.
+        '''
+        ratings = dict((name, (rating, rd)) for name, rating, rd, _ in self.standings())
+        period = {}
+        now = time.time()
+        with self.db:
+            for (first, second, seed), result in zip(games, results):
+                score = game_score(result)
+                self.db.execute("INSERT INTO games (first, second, seed, score, status, moves, played) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (first, second, seed, score, result['status'],
+                                 "".join(str(col) for col in result['moves']), now))
+                period.setdefault(first, []).append(ratings[second] + (score,))
+                period.setdefault(second, []).append(ratings[first] + (1 - score,))
+            for name, period_results in period.items():
+                rating, rd = glicko_update(*ratings[name], period_results)
+                self.db.execute("UPDATE agents SET rating = ?, rd = ?, games = games + ? WHERE name = ?",
+                                (rating, rd, len(period_results), name))
+
+    def run(self, max_rounds=20, n_pairs=4, games_per_pair=10, agents=None, config=None, n_workers=None):
+        ''' Plays rounds of the most informative pairings until the ranking is settled
+
+        Each round plays games_per_pair games (each agent first in half of
+        them) for every scheduled pairing, all on one process pool. Games are
+        seeded from the number of games already in the database, so a
+        resumed ladder plays new games.
+
+        Parameters:
+        -----------
+        max_rounds : int, optional
+            Maximum number of rounds, by default 20.
+
+        n_pairs : int, optional
+            Pairings per round, by default 4.
+
+        games_per_pair : int, optional
+            Games per pairing and round, by default 10.
+
+        agents : list, optional
+            Only rank these agents against the others (e.g. a new
+            checkpoint), by default every agent.
+
+        config : dict, optional
+            Configuration of the game, by default DEFAULT_CONFIG.
+
+        n_workers : int, optional
+            Number of processes, by default the number of cores.
+
+        Returns:
+        --------
+        list
+            The standings at the end.
+        '''
+        specs = dict(self.db.execute("SELECT name, spec FROM agents").fetchall())
+        for _ in range(max_rounds):
+            pairs = self.schedule(n_pairs, agents)
+            # Stop early: every pair of agents is separated
+            if not pairs:
+                break
+            seed = self.db.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+            games = []
+            for k, (a, b) in enumerate(pairs):
+                games += [(first, second, s) for first, second, s, _ in
+                          schedule_match(a, b, games_per_pair, seed + k*games_per_pair)]
+            results = run_games([(specs[first], specs[second], s) for first, second, s in games], config, n_workers)
+            self.record(games, results)
+        return self.standings()
+# %%
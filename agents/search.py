@@ -0,0 +1,421 @@
+#%%
+import random
+import time
+import numpy as np
+
+try:
+    from .bitboard import *
+    from .transposition import *
+    from .windows import *
+except ImportError:
+    from bitboard import *
+    from transposition import *
+    from windows import *
+
+__all__ = ["SEARCH_KEYS", "SearchTimeout", "AlphaBetaSearch", "minimax_batch", "get_best_moves"]
+
+
+###########################################################
+### Alpha-beta search on bitboard positions
+###########################################################
+
+# The value of a node depends on the evaluated mark and on who is maximizing,
+# so both are mixed into the Zobrist hash: SEARCH_KEYS[mark][maximizingPlayer]
+_rng = random.Random(20240602)
+SEARCH_KEYS = [[0, 0]] + [[_rng.getrandbits(64), _rng.getrandbits(64)] for _ in range(2)]
+
+
+class SearchTimeout(Exception):
+    ''' Raised inside the search when its deadline has passed '''
+
+class AlphaBetaSearch:
+    ''' Minimax with alpha-beta pruning and move ordering
+
+    The search returns exactly the same values as minimax() for the best
+    moves: the leaves are scored with get_heuristic from the point of view of
+    mark, and only branches that cannot change the result are pruned. Moves
+    are tried center-first, then killer moves and history scores collected
+    during the search are used to find cutoffs earlier.
+
+    With a transposition table, positions reached through different move
+    orders are searched once. Stored values are only reused at the same
+    remaining depth, so the results stay those of a fixed-depth minimax;
+    the stored best moves are used for ordering at any depth.
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    table : TranspositionTable, optional
+        Table shared between searches, by default None (no table).
+
+    batch_depth : int, optional
+        Subtrees of this depth are searched with minimax_batch, by default 0
+        (every leaf is scored on its own). The pruning lost in those subtrees
+        costs more than batching saves on the default board.
+    '''
+    def __init__(self, config, table=None, batch_depth=0):
+        self.geometry = get_geometry(config)
+        self.config = config
+        self.table = table
+        # The boards are converted through uint64 arrays
+        self.batch_depth = batch_depth if self.geometry.columns * self.geometry.height <= 64 else 0
+        # time.perf_counter() value after which the search is aborted
+        self.deadline = None
+        center = (self.geometry.columns - 1) / 2
+        self.center_order = sorted(range(self.geometry.columns), key=lambda c: abs(c - center))
+        self.clear()
+
+    def clear(self):
+        ''' Forgets the killer moves and history scores '''
+        columns = self.geometry.columns
+        # Two killer moves per ply, and one history table per mark
+        self.killers = [[None, None] for _ in range(self.geometry.size + 1)]
+        self.history = [[0] * columns for _ in range(3)]
+        self.nodes = 0
+        self.leaves = 0
+        self.table_cutoffs = 0
+
+    def order_moves(self, pos, ply, mark, first=None):
+        ''' Returns the valid moves, most promising first
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position.
+
+        ply : int
+            Distance from the root of the search.
+
+        mark : int
+            The value of the piece to be dropped.
+
+        first : int, optional
+            Move to be searched first (e.g. from the transposition table).
+
+        Returns:
+        --------
+        list
+            The valid columns, in the order they should be searched.
+        '''
+        rows = self.geometry.rows
+        heights = pos.heights
+        history = self.history[mark]
+        moves = [c for c in self.center_order if heights[c] < rows]
+        # Stable sort: ties keep the center-first order
+        moves.sort(key=lambda c: -history[c])
+        for killer in reversed(self.killers[ply]):
+            if killer is not None and killer in moves:
+                moves.remove(killer)
+                moves.insert(0, killer)
+        if first is not None and first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+    def _cutoff(self, col, depth, ply, mark):
+        killers = self.killers[ply]
+        if killers[0] != col:
+            killers[1] = killers[0]
+            killers[0] = col
+        self.history[mark][col] += depth * depth
+
+    def alphabeta(self, pos, depth, alpha, beta, maximizingPlayer, mark, ply=0):
+        ''' Fail-soft alpha-beta search
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position. Moves are played and undone in place.
+
+        depth : int
+            The depth to which the search should go.
+
+        alpha : float
+            Lower bound of the search window.
+
+        beta : float
+            Upper bound of the search window.
+
+        maximizingPlayer : bool
+            True if the current player is maximizing, False if minimizing.
+
+        mark : int
+            The value of the piece to be evaluated.
+
+        ply : int, optional
+            Distance from the root of the search, by default 0.
+
+        Returns:
+        --------
+        float
+            The minimax value if it lies inside (alpha, beta), otherwise a
+            bound on the side of the window it fell out of.
+        '''
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 1023 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        table = self.table
+        table_move = None
+        if table is not None:
+            # A position and its mirror image share their entry, stored as seen from the smaller hash
+            mirrored = pos.mirror_hash < pos.hash
+            key = (pos.mirror_hash if mirrored else pos.hash) ^ SEARCH_KEYS[mark][maximizingPlayer]
+            entry = table.probe(key)
+            if entry is not None:
+                table_move = entry[4]
+                if mirrored and table_move is not None:
+                    table_move = self.geometry.columns - 1 - table_move
+                if entry[1] == depth:
+                    bound, value = entry[2], entry[3]
+                    if bound == LOWER and value > alpha:
+                        alpha = value
+                    elif bound == UPPER and value < beta:
+                        beta = value
+                    if bound == EXACT or alpha >= beta:
+                        self.table_cutoffs += 1
+                        return value
+
+        # Only the player that just moved can have completed a line
+        if (depth == 0 or pos.n_moves == self.geometry.size
+                or (pos.history and pos.connected(pos.masks[pos.history[-1][1]]))):
+            self.leaves += 1
+            value = get_heuristic_position(pos, mark)
+            if table is not None:
+                table.store(key, depth, EXACT, value, None)
+            return value
+
+        if depth <= self.batch_depth:
+            value, best_move = self._evaluate_subtree(pos, depth, maximizingPlayer, mark)
+            if table is not None:
+                table.store(key, depth, EXACT, value,
+                            self.geometry.columns - 1 - best_move if mirrored and best_move is not None else best_move)
+            return value
+
+        alpha0, beta0 = alpha, beta
+        best_move = None
+        if maximizingPlayer:
+            value = -np.inf
+            for col in self.order_moves(pos, ply, mark, table_move):
+                pos.play(col, mark)
+                child = self.alphabeta(pos, depth-1, alpha, beta, False, mark, ply+1)
+                pos.undo()
+                if child > value:
+                    value = child
+                    best_move = col
+                    if value > alpha:
+                        alpha = value
+                        if alpha >= beta:
+                            self._cutoff(col, depth, ply, mark)
+                            break
+        else:
+            opp = mark%2+1
+            value = np.inf
+            for col in self.order_moves(pos, ply, opp, table_move):
+                pos.play(col, opp)
+                child = self.alphabeta(pos, depth-1, alpha, beta, True, mark, ply+1)
+                pos.undo()
+                if child < value:
+                    value = child
+                    best_move = col
+                    if value < beta:
+                        beta = value
+                        if alpha >= beta:
+                            self._cutoff(col, depth, ply, opp)
+                            break
+
+        if table is not None:
+            bound = UPPER if value <= alpha0 else LOWER if value >= beta0 else EXACT
+            if mirrored:
+                best_move = self.geometry.columns - 1 - best_move
+            table.store(key, depth, bound, value, best_move)
+        return value
+
+    def _evaluate_subtree(self, pos, depth, maximizingPlayer, mark):
+        value, best_move, n_leaves = minimax_batch(pos, depth, maximizingPlayer, mark)
+        self.nodes += n_leaves
+        self.leaves += n_leaves
+        return value, best_move
+
+    def score_moves(self, pos, depth, mark, order=None):
+        ''' Scores every valid move of the root position
+
+        The scores of the best moves are exact (equal to score_move), the
+        other moves only get an upper bound that is lower than the best score.
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position. It is left unchanged.
+
+        depth : int
+            The number of steps to look ahead, as nsteps in score_move.
+
+        mark : int
+            The value of the piece to be dropped.
+
+        order : list, optional
+            Order in which the moves are searched, by default order_moves().
+
+        Returns:
+        --------
+        scores : dict
+            Score of each valid column.
+        '''
+        if order is None:
+            order = self.order_moves(pos, 0, mark)
+        scores = {}
+        best = -np.inf
+        for col in order:
+            pos.play(col, mark)
+            # Half a point below the best score: ties with the best move are
+            # still searched exactly (the heuristic only takes integer values)
+            scores[col] = self.alphabeta(pos, depth-1, best - 0.5, np.inf, False, mark, 1)
+            pos.undo()
+            best = max(best, scores[col])
+        return scores
+
+    def iterative_deepening(self, pos, mark, deadline, max_depth=None):
+        ''' Searches deeper and deeper until the deadline
+
+        Each iteration starts with the best moves of the previous one, and
+        the killer moves, history scores and transposition table it filled
+        order the moves of the next one. The first iteration always
+        completes, so there is a move to return however short the budget.
+
+        Parameters:
+        -----------
+        pos : Position
+            The current position. It is left unchanged.
+
+        mark : int
+            The value of the piece to be dropped.
+
+        deadline : float
+            time.perf_counter() value at which the search must stop.
+
+        max_depth : int, optional
+            Depth at which to stop even if there is time left, by default
+            the number of empty cells.
+
+        Returns:
+        --------
+        scores : dict
+            Score of each valid column at the last completed depth.
+
+        depth : int
+            The last completed depth.
+        '''
+        empty = self.geometry.size - pos.n_moves
+        if max_depth is None or max_depth > empty:
+            max_depth = empty
+        n_played = len(pos.history)
+        scores = self.score_moves(pos, 1, mark)
+        depth = 1
+        self.deadline = deadline
+        try:
+            while depth < max_depth and time.perf_counter() < deadline:
+                # Best moves of the previous iteration first
+                order = sorted(scores, key=lambda col: -scores[col])
+                scores = self.score_moves(pos, depth+1, mark, order)
+                depth += 1
+        except SearchTimeout:
+            # Take back the moves of the interrupted iteration
+            while len(pos.history) > n_played:
+                pos.undo()
+        finally:
+            self.deadline = None
+        return scores, depth
+
+
+def minimax_batch(pos, depth, maximizingPlayer, mark):
+    ''' Minimax without pruning, all the leaves being scored in one batch
+
+    The subtree is expanded first, then its leaves are converted to boards
+    and scored with a single call to get_heuristic_batch. The boards must fit
+    in 64 bits (columns * (rows+1) <= 64).
+
+    Parameters:
+    -----------
+    pos : Position
+        The current position. It is left unchanged.
+
+    depth : int
+        The depth to which the minimax algorithm should search.
+
+    maximizingPlayer : bool
+        True if the current player is maximizing, False if minimizing.
+
+    mark : int
+        The value of the piece to be evaluated.
+
+    Returns:
+    --------
+    value : float
+        The minimax value of the position.
+
+    best_move : int or None
+        A move reaching that value, None if the position is a leaf.
+
+    n_leaves : int
+        The number of leaves scored.
+    '''
+    geometry = pos.geometry
+    masks1, masks2 = [], []
+
+    def expand(depth, maximizing):
+        if depth == 0 or pos.n_moves == geometry.size or pos.connected(pos.masks[pos.history[-1][1]]):
+            masks1.append(pos.masks[1])
+            masks2.append(pos.masks[2])
+            return len(masks1) - 1
+        player = mark if maximizing else mark%2+1
+        moves = pos.valid_moves()
+        children = []
+        for col in moves:
+            pos.play(col, player)
+            children.append(expand(depth-1, not maximizing))
+            pos.undo()
+        return maximizing, moves, children
+
+    def reduce(node):
+        if not isinstance(node, tuple):
+            return values[node], None
+        maximizing, moves, children = node
+        child_values = [reduce(child)[0] for child in children]
+        best = max(child_values) if maximizing else min(child_values)
+        return best, moves[child_values.index(best)]
+
+    if depth == 0 or pos.is_terminal():
+        return get_heuristic_position(pos, mark), None, 1
+    # The root is not terminal, every other node is checked by expand()
+    player = mark if maximizingPlayer else mark%2+1
+    moves = pos.valid_moves()
+    children = []
+    for col in moves:
+        pos.play(col, player)
+        children.append(expand(depth-1, not maximizingPlayer))
+        pos.undo()
+    # The geometry has the rows, columns and inarow of the game configuration
+    boards = boards_from_masks(masks1, masks2, geometry)
+    values = get_heuristic_batch(boards, mark, geometry).tolist()
+    value, best_move = reduce((maximizingPlayer, moves, children))
+    return value, best_move, len(values)
+
+
+def get_best_moves(scores):
+    ''' Returns the columns with the highest score, in increasing order
+
+    Parameters:
+    -----------
+    scores : dict
+        Score of each valid column.
+
+    Returns:
+    --------
+    list
+        Columns (moves) that maximize the score.
+    '''
+    best = max(scores.values())
+    return [col for col in sorted(scores) if scores[col] == best]
+# %%
@@ -0,0 +1,359 @@
+#%%
+import random
+import time
+from pathlib import Path
+
+try:
+    from .bitboard import *
+    from .game import *
+    from .opening_book import *
+    from .search import *
+except ImportError:
+    from bitboard import *
+    from game import *
+    from opening_book import *
+    from search import *
+
+__all__ = ["TABLEBASE_PATH", "Solver", "get_solver", "distance_to_end", "TABLEBASE", "build_tablebase"]
+
+
+###########################################################
+### Exact solver
+###########################################################
+
+# Tablebase of solved late-game positions, in the format of the opening book
+TABLEBASE_PATH = Path(__file__).resolve().parent / "models" / "tablebase.bin"
+
+
+class Solver:
+    ''' Exact negamax solver of Connect Four (4 in a row)
+
+    Scores follow the usual convention: 0 is a draw, a positive score is a
+    win of the player to move, the faster the higher (size+1-n)//2 where n
+    is the number of discs on the board when the winning disc is dropped,
+    and a negative score is a loss. The root score is found by null-window
+    searches narrowing [min, max], each one an alpha-beta negamax over
+    bitboards with a transposition table, moves that lose at once left
+    out, and the moves creating the most threats searched first.
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    max_entries : int, optional
+        Entries kept in the transposition table before it is cleared, by
+        default 2**18 (about 50 MB).
+    '''
+    def __init__(self, config, max_entries=2**18):
+        geometry = get_geometry(config)
+        if geometry.inarow != 4:
+            raise ValueError("The solver only supports 4 in a row")
+        self.geometry = geometry
+        self.size = geometry.size
+        self.max_entries = max_entries
+        self.table = {}
+        self.nodes = 0
+        self.deadline = None
+        center = geometry.columns // 2
+        self.order = sorted(range(geometry.columns), key=lambda c: abs(c - center))
+        self.column_masks = [geometry.column_masks[c] for c in self.order]
+
+    def clear(self):
+        ''' Empties the transposition table '''
+        self.table = {}
+
+    def _winning_cells(self, position, mask):
+        # Empty cells that would complete 4 in a row for the discs in position
+        height = self.geometry.height
+        r = (position << 1) & (position << 2) & (position << 3)
+        for shift in (height, height - 1, height + 1):
+            p = (position << shift) & (position << 2*shift)
+            r |= p & (position << 3*shift)
+            r |= p & (position >> shift)
+            p = (position >> shift) & (position >> 2*shift)
+            r |= p & (position << shift)
+            r |= p & (position >> 3*shift)
+        return r & (self.geometry.board_mask ^ mask)
+
+    def _non_losing_moves(self, current, mask):
+        # Moves (one bit each) after which the opponent cannot win at once
+        possible = (mask + self.geometry.bottom_mask) & self.geometry.board_mask
+        opponent_win = self._winning_cells(current ^ mask, mask)
+        forced = possible & opponent_win
+        if forced:
+            if forced & (forced - 1):
+                return 0
+            possible = forced
+        return possible & ~(opponent_win >> 1)
+
+    def _negamax(self, current, mask, n_moves, alpha, beta):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 4095 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        size = self.size
+        moves = self._non_losing_moves(current, mask)
+        if not moves:
+            return -((size - n_moves) // 2)
+        if n_moves >= size - 2:
+            return 0
+        low = -((size - 2 - n_moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = (size - 1 - n_moves) // 2
+        key = current + mask
+        entry = self.table.get(key)
+        if entry is not None:
+            lower, upper = entry
+            if lower >= beta:
+                return lower
+            if upper <= alpha:
+                return upper
+            if lower > alpha:
+                alpha = lower
+            if upper < high:
+                high = upper
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        # Moves creating the most threats first, center columns first on ties
+        candidates = []
+        for i, column_mask in enumerate(self.column_masks):
+            move = moves & column_mask
+            if move:
+                threats = popcount(self._winning_cells(current | move, mask | move))
+                candidates.append((-threats, i, move))
+        candidates.sort()
+
+        alpha0 = alpha
+        opponent = current ^ mask
+        for _, _, move in candidates:
+            score = -self._negamax(opponent, mask | move, n_moves + 1, -beta, -alpha)
+            if score >= beta:
+                self._store(key, score, size)
+                return score
+            if score > alpha:
+                alpha = score
+        if alpha > alpha0:
+            self._store(key, alpha, alpha)
+        else:
+            self._store(key, -size, alpha)
+        return alpha
+
+    def _store(self, key, lower, upper):
+        # Keeps the tightest bounds known for the position
+        if len(self.table) >= self.max_entries:
+            self.table = {}
+        entry = self.table.get(key)
+        if entry is not None:
+            lower, upper = max(lower, entry[0]), min(upper, entry[1])
+        self.table[key] = (lower, upper)
+
+    def _solve(self, current, mask, n_moves):
+        # Exact score of a position where the player to move cannot win at once
+        size = self.size
+        low, high = -((size - n_moves) // 2), (size + 1 - n_moves) // 2
+        while low < high:
+            # Bisect, but closer to 0 first: wins and losses far away are rarer
+            med = low + (high - low) // 2
+            if med <= 0 and -(-low // 2) < med:
+                med = -(-low // 2)
+            elif med >= 0 and high // 2 > med:
+                med = high // 2
+            score = self._negamax(current, mask, n_moves, med, med + 1)
+            if score <= med:
+                high = score
+            else:
+                low = score
+        return low
+
+    def _split(self, pos):
+        current = pos.masks[pos.mark]
+        return current, pos.masks[1] | pos.masks[2]
+
+    def solve(self, pos, deadline=None):
+        ''' Exact score of a position for the player to move
+
+        Parameters:
+        -----------
+        pos : Position
+            The position, which must not be finished.
+
+        deadline : float, optional
+            time.perf_counter() value at which to give up by raising
+            SearchTimeout, by default None (no limit).
+
+        Returns:
+        --------
+        int
+            The score (see Solver).
+        '''
+        current, mask = self._split(pos)
+        if self._winning_cells(current, mask) & ((mask + self.geometry.bottom_mask) & self.geometry.board_mask):
+            return (self.size + 1 - pos.n_moves) // 2
+        self.deadline = deadline
+        try:
+            return self._solve(current, mask, pos.n_moves)
+        finally:
+            self.deadline = None
+
+    def score_moves(self, pos, deadline=None):
+        ''' Exact score of every valid move, for the player to move
+
+        Parameters:
+        -----------
+        pos : Position
+            The position, which must not be finished. It is left unchanged.
+
+        deadline : float, optional
+            time.perf_counter() value at which to give up by raising
+            SearchTimeout, by default None (no limit).
+
+        Returns:
+        --------
+        dict
+            Score of each valid column.
+        '''
+        scores = {}
+        self.deadline = deadline
+        try:
+            for col in pos.valid_moves():
+                if pos.is_winning_move(col):
+                    scores[col] = (self.size + 1 - pos.n_moves) // 2
+                    continue
+                pos.play(col)
+                if pos.is_full():
+                    scores[col] = 0
+                else:
+                    current, mask = self._split(pos)
+                    if self._winning_cells(current, mask) & ((mask + self.geometry.bottom_mask)
+                                                             & self.geometry.board_mask):
+                        scores[col] = -((self.size + 1 - pos.n_moves) // 2)
+                    else:
+                        scores[col] = -self._solve(current, mask, pos.n_moves)
+                pos.undo()
+        finally:
+            self.deadline = None
+        return scores
+
+
+_SOLVERS = {}
+
+def get_solver(config):
+    ''' Returns the (cached) Solver of the game configuration, None if it cannot be solved
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    Solver or None
+        The solver shared by the agents of this process, None unless 4 in a row.
+    '''
+    key = (config.rows, config.columns, config.inarow)
+    if key not in _SOLVERS:
+        _SOLVERS[key] = Solver(config) if config.inarow == 4 else None
+    return _SOLVERS[key]
+
+
+def distance_to_end(score, n_moves, size=42):
+    ''' Number of plies until the end of the game under perfect play
+
+    Parameters:
+    -----------
+    score : int
+        Score of the position for the player to move (see Solver).
+
+    n_moves : int
+        Number of discs on the board.
+
+    size : int, optional
+        Number of cells of the board, by default 42.
+
+    Returns:
+    --------
+    int
+        Plies until the winning disc is dropped, or until the board is full
+        for a draw.
+    '''
+    if score == 0:
+        return size - n_moves
+    if score < 0:
+        return 1 + distance_to_end(-score, n_moves + 1, size)
+    last = size + 1 - 2*score - (size + 1 - n_moves) % 2
+    return last - n_moves + 1
+
+
+# Tablebase shared by the agents of this process
+TABLEBASE = OpeningBook(TABLEBASE_PATH)
+
+
+def build_tablebase(path=TABLEBASE_PATH, n_games=2000, min_discs=20, agents=("random", "agent_q1", "agent_q2", "agent_q3"),
+                    seed=0, config=None, verbose=False):
+    ''' Solves the late-game positions of sampled games and writes the tablebase
+
+    The games are played between the given agents (every pairing, either
+    side first). Every position with at least min_discs discs that is not
+    finished is solved exactly, mirror images counted once, and stored with
+    its best moves and score in the format of the opening book.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The tablebase file, by default TABLEBASE_PATH.
+
+    n_games : int, optional
+        Number of games sampled, by default 2000.
+
+    min_discs : int, optional
+        Positions with fewer discs are left out, by default 20.
+
+    agents : tuple, optional
+        Agents playing the sampled games, by default random, agent_q1,
+        agent_q2 and agent_q3.
+
+    seed : int, optional
+        Seed of the games, by default 0.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    verbose : bool, optional
+        Print the progress every 100 games, by default False.
+
+    Returns:
+    --------
+    int
+        The number of positions in the tablebase.
+    '''
+    if config is None:
+        config = DEFAULT_CONFIG
+    solver = Solver(config)
+    players = [get_agent(agent) for agent in agents]
+    solved = {}
+    start = time.perf_counter()
+    for game in range(n_games):
+        result = play_game(players[game % len(players)], players[(game // len(players)) % len(players)],
+                           config, seed + game)
+        pos = Position(config)
+        for col in result['moves']:
+            if pos.n_moves >= min_discs and not pos.is_terminal():
+                key, mirrored = pos.canonical_key()
+                if key not in solved:
+                    canonical = pos.mirrored() if mirrored else pos
+                    scores = solver.score_moves(canonical)
+                    best = get_best_moves(scores)
+                    solved[key] = (sum(1 << c for c in best), scores[best[0]])
+            pos.play(col)
+        if verbose and (game + 1) % 100 == 0:
+            print(f"{game + 1} games, {len(solved)} positions, {time.perf_counter() - start:.0f}s")
+    keys = list(solved)
+    write_book(path, keys, [solved[k][0] for k in keys], [solved[k][1] for k in keys], config, max_ply=min_discs)
+    return len(keys)
+# %%
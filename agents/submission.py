@@ -0,0 +1,187 @@
+#%%
+import io
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from .numpy_policy import *
+except ImportError:
+    from numpy_policy import *
+
+__all__ = [
+    "CHECKPOINT_PATH", "SUBMISSION_PATH", "policy_weights", "extract_policy_weights", "load_numpy_policy",
+    "save_weights", "build_submission", "load_submission"
+]
+
+
+###########################################################
+### Standalone submission file of the RL agent
+###########################################################
+
+# Checkpoint of agent_rl, and the file built from it (at the root of the project)
+CHECKPOINT_PATH = Path(__file__).resolve().parent / "models" / "ppo.zip"
+SUBMISSION_PATH = Path(__file__).resolve().parents[1] / "submission.py"
+
+# Layers of the policy the submission needs, by their name in the state dict
+_EXTRACTORS = ("features_extractor.", "pi_features_extractor.", "vf_features_extractor.")
+_LAYERS = ("cnn.0.weight", "cnn.0.bias", "cnn.2.weight", "cnn.2.bias", "linear.0.weight", "linear.0.bias")
+_HEADS = ("mlp_extractor.policy_net.0.weight", "mlp_extractor.policy_net.0.bias",
+          "mlp_extractor.policy_net.2.weight", "mlp_extractor.policy_net.2.bias",
+          "mlp_extractor.value_net.0.weight", "mlp_extractor.value_net.0.bias",
+          "mlp_extractor.value_net.2.weight", "mlp_extractor.value_net.2.bias",
+          "action_net.weight", "action_net.bias", "value_net.weight", "value_net.bias")
+
+_AGENT_SOURCE = '''
+DETERMINISTIC = {deterministic}
+
+# Loaded once, when kaggle imports the file
+POLICY = NumpyPolicy(unpack_weights(WEIGHTS))
+
+
+def agent(obs, config):
+    board = np.asarray(obs['board'], dtype=np.float32).reshape(1, config.rows, config.columns)
+    valid = board[0, 0] == 0
+    probabilities = POLICY.probabilities(board)[0].astype(np.float64) * valid
+    if probabilities.sum() <= 0:
+        return int(np.random.choice(np.flatnonzero(valid)))
+    if DETERMINISTIC:
+        return int(np.argmax(probabilities))
+    return int(np.random.choice(len(probabilities), p=probabilities / probabilities.sum()))
+'''
+
+
+def policy_weights(state):
+    ''' Selects the arrays of a policy state dict that NumpyPolicy needs
+
+    The pi_ and vf_ features extractors are left out when they are copies of
+    the shared one.
+
+    Parameters:
+    -----------
+    state : dict
+        Arrays of the state dict of the policy, by name.
+
+    Returns:
+    --------
+    dict
+        float32 arrays named as in the state dict.
+    '''
+    names = list(_HEADS)
+    for prefix in _EXTRACTORS:
+        if prefix + _LAYERS[0] not in state:
+            continue
+        if prefix != _EXTRACTORS[0] and all(np.array_equal(state[prefix + layer], state[_EXTRACTORS[0] + layer])
+                                            for layer in _LAYERS):
+            continue
+        names += [prefix + layer for layer in _LAYERS]
+    return {name: np.asarray(state[name], dtype=np.float32) for name in names}
+
+
+def extract_policy_weights(path=CHECKPOINT_PATH):
+    ''' Reads the weights of the policy from a PPO checkpoint, as NumPy arrays
+
+    Only torch is needed (policy.pth is a torch state dict), not
+    stable_baselines3.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The .zip checkpoint, by default CHECKPOINT_PATH.
+
+    Returns:
+    --------
+    dict
+        float32 arrays named as in the state dict (see policy_weights).
+    '''
+    import torch
+
+    with zipfile.ZipFile(path) as archive:
+        state = {name: tensor.numpy() for name, tensor in
+                 torch.load(io.BytesIO(archive.read("policy.pth")), map_location="cpu").items()}
+    return policy_weights(state)
+
+
+def load_numpy_policy(path=CHECKPOINT_PATH):
+    ''' Loads the policy of a PPO checkpoint as a NumpyPolicy (a loader for ModelRegistry) '''
+    return NumpyPolicy(extract_policy_weights(path))
+
+
+def save_weights(path, weights):
+    ''' Writes the arrays of a NumpyPolicy to an .npz file, replacing it at once
+
+    Parameters:
+    -----------
+    path : Path or str
+        The .npz file.
+
+    weights : dict
+        Arrays by name, e.g. from policy_weights.
+    '''
+    path = Path(path)
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "wb") as f:
+        np.savez(f, **weights)
+    os.replace(temporary, path)
+
+
+def build_submission(path=SUBMISSION_PATH, checkpoint=CHECKPOINT_PATH, deterministic=False):
+    ''' Writes a single-file kaggle agent playing the policy of a checkpoint
+
+    The file holds the NumPy forward pass of numpy_policy.py, the weights
+    packed as base64 and an agent function, last in the file as kaggle
+    expects. It imports nothing but NumPy, so it starts in milliseconds
+    where agent_rl loads stable_baselines3, torch and the checkpoint.
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The submission file, by default SUBMISSION_PATH.
+
+    checkpoint : Path or str, optional
+        The PPO checkpoint, by default CHECKPOINT_PATH.
+
+    deterministic : bool, optional
+        Play the most likely column instead of sampling the policy as
+        model.predict does, by default False.
+
+    Returns:
+    --------
+    int
+        The size of the file in bytes.
+    '''
+    policy_source = Path(__file__).resolve().with_name("numpy_policy.py").read_text()
+    policy_source = "\n".join(line for line in policy_source.splitlines() if line.strip() not in ("#%%", "# %%"))
+    source = "\n".join([
+        f"# Standalone agent built by agents/submission.py from {Path(checkpoint).name}: do not edit",
+        policy_source.strip(),
+        "",
+        "",
+        f'WEIGHTS = "{pack_weights(extract_policy_weights(checkpoint))}"',
+        _AGENT_SOURCE.format(deterministic=bool(deterministic)),
+    ])
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(source)
+    return path.stat().st_size
+
+
+def load_submission(path=SUBMISSION_PATH):
+    ''' Returns the agent of a submission file, the last function it defines (as kaggle does)
+
+    Parameters:
+    -----------
+    path : Path or str, optional
+        The submission file, by default SUBMISSION_PATH.
+
+    Returns:
+    --------
+    function
+        The agent, taking (obs, config).
+    '''
+    namespace = {"__name__": Path(path).stem, "__file__": str(path)}
+    exec(compile(Path(path).read_text(), str(path), "exec"), namespace)
+    return [value for value in namespace.values() if callable(value)][-1]
+# %%
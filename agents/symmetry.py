@@ -0,0 +1,99 @@
+#%%
+import numpy as np
+
+try:
+    from .bitboard import *
+except ImportError:
+    from bitboard import *
+
+__all__ = [
+    "mirror_column", "mirror_board", "mirror_grids", "canonical_key", "canonical_hash", "augment_mirror"
+]
+
+
+###########################################################
+### Mirror symmetry across the center column
+###########################################################
+# A position and its mirror image have the same value, and the best moves of
+# one are the mirrored best moves of the other. Caches keyed on a canonical
+# form (the smaller of the two) store each pair of positions once, with a
+# flag telling whether the position at hand is the mirrored one.
+
+def mirror_column(col, config):
+    ''' Returns the column that col is reflected to '''
+    return config.columns - 1 - col
+
+
+def mirror_board(board, config):
+    ''' Returns a kaggle board (obs.board) reflected across the center column
+
+    Parameters:
+    -----------
+    board : list
+        The flattened board, row-major with the top row first.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    list
+        The mirrored board.
+    '''
+    columns = config.columns
+    return [board[r*columns + columns - 1 - c] for r in range(config.rows) for c in range(columns)]
+
+
+def mirror_grids(grids):
+    ''' Returns grids of shape (..., rows, columns) reflected across the center column (a view) '''
+    return np.asarray(grids)[..., ::-1]
+
+
+def canonical_key(pos):
+    ''' Returns the canonical integer key of a Position and the mirror flag
+
+    The key is unique (Position.key), so it can index a file or a table
+    without collisions, as the opening book and the tablebase do.
+    '''
+    return pos.canonical_key()
+
+
+def canonical_hash(pos):
+    ''' Returns the canonical Zobrist hash of a Position and the mirror flag
+
+    Both hashes are kept up to date by play() and undo(), so this costs a
+    comparison: it is the key of the transposition table of the search.
+    '''
+    return (pos.mirror_hash, True) if pos.mirror_hash < pos.hash else (pos.hash, False)
+
+
+def augment_mirror(observations, actions=None, *arrays):
+    ''' Appends the mirror images of a batch of training samples
+
+    Parameters:
+    -----------
+    observations : numpy array
+        Observations of shape (n, ..., rows, columns), e.g. (n, 1, 6, 7).
+
+    actions : numpy array, optional
+        Columns played (n,), or per-column arrays (n, columns) such as
+        policies, mirrored accordingly.
+
+    *arrays : numpy array
+        Other per-sample arrays (values, returns, ...), repeated unchanged.
+
+    Returns:
+    --------
+    tuple
+        The 2n observations, actions and other arrays.
+    '''
+    observations = np.asarray(observations)
+    result = [np.concatenate([observations, mirror_grids(observations)])]
+    if actions is not None:
+        actions = np.asarray(actions)
+        columns = observations.shape[-1]
+        mirrored = actions[..., ::-1] if actions.ndim > 1 else columns - 1 - actions
+        result.append(np.concatenate([actions, mirrored]))
+    result += [np.concatenate([a, a]) for a in map(np.asarray, arrays)]
+    return tuple(result)
+# %%
@@ -0,0 +1,261 @@
+#%%
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .game import *
+    from .game_records import *
+    from .profiling import *
+except ImportError:
+    from game import *
+    from game_records import *
+    from profiling import *
+
+__all__ = ["schedule_match", "run_games", "summarize_match", "play_match", "round_robin"]
+
+
+###########################################################
+### Tournaments played on a process pool
+###########################################################
+
+# Agents already resolved in this process, by name
+_AGENTS = {}
+
+
+def _resolve(agent):
+    if callable(agent):
+        return agent
+    if agent not in _AGENTS:
+        _AGENTS[agent] = get_agent(agent)
+    return _AGENTS[agent]
+
+
+def _play_games(tasks, config, profile=False):
+    # Runs in the workers: tasks are (game index, first agent, second agent, seed)
+    results = []
+    for index, agent1, agent2, seed in tasks:
+        if profile:
+            n_records = len(PROFILER.records)
+            with PROFILER.recording():
+                result = play_game(_resolve(agent1), _resolve(agent2), config, seed)
+            result['profile'] = PROFILER.records[n_records:]
+            del PROFILER.records[n_records:]
+        else:
+            result = play_game(_resolve(agent1), _resolve(agent2), config, seed)
+        result['index'] = index
+        results.append(result)
+    return results
+
+
+def schedule_match(agent1, agent2, n_games, seed=0):
+    ''' Lists the games of a match, each agent playing first in half of them
+
+    Parameters:
+    -----------
+    agent1 : str or function
+        First agent (see get_agent).
+
+    agent2 : str or function
+        Second agent.
+
+    n_games : int
+        Number of games.
+
+    seed : int, optional
+        Seed of the first game, by default 0. Game i is seeded with seed + i,
+        whatever the number of workers.
+
+    Returns:
+    --------
+    list
+        (first agent, second agent, seed, swapped) of every game, swapped
+        being True when agent2 plays first.
+    '''
+    return [(agent2, agent1, seed + i, True) if i % 2 else (agent1, agent2, seed + i, False)
+            for i in range(n_games)]
+
+
+def run_games(games, config=None, n_workers=None, chunk_size=None, profile=False, records=None):
+    ''' Plays a list of games, sharded across a process pool
+
+    Parameters:
+    -----------
+    games : list
+        (first agent, second agent, seed, ...) of every game. Agents given by
+        name are resolved once per worker, agent functions must be picklable
+        (defined at the top level of a module).
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    n_workers : int, optional
+        Number of processes, by default the number of cores. 1 plays the
+        games in this process.
+
+    chunk_size : int, optional
+        Number of games sent to a worker at once, by default enough for
+        about 4 chunks per worker.
+
+    profile : bool, optional
+        Profile the moves of the profiled agents in the workers, by default
+        False. The records of each game are in its result (profile) and are
+        added to PROFILER of this process.
+
+    records : str, Path or GameRecordWriter, optional
+        Game records to which the games are appended (see write_games), by
+        default None.
+
+    Returns:
+    --------
+    list
+        The result of play_game of every game, in the order of games.
+    '''
+    config = Struct(DEFAULT_CONFIG if config is None else config)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    tasks = [(i, game[0], game[1], game[2]) for i, game in enumerate(games)]
+    if n_workers <= 1 or len(tasks) <= 1:
+        results = _play_games(tasks, config, profile)
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, len(tasks) // (4*n_workers))
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        results = [None] * len(tasks)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for chunk in executor.map(_play_games, chunks, itertools.repeat(config), itertools.repeat(profile)):
+                for result in chunk:
+                    results[result['index']] = result
+    if profile:
+        for result in results:
+            PROFILER.records += result['profile']
+    if records is not None:
+        write_games(records, games, results, config)
+    return results
+
+
+def summarize_match(results, swapped):
+    ''' Aggregates the games of a match from the point of view of its first agent
+
+    Parameters:
+    -----------
+    results : list
+        Results of play_game.
+
+    swapped : list
+        True for the games where the second agent of the match played first.
+
+    Returns:
+    --------
+    dict
+        games, wins, losses, draws, invalid plays of each agent (invalid,
+        invalid_opponent: invalid moves, errors and timeouts), and the move
+        times of each agent (times, times_opponent: mean, p95 and max seconds).
+    '''
+    summary = dict(games=len(results), wins=0, losses=0, draws=0, invalid=0, invalid_opponent=0)
+    times = [[], []]
+    for result, swap in zip(results, swapped):
+        rewards = result['rewards'][::-1] if swap else result['rewards']
+        move_times = result['times'][::-1] if swap else result['times']
+        if rewards[0] is None:
+            summary['invalid'] += 1
+        elif rewards[1] is None:
+            summary['invalid_opponent'] += 1
+        elif rewards[0] == 1:
+            summary['wins'] += 1
+        elif rewards[0] == -1:
+            summary['losses'] += 1
+        else:
+            summary['draws'] += 1
+        times[0] += move_times[0]
+        times[1] += move_times[1]
+    for key, values in zip(('times', 'times_opponent'), times):
+        values = np.array(values)
+        summary[key] = dict(mean=float(values.mean()), p95=float(np.percentile(values, 95)),
+                            max=float(values.max())) if len(values) else {}
+    return summary
+
+
+def play_match(agent1, agent2, n_games=100, seed=0, config=None, n_workers=None, profile=False, records=None):
+    ''' Plays a match between two agents on a process pool
+
+    Parameters:
+    -----------
+    agent1 : str or function
+        First agent (see get_agent).
+
+    agent2 : str or function
+        Second agent.
+
+    n_games : int, optional
+        Number of games, by default 100. Each agent plays first in half of them.
+
+    seed : int, optional
+        Seed of the first game, by default 0.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    n_workers : int, optional
+        Number of processes, by default the number of cores.
+
+    profile : bool, optional
+        Record the moves in PROFILER, by default False (see run_games).
+
+    records : str, Path or GameRecordWriter, optional
+        Game records to which the games are appended, by default None.
+
+    Returns:
+    --------
+    dict
+        The summary of summarize_match, and the results of every game (results).
+    '''
+    games = schedule_match(agent1, agent2, n_games, seed)
+    results = run_games(games, config, n_workers, profile=profile, records=records)
+    summary = summarize_match(results, [game[3] for game in games])
+    summary['results'] = results
+    return summary
+
+
+def round_robin(agents, n_games=100, seed=0, config=None, n_workers=None, records=None):
+    ''' Plays a match between every pair of agents, all games sharing one process pool
+
+    Parameters:
+    -----------
+    agents : list
+        Agents (see get_agent), e.g. ["random", "agent_q1", "agent_q3", "agent_minimax"].
+
+    n_games : int, optional
+        Number of games per pair, by default 100.
+
+    seed : int, optional
+        Seed of the first game of every pair, by default 0.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    n_workers : int, optional
+        Number of processes, by default the number of cores.
+
+    records : str, Path or GameRecordWriter, optional
+        Game records to which the games are appended, by default None.
+
+    Returns:
+    --------
+    dict
+        (name of agent1, name of agent2) -> summary of their match
+        (see play_match), for every pair.
+    '''
+    pairs = list(itertools.combinations(agents, 2))
+    schedules = [schedule_match(agent1, agent2, n_games, seed) for agent1, agent2 in pairs]
+    results = run_games([game for games in schedules for game in games], config, n_workers, records=records)
+    summaries = {}
+    for k, ((agent1, agent2), games) in enumerate(zip(pairs, schedules)):
+        match = results[k*n_games:(k + 1)*n_games]
+        summary = summarize_match(match, [game[3] for game in games])
+        summary['results'] = match
+        summaries[get_agent_name(agent1), get_agent_name(agent2)] = summary
+    return summaries
+# %%
@@ -0,0 +1,121 @@
+#%%
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch as th
+from stable_baselines3 import PPO
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from symmetry import *
+
+
+###########################################################
+### Mirror augmentation of the training games
+###########################################################
+
+class MirrorRolloutBuffer(RolloutBuffer):
+    """RolloutBuffer that trains on every sample and on its mirror image
+
+    When the rollout is complete, the mirror image of every transition is
+    added to the buffer: the observation and the column are mirrored, the
+    reward, value, advantage and return are kept (a position and its mirror
+    image have the same value), and the log probability of the mirrored
+    column is computed with the policy that collected the rollout, so the
+    PPO ratios of the added samples start at 1. Every epoch then goes
+    through twice as many samples. The buffer needs the policy: use it
+    through MirrorPPO.
+    """
+    policy = None
+
+    def reset(self):
+        # Back to the number of environments of the rollouts
+        if getattr(self, "mirrored", False):
+            self.n_envs //= 2
+        self.mirrored = False
+        super().reset()
+
+    def _add_mirror_images(self):
+        columns = self.observations.shape[-1]
+        observations = np.ascontiguousarray(mirror_grids(self.observations))
+        actions = columns - 1 - self.actions
+        with th.no_grad():
+            _, log_probs, _ = self.policy.evaluate_actions(
+                self.to_torch(observations.reshape((-1,) + self.obs_shape)), self.to_torch(actions.reshape(-1)).long())
+        mirrored = dict(observations=observations, actions=actions,
+                        log_probs=log_probs.cpu().numpy().reshape(self.buffer_size, self.n_envs))
+        for name in ("observations", "actions", "log_probs", "rewards", "returns", "episode_starts", "values",
+                     "advantages"):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, mirrored.get(name, array)], axis=1))
+        self.n_envs *= 2
+        self.mirrored = True
+
+    def get(self, batch_size=None):
+        if not self.generator_ready and not self.mirrored:
+            self._add_mirror_images()
+        return super().get(batch_size)
+
+
+class MirrorPPO(PPO):
+    """PPO whose rollouts are augmented with their mirror images (MirrorRolloutBuffer)"""
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("rollout_buffer_class", MirrorRolloutBuffer)
+        super().__init__(*args, **kwargs)
+
+    def _setup_model(self):
+        super()._setup_model()
+        self.rollout_buffer.policy = self.policy
+
+
+class MirrorVecEnv(VecEnvWrapper):
+    """Plays a random half of the games of a VecEnv as their mirror image
+
+    At the start of every game, each environment draws whether its game is
+    mirrored. The agent then gets mirrored observations and its actions are
+    mirrored back before reaching the game. This only randomizes the
+    orientation of the games (both orientations of every opening are seen
+    equally often): it adds no samples, for that see MirrorPPO.
+
+    Parameters
+    ----------
+    venv : VecEnv
+        Environment with (n, 1, rows, columns) observations and column actions.
+    p : float, optional
+        Probability that a game is mirrored, by default 0.5.
+    seed : int, optional
+        Seed of the draws, by default None (random).
+    """
+    def __init__(self, venv, p=0.5, seed=None):
+        super().__init__(venv)
+        self.p = p
+        self.rng = np.random.default_rng(seed)
+        self.columns = venv.observation_space.shape[-1]
+        self.mirrored = np.zeros(self.num_envs, dtype=bool)
+
+    def _mirror(self, obs, mirrored):
+        obs = np.array(obs)
+        obs[mirrored] = mirror_grids(obs[mirrored])
+        return obs
+
+    def reset(self):
+        self.mirrored = self.rng.random(self.num_envs) < self.p
+        return self._mirror(self.venv.reset(), self.mirrored)
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        self.venv.step_async(np.where(self.mirrored, self.columns - 1 - actions, actions))
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        for i in np.flatnonzero(dones):
+            if self.mirrored[i] and "terminal_observation" in infos[i]:
+                infos[i] = dict(infos[i], terminal_observation=mirror_grids(infos[i]["terminal_observation"]).copy())
+        # The games that ended start over with a new draw
+        self.mirrored[dones] = self.rng.random(int(dones.sum())) < self.p
+        return self._mirror(obs, self.mirrored), rewards, dones, infos
+# %%
@@ -0,0 +1,159 @@
+#%%
+import sys
+from pathlib import Path
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from batched_game import *
+from game import *
+
+
+###########################################################
+### Batched environment
+###########################################################
+
+class BatchedConnectFourVecEnv(VecEnv):
+    """Steps B games of ConnectFourGym as one array, in a single process
+
+    Observations, actions and rewards are those of ConnectFourGym: the agent
+    plays first (mark 1), the rewards are shaped by change_reward and an
+    invalid move ends the game with -10. The boards are kept in a
+    BatchedBoards, the agent's and the opponent's moves are applied to all
+    the boards at once and finished games are reset automatically, as
+    stable_baselines3 expects from a VecEnv (the last observation of a game
+    is in infos[i]["terminal_observation"]).
+
+    Parameters
+    ----------
+    n_envs : int, optional
+        Number of games B, by default 64.
+    opponent : str or function, optional
+        "random" (uniform among the valid columns), or a function taking the
+        boards to play, of shape (n, 1, rows, columns) and with the marks
+        swapped so the opponent sees itself as player 1, and the (n, columns)
+        array of valid columns, and returning the n columns played. Invalid
+        columns are replaced by random valid ones, as agent_rl does. By
+        default "random".
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+    seed : int, optional
+        Seed of the random opponent, by default None (random).
+    """
+    def __init__(self, n_envs=64, opponent="random", config=None, seed=None):
+        self.config = Struct(DEFAULT_CONFIG if config is None else config)
+        self.rows = self.config.rows
+        self.columns = self.config.columns
+        observation_space = spaces.Box(low=0, high=2, shape=(1,self.rows,self.columns), dtype=int)
+        self.render_mode = None
+        super().__init__(n_envs, observation_space, spaces.Discrete(self.columns))
+        self.opponent = opponent
+        self.game = BatchedBoards(n_envs, self.config)
+        self.rng = np.random.default_rng(seed)
+        self._actions = None
+        self._index = np.arange(n_envs)
+        self._no_info = {}
+
+    def _observations(self, boards=None):
+        grids = self.game.grids if boards is None else self.game.grids[boards]
+        return grids[:, None].astype(self.observation_space.dtype)
+
+    def reset(self):
+        self.game.reset()
+        return self._observations()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+
+    def _opponent_moves(self, boards):
+        valid = self.game.valid_moves(boards)
+        if self.opponent == "random":
+            return random_valid_moves(valid, self.rng)
+        cols = np.asarray(self.opponent(swap_marks(self._observations(boards)), valid)).reshape(-1)
+        cols = np.clip(cols, 0, self.columns - 1)
+        # If not valid, select random move.
+        invalid = ~valid[np.arange(len(boards)), cols]
+        if invalid.any():
+            cols[invalid] = random_valid_moves(valid[invalid], self.rng)
+        return cols
+
+    def step_wait(self):
+        game, actions = self.game, self._actions
+        rewards = np.full(self.num_envs, 1/(self.rows*self.columns), dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        # Check if agent's move is valid
+        valid = game.heights[self._index, actions] < self.rows
+        rewards[~valid] = -10
+        dones[~valid] = True
+
+        boards = np.flatnonzero(valid)
+        won, full = game.play(actions[boards], 1, boards)
+        rewards[boards[won]] = 1
+        rewards[boards[full & ~won]] = -1
+        dones[boards[won | full]] = True
+
+        # The opponent plays in the games that go on
+        boards = boards[~(won | full)]
+        if len(boards):
+            won, full = game.play(self._opponent_moves(boards), 2, boards)
+            rewards[boards[won | full]] = -1
+            dones[boards[won | full]] = True
+
+        obs = self._observations()
+        infos = [self._no_info] * self.num_envs
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            for i in finished:
+                infos[i] = {"terminal_observation": obs[i].copy()}
+            game.reset(finished)
+            obs[finished] = 0
+        return obs, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # The boards share one environment: the method is called once, its result given for every index
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result] * len(self._get_indices(indices))
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
+
+
+def make_policy_opponent(model, deterministic=False):
+    """Builds an opponent of BatchedConnectFourVecEnv from a policy, for self-play
+
+    Parameters
+    ----------
+    model : object
+        Model with a stable_baselines3-like predict(observations, deterministic)
+        method, e.g. the PPO model being trained.
+    deterministic : bool, optional
+        Take the most likely action instead of sampling it, by default False.
+
+    Returns
+    -------
+    function
+        The opponent, playing all its boards in one model.predict call.
+    """
+    def policy_opponent(boards, valid):
+        cols, _ = model.predict(boards, deterministic=deterministic)
+        return cols
+    return policy_opponent
+# %%
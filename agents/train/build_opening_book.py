@@ -0,0 +1,21 @@
+#%%
+import argparse
+import sys
+from pathlib import Path
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from opening_book import *
+
+#%%
+parser = argparse.ArgumentParser(description="Builds the opening book of the agents")
+parser.add_argument("--output", default=str(BOOK_PATH), help="book file")
+parser.add_argument("--max-ply", type=int, default=4, help="search the positions with up to this many discs")
+parser.add_argument("--depth", type=int, default=9, help="search depth")
+parser.add_argument("--table-mb", type=int, default=256, help="transposition table size")
+args = parser.parse_args()
+
+n = build_opening_book(args.output, args.max_ply, args.depth, table_mb=args.table_mb, verbose=True)
+print(f"{n} positions written to {args.output}")
+# %%
@@ -0,0 +1,20 @@
+#%%
+import argparse
+import sys
+from pathlib import Path
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from submission import *
+
+#%%
+parser = argparse.ArgumentParser(description="Builds the standalone kaggle submission of agent_rl")
+parser.add_argument("--output", default=str(SUBMISSION_PATH), help="submission file")
+parser.add_argument("--checkpoint", default=str(CHECKPOINT_PATH), help="PPO checkpoint")
+parser.add_argument("--deterministic", action="store_true", help="play the most likely column")
+args = parser.parse_args()
+
+size = build_submission(args.output, args.checkpoint, args.deterministic)
+print(f"{size / 1024:.0f} kB written to {args.output}")
+# %%
@@ -0,0 +1,23 @@
+#%%
+import argparse
+import sys
+from pathlib import Path
+
+# Make the modules of agents/ (and the agents package, for the sampling agents) importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from solver import *
+
+#%%
+parser = argparse.ArgumentParser(description="Solves late-game positions into the tablebase of the agents")
+parser.add_argument("--output", default=str(TABLEBASE_PATH), help="tablebase file")
+parser.add_argument("--games", type=int, default=2000, help="number of games sampled")
+parser.add_argument("--min-discs", type=int, default=20, help="solve the positions with at least this many discs")
+parser.add_argument("--agents", nargs="*", default=["random", "agent_q1", "agent_q2", "agent_q3"], help="agents playing the games")
+parser.add_argument("--seed", type=int, default=0, help="seed of the games")
+args = parser.parse_args()
+
+n = build_tablebase(args.output, args.games, args.min_discs, tuple(args.agents), args.seed, verbose=True)
+print(f"{n} positions written to {args.output}")
+# %%
@@ -0,0 +1,308 @@
+#%%
+import os
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import gym
+from kaggle_environments import make
+from gym import spaces
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from bitboard import *
+from game import *
+from game_records import *
+
+class ConnectFourGym(gym.Env):
+    def __init__(self, agent2="random"):
+        ks_env = make("connectx", debug=True)
+        self.env = ks_env.train([None, agent2])
+        self.rows = ks_env.configuration.rows
+        self.columns = ks_env.configuration.columns
+        # Learn about spaces here: http://gym.openai.com/docs/#spaces
+        self.action_space = spaces.Discrete(self.columns)
+        self.observation_space = spaces.Box(low=0, high=2, 
+                                            shape=(1,self.rows,self.columns), dtype=int)
+        # Tuple corresponding to the min and max possible rewards
+        self.reward_range = (-10, 1)
+        # StableBaselines throws error if these are not defined
+        self.spec = None
+        self.metadata = None
+    def reset(self):
+        self.obs = self.env.reset()
+        return np.array(self.obs['board']).reshape(1,self.rows,self.columns)
+    def change_reward(self, old_reward, done):
+        if old_reward == 1: # The agent won the game
+            return 1
+        elif done: # The opponent won the game
+            return -1
+        else: # Reward 1/42
+            return 1/(self.rows*self.columns)
+    def step(self, action):
+        # Check if agent's move is valid
+        is_valid = (self.obs['board'][int(action)] == 0)
+        if is_valid: # Play the move
+            self.obs, old_reward, done, _ = self.env.step(int(action))
+            reward = self.change_reward(old_reward, done)
+        else: # End the game and penalize agent
+            reward, done, _ = -10, True, {}
+        return np.array(self.obs['board']).reshape(1,self.rows,self.columns), reward, done, _
+
+
+###########################################################
+### Native environment
+###########################################################
+
+class NativeConnectFourGym(gym.Env):
+    """Drop-in replacement of ConnectFourGym that does not go through kaggle_environments
+
+    Observations, actions and rewards are the same as ConnectFourGym: the
+    agent plays first (mark 1), change_reward shapes the rewards and an
+    invalid move ends the game with -10. The game is kept in a bitboard
+    Position, a board list and a preallocated observation array, all
+    updated in place. The opponent is called directly, as kaggle does
+    with debug=True.
+
+    The observation returned by reset() and step() is the same array every
+    time: it is overwritten by the next step (stable_baselines3 copies it).
+
+    Parameters
+    ----------
+    agent2 : str or function, optional
+        Opponent agent: "random", "negamax" or an agent function, by default "random".
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+    records : str or Path, optional
+        Game records to which every finished game is appended, the agent
+        being recorded as "training", by default None. The games are
+        written a chunk at a time, the last ones when the environment is
+        closed.
+    """
+    def __init__(self, agent2="random", config=None, records=None):
+        self.config = Struct(DEFAULT_CONFIG if config is None else config)
+        self.agent2 = get_agent(agent2)
+        self.agent2_name = get_agent_name(agent2)
+        self.records = None if records is None else GameRecordWriter(records, self.config)
+        self.rows = self.config.rows
+        self.columns = self.config.columns
+        self.action_space = spaces.Discrete(self.columns)
+        self.observation_space = spaces.Box(low=0, high=2, 
+                                            shape=(1,self.rows,self.columns), dtype=int)
+        # Tuple corresponding to the min and max possible rewards
+        self.reward_range = (-10, 1)
+        # StableBaselines throws error if these are not defined
+        self.spec = None
+        self.metadata = None
+        self.pos = Position(self.config)
+        self.board = [0] * (self.rows*self.columns)
+        self._obs = np.zeros((1,self.rows,self.columns), dtype=int)
+        self._grid = self._obs[0]
+        self.opponent_obs = Struct(board=self.board, mark=2, step=0, remainingOverageTime=self.config.agentTimeout)
+
+    def reset(self):
+        pos = self.pos
+        pos.masks[1] = pos.masks[2] = 0
+        pos.heights[:] = [0] * self.columns
+        pos.n_moves = 0
+        pos.hash = pos.mirror_hash = 0
+        del pos.history[:]
+        self.board[:] = [0] * len(self.board)
+        self._obs.fill(0)
+        return self._obs
+
+    def _play(self, col, mark):
+        # Drops the piece everywhere, returns True if it wins the game
+        row = self.rows - 1 - self.pos.heights[col]
+        won = self.pos.is_winning_move(col, mark)
+        self.pos.play(col, mark)
+        self.board[row*self.columns + col] = mark
+        self._grid[row, col] = mark
+        return won
+
+    def _record(self, rewards, status="DONE"):
+        if self.records is not None:
+            moves = [col for col, _ in self.pos.history]
+            self.records.write("training", self.agent2_name, dict(rewards=rewards, status=status, moves=moves))
+
+    def change_reward(self, old_reward, done):
+        if old_reward == 1: # The agent won the game
+            return 1
+        elif done: # The opponent won the game
+            return -1
+        else: # Reward 1/42
+            return 1/(self.rows*self.columns)
+
+    def step(self, action):
+        # Check if agent's move is valid
+        col = int(action)
+        if self.board[col] != 0: # End the game and penalize agent
+            self._record([None, 0], "INVALID")
+            return self._obs, -10, True, {}
+        if self._play(col, 1):
+            old_reward, done = 1, True
+            self._record([1, -1])
+        elif self.pos.is_full():
+            old_reward, done = 0, True
+            self._record([0, 0])
+        else: # The opponent plays
+            self.opponent_obs.step = self.pos.n_moves
+            opp_col = self.agent2(self.opponent_obs, self.config)
+            if not (0 <= opp_col < self.columns) or self.board[opp_col] != 0:
+                # Invalid opponent move: kaggle ends the game without reward
+                old_reward, done = 0, True
+                self._record([0, None], "INVALID")
+            elif self._play(int(opp_col), 2):
+                old_reward, done = -1, True
+                self._record([-1, 1])
+            else:
+                old_reward, done = 0, self.pos.is_full()
+                if done:
+                    self._record([0, 0])
+        return self._obs, self.change_reward(old_reward, done), done, {}
+
+    def close(self):
+        if self.records is not None:
+            self.records.close()
+
+
+def check_parity(agent2="random", n_games=100, seed=0):
+    """Plays the same games in ConnectFourGym and NativeConnectFourGym and compares them
+
+    Both environments get the same random seed before each game, and the
+    agent plays the same random actions (invalid ones included).
+
+    Parameters
+    ----------
+    agent2 : str or function, optional
+        Opponent agent, by default "random".
+    n_games : int, optional
+        Number of games to compare, by default 100.
+    seed : int, optional
+        Seed of the games, by default 0.
+
+    Returns
+    -------
+    int
+        Number of steps compared. An AssertionError is raised at the first
+        difference of observation, reward or done flag.
+    """
+    kaggle_env, native_env = ConnectFourGym(agent2), NativeConnectFourGym(agent2)
+    actions = np.random.RandomState(seed)
+    n_steps = 0
+    for game in range(n_games):
+        trajectories = []
+        moves = actions.randint(0, kaggle_env.columns, size=kaggle_env.rows*kaggle_env.columns + 1)
+        for env in (kaggle_env, native_env):
+            random.seed(seed + game)
+            trajectory = [env.reset().copy()]
+            for action in moves:
+                obs, reward, done, _ = env.step(action)
+                trajectory.append((obs.copy(), reward, done))
+                if done:
+                    break
+            trajectories.append(trajectory)
+        assert len(trajectories[0]) == len(trajectories[1]), f"Game {game}: different lengths"
+        for t, (a, b) in enumerate(zip(*trajectories)):
+            if t == 0:
+                assert (a == b).all(), f"Game {game}: different first observation"
+            else:
+                assert (a[0] == b[0]).all() and a[1:] == b[1:], f"Game {game}, step {t}: {a} != {b}"
+        n_steps += len(trajectories[0]) - 1
+    return n_steps
+
+
+###########################################################
+### Parallel environments
+###########################################################
+
+def make_env_fn(agent2="random", seed=None, rank=0, native=False, records=None):
+    """Returns a function creating one ConnectFourGym, for the vectorized environments
+
+    Parameters
+    ----------
+    agent2 : str or function, optional
+        Opponent agent, by default "random". It runs in the process of the
+        environment.
+    seed : int, optional
+        Base seed of the opponent's random moves, by default None (random).
+    rank : int, optional
+        Index of the environment, added to the seed, by default 0.
+    native : bool, optional
+        Create a NativeConnectFourGym instead, by default False.
+    records : str or Path, optional
+        Directory in which a NativeConnectFourGym records its games, in
+        env-<rank>.c4g, by default None.
+
+    Returns
+    -------
+    function
+        Function without arguments returning the environment.
+    """
+    def _init():
+        # Forked workers start with the same random state: reseed each one
+        random.seed(None if seed is None else seed + rank)
+        np.random.seed(None if seed is None else seed + rank)
+        if native:
+            path = None if records is None else Path(records) / f"env-{rank}.c4g"
+            return NativeConnectFourGym(agent2=agent2, records=path)
+        return ConnectFourGym(agent2=agent2)
+    return _init
+
+
+def make_connect_four_vec_env(n_envs=None, agent2="random", use_subprocess=True, seed=None, start_method=None,
+                              native=False, records=None):
+    """Runs N ConnectFourGym environments in parallel
+
+    Parameters
+    ----------
+    n_envs : int, optional
+        Number of environments (workers), by default the number of cores.
+    agent2 : str or function, optional
+        Opponent agent, by default "random". Each environment steps its own
+        opponent, inside its worker process.
+    use_subprocess : bool, optional
+        Run every environment in its own process (SubprocVecEnv) instead of
+        one after the other in this process (DummyVecEnv), by default True.
+    seed : int, optional
+        Base seed of the opponents, by default None (random).
+    start_method : str, optional
+        Multiprocessing start method of the workers, by default "fork" where
+        available: "spawn" and "forkserver" re-run the training script
+        (which has no __main__ guard) in every worker.
+    native : bool, optional
+        Use NativeConnectFourGym instead of the kaggle-backed ConnectFourGym,
+        by default False.
+    records : str or Path, optional
+        Directory of the game records of the native environments, one file
+        per environment, by default None (not recorded).
+
+    Returns
+    -------
+    VecEnv
+        The vectorized environment, to be passed to PPO.
+    """
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+
+    if n_envs is None:
+        n_envs = os.cpu_count() or 1
+    if records is not None:
+        os.makedirs(records, exist_ok=True)
+    env_fns = [make_env_fn(agent2, seed, rank, native, records) for rank in range(n_envs)]
+    if not use_subprocess:
+        return DummyVecEnv(env_fns)
+    if start_method is None:
+        start_method = "fork" if sys.platform != "win32" else "spawn"
+    return SubprocVecEnv(env_fns, start_method=start_method)
+
+
+if __name__ == "__main__":
+    # Parity of NativeConnectFourGym with ConnectFourGym: same seeded games,
+    # same number of steps as when the native environment was checked
+    for agent2, n_games, expected in (("random", 50, 506), ("negamax", 20, 178)):
+        n_steps = check_parity(agent2, n_games=n_games, seed=0)
+        assert n_steps == expected, f"{agent2}: {n_steps} steps compared instead of {expected}"
+        print(f"{agent2}: {n_games} games, {n_steps} steps identical")
+# %%
@@ -0,0 +1,473 @@
+#%%
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Make the modules of agents/ importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from batched_game import *
+from bitboard import *
+from game import *
+from model_registry import *
+from numpy_policy import *
+from puct import *
+from rating import *
+from submission import *
+from symmetry import *
+from tournament import *
+
+
+###########################################################
+### Self-play training: actors, replay buffer, learner, gating
+###########################################################
+# Actor processes play games with a PUCT search guided by the best network
+# so far, against checkpoints of the pool, and write the searched positions
+# to a replay buffer in shared memory. The learner (this process) fits the
+# policy to the visit counts of the searches and the value to the results
+# of the games, and saves a candidate checkpoint from time to time. The
+# evaluator process plays every candidate against the best network and
+# promotes it if it wins significantly. All the checkpoints are PPO .zip
+# files, so agent_rl, agent_puct and build_submission.py can play them. The
+# learner also saves the arrays of their policy next to them (.npz), which
+# the actors and the evaluator play with NumpyPolicy without importing torch.
+
+# Where the checkpoints of the self-play run are kept
+SELF_PLAY_DIR = Path(__file__).resolve().parents[1] / "models" / "self_play"
+BEST_NAME = "best.zip"
+
+
+def weights_path(checkpoint):
+    ''' Returns the .npz file of the policy arrays saved next to a checkpoint '''
+    return Path(checkpoint).with_suffix(".npz")
+
+
+class ReplayBuffer:
+    ''' Ring buffer of training samples in shared memory, written by several processes
+
+    The arrays are allocated once (capacity samples, about 75 bytes each on
+    the default board), so the memory used is bounded: once full, the
+    oldest samples are overwritten. It is passed to the processes when they
+    are started.
+
+    Parameters:
+    -----------
+    capacity : int
+        Number of samples kept.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+    '''
+    def __init__(self, capacity, config):
+        self.capacity = capacity
+        self.shape = (config.rows, config.columns)
+        size = config.rows * config.columns
+        self._boards = multiprocessing.RawArray('b', capacity * size)
+        self._policies = multiprocessing.RawArray('f', capacity * config.columns)
+        self._values = multiprocessing.RawArray('f', capacity)
+        # Samples written since the start, the next one going to added % capacity
+        self._added = multiprocessing.RawValue('q', 0)
+        self._lock = multiprocessing.Lock()
+
+    def _arrays(self):
+        boards = np.frombuffer(self._boards, dtype=np.int8).reshape((self.capacity, 1) + self.shape)
+        policies = np.frombuffer(self._policies, dtype=np.float32).reshape(self.capacity, self.shape[1])
+        values = np.frombuffer(self._values, dtype=np.float32)
+        return boards, policies, values
+
+    @property
+    def added(self):
+        ''' Number of samples written since the start '''
+        return self._added.value
+
+    def __len__(self):
+        return min(self._added.value, self.capacity)
+
+    def add(self, boards, policies, values):
+        ''' Appends samples: boards (n, rows, columns), search policies (n, columns) and results (n,) '''
+        n = len(boards)
+        arrays = self._arrays()
+        with self._lock:
+            index = (self._added.value + np.arange(n)) % self.capacity
+            for array, samples in zip(arrays, (np.reshape(boards, (n, 1) + self.shape), policies, values)):
+                array[index] = samples
+            self._added.value += n
+
+    def sample(self, n, rng):
+        ''' Returns n samples drawn uniformly (copies): boards (n, 1, rows, columns), policies and values '''
+        index = rng.integers(len(self), size=n)
+        with self._lock:
+            return tuple(array[index] for array in self._arrays())
+
+
+def search_policy(visits, columns):
+    ''' Returns the visits of the root as a probability vector over the columns '''
+    policy = np.zeros(columns, dtype=np.float32)
+    for col, n in visits.items():
+        policy[col] = n
+    return policy / policy.sum()
+
+
+def choose_move(policy, rng, explore):
+    ''' Draws a column in proportion to the visits when exploring, otherwise plays the most visited one '''
+    if explore:
+        return int(rng.choice(len(policy), p=policy / policy.sum()))
+    return int(rng.choice(np.flatnonzero(policy == policy.max())))
+
+
+def play_self_play_game(network, opponent, config, n_simulations, rng, explore_moves=8, learner_first=None):
+    ''' Plays one game between two networks searched with PUCT, and returns the samples of the first one
+
+    Parameters:
+    -----------
+    network : object
+        Network being trained (see PUCT), whose moves are recorded.
+
+    opponent : object
+        Network of the other player (it can be network itself).
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    n_simulations : int
+        Leaves evaluated by each search.
+
+    rng : numpy.random.Generator
+        Random generator.
+
+    explore_moves : int, optional
+        The moves of the first plies are drawn in proportion to the visits,
+        the later ones are the most visited moves, by default 8.
+
+    learner_first : bool, optional
+        Whether network plays first, by default drawn at random.
+
+    Returns:
+    --------
+    boards : numpy array
+        (n, rows, columns) boards before the moves of network, as seen by
+        it (marks swapped when it is player 2).
+
+    policies : numpy array
+        (n, columns) visits of its searches, normalized.
+
+    values : numpy array
+        (n,) result of the game for network: 1, 0 or -1.
+    '''
+    if learner_first is None:
+        learner_first = bool(rng.integers(2))
+    learner_mark = 1 if learner_first else 2
+    trees = {learner_mark: PUCT(config, network, capacity=2**15, batch_size=8),
+             3 - learner_mark: PUCT(config, opponent, capacity=2**15, batch_size=8)}
+    pos = Position(config)
+    boards, policies = [], []
+    result = 0
+    while True:
+        mark = pos.mark
+        policy = search_policy(trees[mark].search(pos, n_playouts=n_simulations), config.columns)
+        if mark == learner_mark:
+            grid = np.asarray(pos.to_board(), dtype=np.int8).reshape(config.rows, config.columns)
+            boards.append(swap_marks(grid) if mark == 2 else grid)
+            policies.append(policy)
+        col = choose_move(policy, rng, pos.n_moves < explore_moves)
+        if pos.is_winning_move(col):
+            result = 1 if mark == learner_mark else -1
+            break
+        pos.play(col)
+        if pos.is_full():
+            break
+    return np.array(boards), np.array(policies), np.full(len(boards), result, dtype=np.float32)
+
+
+def _actor(buffer, directory, stop, config, n_simulations, seed):
+    # Actor process: games of the best network against the pool, until stop is set
+    rng = np.random.default_rng(seed)
+    networks = ModelRegistry(loader=load_weights, check_interval=5.0)
+    best = weights_path(directory / BEST_NAME)
+    while not stop.is_set():
+        if not best.exists():
+            # Written by the learner once it has loaded the first checkpoint
+            time.sleep(0.5)
+            continue
+        pool = sorted(directory.glob("gen-*.npz"))
+        opponent = pool[rng.integers(len(pool))] if pool and rng.random() < 0.5 else best
+        samples = play_self_play_game(networks.get(best), networks.get(opponent), config, n_simulations, rng)
+        buffer.add(*samples)
+
+
+def _search_agent(network, config, n_simulations, rng, explore_moves=4):
+    # Agent playing network with PUCT, the first moves drawn so the games differ
+    tree = PUCT(config, network, capacity=2**15, batch_size=8)
+
+    def agent(obs, config):
+        pos = Position.from_board(obs.board, config)
+        policy = search_policy(tree.search(pos, n_playouts=n_simulations), config.columns)
+        return choose_move(policy, rng, pos.n_moves < explore_moves)
+    return agent
+
+
+def gate_passed(scores, threshold, z):
+    ''' Whether a candidate wins significantly against the best network
+
+    Parameters:
+    -----------
+    scores : list
+        Score of the candidate in every game: 1, 0.5 or 0.
+
+    threshold : float
+        Mean score needed.
+
+    z : float
+        One-sided z-score of the mean score above 0.5 needed, e.g. 1.645 for
+        a 5% significance level. 0 only checks the threshold.
+
+    Returns:
+    --------
+    bool
+        True if the mean score passes both.
+    '''
+    scores = np.asarray(scores, dtype=np.float64)
+    mean = scores.mean()
+    error = scores.std(ddof=1) / np.sqrt(len(scores)) if len(scores) > 1 else np.inf
+    if error == 0:
+        return bool(mean >= threshold and mean > 0.5)
+    return bool(mean >= threshold and (mean - 0.5) / error >= z)
+
+
+def _evaluator(candidates, results, directory, stop, config, n_simulations, n_games, threshold, z, ladder, seed):
+    # Evaluator process: plays the candidates against the best network and promotes the winners
+    rng = np.random.default_rng(seed)
+    generation = len(list(directory.glob("gen-*.zip")))
+    while True:
+        try:
+            candidate = candidates.get(timeout=1.0)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if candidate is None:
+            return
+        best = directory / BEST_NAME
+        summary = play_match(_search_agent(load_weights(weights_path(candidate)), config, n_simulations, rng),
+                             _search_agent(load_weights(weights_path(best)), config, n_simulations, rng),
+                             n_games=n_games, config=config, n_workers=1)
+        # The candidate plays first in the even games (see schedule_match)
+        rewards = [result['rewards'][i % 2] for i, result in enumerate(summary['results'])]
+        scores = [1.0 if reward == 1 else 0.5 if reward == 0 else 0.0 for reward in rewards]
+        score = float(np.mean(scores))
+        promoted = gate_passed(scores, threshold, z)
+        if promoted:
+            generation += 1
+            for source in (candidate, weights_path(candidate)):
+                shutil.copyfile(source, directory / f"gen-{generation:04d}{Path(source).suffix}")
+            # Replaced at once, the actors may be reading them
+            for source, target in ((candidate, best), (weights_path(candidate), weights_path(best))):
+                shutil.copyfile(source, directory / "best.tmp")
+                os.replace(directory / "best.tmp", target)
+            if ladder is not None:
+                with RatingLadder(ladder) as ratings:
+                    ratings.register_checkpoint(best, name=f"self_play-gen-{generation:04d}")
+        os.remove(candidate)
+        os.remove(weights_path(candidate))
+        results.put((Path(candidate).name, score, promoted))
+
+
+def _learn(model, optimizer, buffer, n_steps, batch_size, value_coef, rng):
+    # Fits the policy to the visits of the searches and the value to the results, on mirrored samples too
+    import torch
+    import torch.nn.functional as F
+
+    policy = model.policy
+    policy.set_training_mode(True)
+    losses = []
+    for _ in range(n_steps):
+        boards, policies, values = augment_mirror(*buffer.sample(batch_size, rng))
+        observations = torch.as_tensor(boards, dtype=torch.float32)
+        log_probs = policy.get_distribution(observations).distribution.logits
+        policy_loss = -(torch.as_tensor(policies) * log_probs).sum(dim=1).mean()
+        value_loss = F.mse_loss(policy.predict_values(observations)[:, 0], torch.as_tensor(values))
+        loss = policy_loss + value_coef * value_loss
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append((policy_loss.item(), value_loss.item()))
+    policy.set_training_mode(False)
+    return np.mean(losses, axis=0)
+
+
+def _save_weights(model, checkpoint):
+    # Arrays of the policy of model, next to its checkpoint
+    state = {name: tensor.detach().cpu().numpy() for name, tensor in model.policy.state_dict().items()}
+    save_weights(weights_path(checkpoint), policy_weights(state))
+
+
+def run_self_play(directory=SELF_PLAY_DIR, initial=CHECKPOINT_PATH, n_actors=None, n_steps=20000,
+                  checkpoint_interval=1000, batch_size=256, learning_rate=1e-4, value_coef=1.0,
+                  buffer_size=500000, min_samples=5000, replay_ratio=8, n_simulations=64, gate_games=200,
+                  gate_threshold=0.55, gate_z=1.645, ladder=LADDER_PATH, config=None, seed=0, verbose=True):
+    ''' Trains the policy of agent_rl by self-play, actors, learner and evaluator running at once
+
+    Parameters:
+    -----------
+    directory : Path, optional
+        Checkpoints of the run: best.zip (the network the actors play) and
+        gen-NNNN.zip (the promoted ones, the pool of opponents), each with
+        the .npz of its policy arrays, by default SELF_PLAY_DIR. A run starts
+        again from its best.zip.
+
+    initial : Path, optional
+        Checkpoint the first run starts from, by default CHECKPOINT_PATH.
+
+    n_actors : int, optional
+        Actor processes, by default the number of cores minus two (one for
+        the learner, one for the evaluator), at least 1.
+
+    n_steps : int, optional
+        Gradient steps of the learner, by default 20000.
+
+    checkpoint_interval : int, optional
+        Steps between two candidates sent to the evaluator, by default 1000.
+
+    batch_size : int, optional
+        Samples of a step (twice as many with their mirror images), by
+        default 256.
+
+    learning_rate : float, optional
+        Learning rate of Adam, by default 1e-4. The optimizer is kept for
+        the whole run.
+
+    value_coef : float, optional
+        Weight of the value loss, by default 1.0.
+
+    buffer_size : int, optional
+        Samples kept in the replay buffer, by default 500000 (about 40 MB).
+
+    min_samples : int, optional
+        Samples in the buffer before the learner starts, by default 5000.
+
+    replay_ratio : float, optional
+        The learner waits for the actors when it has drawn more than
+        replay_ratio times the number of samples they wrote, by default 8.
+
+    n_simulations : int, optional
+        Leaves evaluated by each search of the actors and evaluator, by
+        default 64.
+
+    gate_games : int, optional
+        Games of a candidate against the best network, by default 200: the
+        standard error of the score is then at most 0.035.
+
+    gate_threshold : float, optional
+        Score (wins + draws/2 per game) a candidate needs to be promoted, by
+        default 0.55.
+
+    gate_z : float, optional
+        The score must also be above 0.5 by gate_z standard errors (see
+        gate_passed), by default 1.645 (5% one-sided).
+
+    ladder : Path, optional
+        Rating ladder the promoted checkpoints are registered in, by default
+        LADDER_PATH. None does not register them.
+
+    config : dict, optional
+        Configuration of the game, by default DEFAULT_CONFIG.
+
+    seed : int, optional
+        Seed of the run, by default 0.
+
+    verbose : bool, optional
+        Print the losses and the evaluations, by default True.
+
+    Returns:
+    --------
+    list
+        (candidate, score, promoted) of every evaluated candidate.
+    '''
+    config = Struct(DEFAULT_CONFIG if config is None else config)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    best = directory / BEST_NAME
+    if not best.exists():
+        shutil.copyfile(initial, best)
+    if n_actors is None:
+        n_actors = max(1, (os.cpu_count() or 1) - 2)
+
+    # The actors and the evaluator are started before torch is imported here
+    buffer = ReplayBuffer(buffer_size, config)
+    stop = multiprocessing.Event()
+    candidates, results = multiprocessing.Queue(), multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_actor, args=(buffer, directory, stop, config, n_simulations,
+                                                              seed + 1 + i), daemon=True)
+                 for i in range(n_actors)]
+    processes.append(multiprocessing.Process(target=_evaluator, args=(candidates, results, directory, stop, config,
+                                                                      n_simulations, gate_games, gate_threshold,
+                                                                      gate_z, ladder, seed), daemon=True))
+    for process in processes:
+        process.start()
+
+    evaluations = []
+    try:
+        import torch
+        torch.set_num_threads(1)
+        model = load_ppo(best)
+        if not weights_path(best).exists():
+            _save_weights(model, best)
+        optimizer = torch.optim.Adam(model.policy.parameters(), lr=learning_rate)
+        rng = np.random.default_rng(seed)
+        start = time.perf_counter()
+        step = 0
+        while step < n_steps:
+            # Enough samples, and not too many draws per sample written
+            if len(buffer) < min_samples or buffer.added * replay_ratio < (step + checkpoint_interval) * batch_size:
+                time.sleep(0.5)
+                continue
+            losses = _learn(model, optimizer, buffer, checkpoint_interval, batch_size, value_coef, rng)
+            step += checkpoint_interval
+            candidate = directory / f"candidate-{step:07d}.zip"
+            model.save(candidate)
+            _save_weights(model, candidate)
+            candidates.put(str(candidate))
+            if verbose:
+                print(f"step {step}: policy loss {losses[0]:.3f}, value loss {losses[1]:.3f}, "
+                      f"{buffer.added} samples, {time.perf_counter() - start:.0f}s")
+            while not results.empty():
+                evaluations.append(results.get())
+                if verbose:
+                    print("evaluated {}: score {:.2f}, promoted {}".format(*evaluations[-1]))
+    finally:
+        # The last candidate is still evaluated before the evaluator stops
+        candidates.put(None)
+        stop.set()
+        processes[-1].join()
+        for process in processes[:-1]:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+    while not results.empty():
+        evaluations.append(results.get())
+        if verbose:
+            print("evaluated {}: score {:.2f}, promoted {}".format(*evaluations[-1]))
+    return evaluations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains the policy of agent_rl by self-play")
+    parser.add_argument("--directory", default=str(SELF_PLAY_DIR), help="checkpoints of the run")
+    parser.add_argument("--actors", type=int, default=None, help="actor processes, by default cores - 2")
+    parser.add_argument("--steps", type=int, default=20000, help="gradient steps of the learner")
+    parser.add_argument("--checkpoint-interval", type=int, default=1000, help="steps between two candidates")
+    parser.add_argument("--simulations", type=int, default=64, help="leaves evaluated per search")
+    parser.add_argument("--gate-games", type=int, default=200, help="games of a candidate against the best network")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_self_play(args.directory, n_actors=args.actors, n_steps=args.steps,
+                  checkpoint_interval=args.checkpoint_interval, n_simulations=args.simulations,
+                  gate_games=args.gate_games, seed=args.seed)
+# %%
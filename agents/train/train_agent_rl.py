@@ -1,93 +1,51 @@
 #%%
+import os
 import random
+import sys
+from pathlib import Path
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+# Make the modules of agents/ importable (networks, rating, ...)
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-import gym
-from kaggle_environments import make, evaluate
-from gym import spaces
-
-class ConnectFourGym(gym.Env):
-    def __init__(self, agent2="random"):
-        ks_env = make("connectx", debug=True)
-        self.env = ks_env.train([None, agent2])
-        self.rows = ks_env.configuration.rows
-        self.columns = ks_env.configuration.columns
-        # Learn about spaces here: http://gym.openai.com/docs/#spaces
-        self.action_space = spaces.Discrete(self.columns)
-        self.observation_space = spaces.Box(low=0, high=2, 
-                                            shape=(1,self.rows,self.columns), dtype=int)
-        # Tuple corresponding to the min and max possible rewards
-        self.reward_range = (-10, 1)
-        # StableBaselines throws error if these are not defined
-        self.spec = None
-        self.metadata = None
-    def reset(self):
-        self.obs = self.env.reset()
-        return np.array(self.obs['board']).reshape(1,self.rows,self.columns)
-    def change_reward(self, old_reward, done):
-        if old_reward == 1: # The agent won the game
-            return 1
-        elif done: # The opponent won the game
-            return -1
-        else: # Reward 1/42
-            return 1/(self.rows*self.columns)
-    def step(self, action):
-        # Check if agent's move is valid
-        is_valid = (self.obs['board'][int(action)] == 0)
-        if is_valid: # Play the move
-            self.obs, old_reward, done, _ = self.env.step(int(action))
-            reward = self.change_reward(old_reward, done)
-        else: # End the game and penalize agent
-            reward, done, _ = -10, True, {}
-        return np.array(self.obs['board']).reshape(1,self.rows,self.columns), reward, done, _
-
+from envs import *
 
 #%%
 
-env = ConnectFourGym(agent2="random")
+# Number of environments played in parallel, each one in its own process
+N_ENVS = os.cpu_count()
+# Play the games with NativeConnectFourGym instead of going through kaggle_environments
+NATIVE_ENV = True
+# Step all the games as one array in this process instead (N_BATCHED_ENVS games)
+BATCHED_ENV = True
+N_BATCHED_ENVS = 64
 
-#%%
-import torch as th
-import torch.nn as nn
+if BATCHED_ENV:
+    from batched_env import BatchedConnectFourVecEnv
+    env = BatchedConnectFourVecEnv(n_envs=N_BATCHED_ENVS, opponent="random")
+else:
+    env = make_connect_four_vec_env(n_envs=N_ENVS, agent2="random", native=NATIVE_ENV)
 
+# Train on the mirror image of every sample of the rollouts too
+MIRROR_AUGMENTATION = True
+
+#%%
 from stable_baselines3 import PPO 
-from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
-
-# Neural network for predicting action values
-class CustomCNN(BaseFeaturesExtractor):
-    
-    def __init__(self, observation_space: gym.spaces.Box, features_dim: int=128):
-        super(CustomCNN, self).__init__(observation_space, features_dim)
-        # CxHxW images (channels first)
-        n_input_channels = observation_space.shape[0]
-        self.cnn = nn.Sequential(
-            nn.Conv2d(n_input_channels, 32, kernel_size=3, stride=1, padding=0),
-            nn.ReLU(),
-            nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=0),
-            nn.ReLU(),
-            nn.Flatten(),
-        )
-
-        # Compute shape by doing one forward pass
-        with th.no_grad():
-            n_flatten = self.cnn(
-                th.as_tensor(observation_space.sample()[None]).float()
-            ).shape[1]
-
-        self.linear = nn.Sequential(nn.Linear(n_flatten, features_dim), nn.ReLU())
-
-    def forward(self, observations: th.Tensor) -> th.Tensor:
-        return self.linear(self.cnn(observations))
+
+from networks import CustomCNN
 
 policy_kwargs = dict(
     features_extractor_class=CustomCNN,
 )
         
 # Initialize agent
-model = PPO("CnnPolicy", env, policy_kwargs=policy_kwargs, verbose=0)
+if MIRROR_AUGMENTATION:
+    from augmentation import MirrorPPO
+    model = MirrorPPO("CnnPolicy", env, policy_kwargs=policy_kwargs, verbose=0)
+else:
+    model = PPO("CnnPolicy", env, policy_kwargs=policy_kwargs, verbose=0)
 
 
 
@@ -96,6 +54,18 @@ model = PPO("CnnPolicy", env, policy_kwargs=policy_kwargs, verbose=0)
 model.learn(total_timesteps=60000)
 #%%
 model.save("../models/ppo")
+#%%
+# Register the checkpoint in the rating ladder, and rank it against the reference agents
+from rating import RatingLadder
+
+RANK_CHECKPOINT = False
+
+with RatingLadder() as ladder:
+    name = ladder.register_checkpoint("../models/ppo")
+    if RANK_CHECKPOINT:
+        for reference in ("random", "agent_q1", "agent_q3", "agent_minimax"):
+            ladder.register(reference)
+        print(ladder.run(agents=[name]))
 #%% 
 
 
@@ -0,0 +1,137 @@
+#%%
+__all__ = ["EXACT", "LOWER", "UPPER", "ENTRY_BYTES", "TranspositionTable"]
+
+
+###########################################################
+### Transposition table for the alpha-beta search
+###########################################################
+
+# Bound types of the stored values
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Approximate size in memory of one stored entry: the tuple, the 64-bit
+# key and the float value (small ints are shared by the interpreter)
+ENTRY_BYTES = 160
+
+
+class TranspositionTable:
+    ''' Fixed-size hash table of searched positions, keyed by Zobrist hash
+
+    Every bucket holds two entries. The first one is depth-preferred: it is
+    only replaced by a search at least as deep, or by any search once it
+    comes from an older search. The second one is always replaced. Together
+    they keep the expensive subtrees while still caching the recent ones.
+
+    Parameters:
+    -----------
+    max_mb : float, optional
+        Memory budget of the table in megabytes, by default 64.
+    '''
+    def __init__(self, max_mb=64):
+        n_buckets = max(1, int(max_mb * 2**20) // (2 * ENTRY_BYTES))
+        # Round down to a power of two, so the bucket is just the low bits of the key
+        self.n_buckets = 1 << (n_buckets.bit_length() - 1)
+        self.max_mb = max_mb
+        self.clear()
+
+    def clear(self):
+        ''' Removes every entry and resets the statistics '''
+        # Entries are (key, depth, bound, value, move, generation) tuples
+        self.slots = [None] * (2 * self.n_buckets)
+        self.generation = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        ''' Resets the hit-rate statistics '''
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        ''' Marks the entries stored so far as coming from an older search '''
+        self.generation += 1
+
+    def probe(self, key):
+        ''' Looks a position up
+
+        Parameters:
+        -----------
+        key : int
+            Zobrist hash of the position.
+
+        Returns:
+        --------
+        tuple or None
+            The (key, depth, bound, value, move, generation) entry, or None
+            if the position is not stored.
+        '''
+        self.probes += 1
+        i = (key & (self.n_buckets - 1)) << 1
+        slots = self.slots
+        entry = slots[i]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        entry = slots[i+1]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        ''' Stores the result of a search
+
+        Parameters:
+        -----------
+        key : int
+            Zobrist hash of the position.
+
+        depth : int
+            Remaining depth the position was searched to.
+
+        bound : int
+            EXACT, LOWER or UPPER, depending on the value being exact or a bound.
+
+        value : float
+            The value returned by the search.
+
+        move : int or None
+            Best move found, used to order the moves of later searches.
+        '''
+        self.stores += 1
+        i = (key & (self.n_buckets - 1)) << 1
+        slots = self.slots
+        deep = slots[i]
+        if deep is None or deep[0] == key or depth >= deep[1] or deep[5] != self.generation:
+            if deep is not None and deep[0] != key:
+                self.overwrites += 1
+            slots[i] = (key, depth, bound, value, move, self.generation)
+        else:
+            if slots[i+1] is not None and slots[i+1][0] != key:
+                self.overwrites += 1
+            slots[i+1] = (key, depth, bound, value, move, self.generation)
+
+    def stats(self):
+        ''' Returns the usage statistics of the table
+
+        Returns:
+        --------
+        dict
+            Number of probes, hits, stores and overwrites, the hit rate, and
+            the number, capacity and approximate memory of the stored entries.
+        '''
+        entries = sum(1 for entry in self.slots if entry is not None)
+        return {
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'entries': entries,
+            'capacity': len(self.slots),
+            'fill': entries / len(self.slots),
+            'memory_mb': entries * ENTRY_BYTES / 2**20,
+            'max_mb': self.max_mb,
+        }
+# %%
@@ -0,0 +1,171 @@
+#%%
+import numpy as np
+
+__all__ = [
+    "get_window_indices", "count_windows_batch", "get_heuristic_batch", "get_heuristic_minimax_batch",
+    "boards_from_masks"
+]
+
+
+###########################################################
+### Vectorized window counting on stacks of grids
+###########################################################
+
+_WINDOW_INDICES = {}
+
+def get_window_indices(config):
+    ''' Returns the (cached) flat board indices of every window
+
+    Parameters:
+    -----------
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    numpy array
+        Array of shape (n_windows, inarow), 69 x 4 for the default board. Row
+        i holds the indices in obs.board of the cells of window i.
+    '''
+    key = (config.rows, config.columns, config.inarow)
+    if key not in _WINDOW_INDICES:
+        rows, columns, inarow = key
+        windows = []
+        # horizontal, vertical, positive diagonal, negative diagonal
+        for dr, dc in ((0, 1), (1, 0), (-1, 1), (1, 1)):
+            for row in range(rows):
+                for col in range(columns):
+                    end_row, end_col = row + (inarow-1)*dr, col + (inarow-1)*dc
+                    if 0 <= end_row < rows and 0 <= end_col < columns:
+                        windows.append([(row + k*dr)*columns + col + k*dc for k in range(inarow)])
+        _WINDOW_INDICES[key] = np.array(windows, dtype=np.intp)
+    return _WINDOW_INDICES[key]
+
+
+def _piece_counts(grids, piece, config):
+    # Number of pieces of each player in every window: two (..., n_windows) arrays
+    grids = np.asarray(grids)
+    batch_shape = grids.shape[:-2] if grids.shape[-2:] == (config.rows, config.columns) else grids.shape[:-1]
+    windows = grids.reshape(batch_shape + (-1,))[..., get_window_indices(config)]
+    own = (windows == piece).sum(axis=-1)
+    opp = (windows == piece%2+1).sum(axis=-1)
+    return own, opp
+
+
+def count_windows_batch(grids, num_discs, piece, config):
+    ''' Vectorized count_windows for one grid or a stack of grids
+
+    Parameters:
+    -----------
+    grids : numpy array
+        Grids of shape (..., rows, columns), or flattened boards of shape
+        (..., rows*columns).
+
+    num_discs : int
+        The number of discs to be checked for in a window.
+
+    piece : int
+        The value of the piece to be checked.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    numpy array
+        The number of windows satisfying the condition in every grid.
+    '''
+    own, opp = _piece_counts(grids, piece, config)
+    return ((own == num_discs) & (opp == 0)).sum(axis=-1)
+
+
+def get_heuristic_batch(grids, mark, config):
+    ''' Vectorized get_heuristic for one grid or a stack of grids
+
+    Parameters:
+    -----------
+    grids : numpy array
+        Grids of shape (..., rows, columns), or flattened boards of shape
+        (..., rows*columns).
+
+    mark : int
+        The value of the piece to be evaluated.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    numpy array
+        The heuristic score of every grid.
+    '''
+    own, opp = _piece_counts(grids, mark, config)
+    num_threes = ((own == 3) & (opp == 0)).sum(axis=-1)
+    num_fours = ((own == 4) & (opp == 0)).sum(axis=-1)
+    num_threes_opp = ((opp == 3) & (own == 0)).sum(axis=-1)
+    return num_threes - 1e2*num_threes_opp + 1e6*num_fours
+
+
+def get_heuristic_minimax_batch(grids, mark, config):
+    ''' Vectorized get_heuristic_minimax for one grid or a stack of grids
+
+    Parameters:
+    -----------
+    grids : numpy array
+        Grids of shape (..., rows, columns), or flattened boards of shape
+        (..., rows*columns).
+
+    mark : int
+        The value of the piece to be evaluated.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    numpy array
+        The heuristic score of every grid.
+    '''
+    own, opp = _piece_counts(grids, mark, config)
+    num_threes = ((own == 3) & (opp == 0)).sum(axis=-1)
+    num_fours = ((own == 4) & (opp == 0)).sum(axis=-1)
+    num_threes_opp = ((opp == 3) & (own == 0)).sum(axis=-1)
+    num_fours_opp = ((opp == 4) & (own == 0)).sum(axis=-1)
+    return num_threes - 1e2*num_threes_opp - 1e4*num_fours_opp + 1e6*num_fours
+
+
+def boards_from_masks(masks1, masks2, config):
+    ''' Converts bitboards to a stack of flattened boards in one go
+
+    Parameters:
+    -----------
+    masks1 : list
+        Bitboards of the pieces of player 1, one per board.
+
+    masks2 : list
+        Bitboards of the pieces of player 2, one per board.
+
+    config : dict
+        A dictionary containing the configuration parameters of the game.
+
+    Returns:
+    --------
+    numpy array
+        Boards of shape (len(masks1), rows*columns), laid out as obs.board.
+    '''
+    bits = _cell_bits(config)
+    masks1 = np.array(masks1, dtype=np.uint64)[:, None]
+    masks2 = np.array(masks2, dtype=np.uint64)[:, None]
+    return ((masks1 >> bits) & np.uint64(1)) + 2*((masks2 >> bits) & np.uint64(1))
+
+
+_CELL_BITS = {}
+
+def _cell_bits(config):
+    key = (config.rows, config.columns)
+    if key not in _CELL_BITS:
+        rows, columns = key
+        _CELL_BITS[key] = np.array([c*(rows+1) + rows-1-r for r in range(rows) for c in range(columns)],
+                                   dtype=np.uint64)
+    return _CELL_BITS[key]
+# %%